@@ -1,31 +1,161 @@
-from typing import Generator
-from fastapi import Depends, HTTPException, status
+from ipaddress import IPv4Network, IPv6Network, ip_address, ip_network
+from typing import Generator, List, Tuple, Union
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.core.config import settings
-from app.db.session import get_db
+from app.db.session import get_db, get_async_db
 from app.models.all_models import User
+from app.schemas.all_schemas import OTPSend, OTPVerify
+from app.services.email_service import email_queue
+from app.services.identity import normalize_email, normalize_phone
+from app.services.rate_limiter import Limit, rate_limiter, retry_after
+from app.services.user_cache import UserSnapshot, user_cache
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"{settings.API_V1_STR}/auth/login"
 )
 
-def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
-) -> User:
+ADMIN_SUBJECT = "admin_user"
+
+def decode_token(token: str) -> dict:
     try:
-        payload = jwt.decode(
+        return jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
-        user_id = payload.get("sub")
     except (jwt.JWTError, ValidationError):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials",
         )
+
+def get_token_subject(token: str) -> str:
+    return decode_token(token).get("sub")
+
+def get_current_admin(token: str = Depends(reusable_oauth2)) -> str:
+    """Admin endpoints: the bearer token must be one issued by /api/admin/login."""
+    subject = get_token_subject(token)
+    if subject != ADMIN_SUBJECT:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return subject
+
+def get_current_user(
+    db: Session = Depends(get_db), token: str = Depends(reusable_oauth2)
+) -> User:
+    """
+    The current user as a row attached to the request's session, for endpoints
+    that modify it or walk its relationships. That needs the SELECT, so
+    read-only endpoints use `get_current_user_snapshot` instead.
+    """
+    user_id = get_token_subject(token)
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    user_cache.put(user)
     return user
+
+async def get_current_user_async(
+    db: AsyncSession = Depends(get_async_db), token: str = Depends(reusable_oauth2)
+) -> User:
+    """`get_current_user` for async endpoints."""
+    user_id = get_token_subject(token)
+    user = await db.get(User, int(user_id)) if str(user_id).isdigit() else None
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_cache.put(user)
+    return user
+
+async def get_current_user_snapshot(
+    db: AsyncSession = Depends(get_async_db), token: str = Depends(reusable_oauth2)
+) -> UserSnapshot:
+    """
+    Read-only current user for endpoints that never modify the user row.
+
+    Resolved from token claims when AUTH_EMBED_USER_CLAIMS is on, else from the
+    user cache; the database is only queried on a cache miss.
+    """
+    payload = decode_token(token)
+    user_id = payload.get("sub")
+    if not str(user_id).isdigit():
+        raise HTTPException(status_code=404, detail="User not found")
+    user_id = int(user_id)
+
+    if settings.AUTH_EMBED_USER_CLAIMS and "usr" in payload:
+        return UserSnapshot.from_claims(user_id, payload["usr"])
+
+    snapshot = user_cache.get(user_id)
+    if snapshot:
+        return snapshot
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_cache.put(user)
+
+OTP_SEND_LIMIT = Limit.parse(settings.OTP_SEND_LIMIT)
+OTP_SEND_IP_LIMIT = Limit.parse(settings.OTP_SEND_IP_LIMIT)
+OTP_VERIFY_LIMIT = Limit.parse(settings.OTP_VERIFY_LIMIT)
+OTP_VERIFY_IP_LIMIT = Limit.parse(settings.OTP_VERIFY_IP_LIMIT)
+
+def _parse_networks(spec: str) -> List[Union[IPv4Network, IPv6Network]]:
+    return [ip_network(entry.strip(), strict=False) for entry in spec.split(",") if entry.strip()]
+
+TRUSTED_PROXIES = _parse_networks(settings.TRUSTED_PROXIES)
+
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_ip(request: Request) -> str:
+    """
+    The address rate limits are keyed on. Behind the gateway every connection
+    comes from nginx, so when the peer is a trusted proxy the client is the
+    right-most X-Forwarded-For entry that isn't one of our proxies. Entries
+    further left are set by the client and can't be believed.
+    """
+    peer = request.client.host if request.client else None
+    if not peer or not _is_trusted_proxy(peer):
+        return peer or "unknown"
+    forwarded = [hop.strip() for hop in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return forwarded[0] if forwarded else peer
+
+async def enforce_rate_limit(buckets: List[Tuple[str, Limit]]):
+    wait = await rate_limiter.hit(buckets)
+    if wait:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please try again later",
+            headers={"Retry-After": retry_after(wait)},
+        )
+
+async def otp_send_limit(request: Request, data: OTPSend):
+    """Throttle OTP sends per email, phone and client IP before any DB or SMTP work."""
+    if email_queue.queue.qsize() >= settings.OTP_SHED_EMAIL_BACKLOG:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="OTP service is busy, please try again shortly",
+            headers={"Retry-After": "30"},
+        )
+    buckets = [
+        (f"otp-send:email:{normalize_email(data.email)}", OTP_SEND_LIMIT),
+        (f"otp-send:ip:{client_ip(request)}", OTP_SEND_IP_LIMIT),
+    ]
+    _, phone = normalize_phone(data.phone)
+    if phone:
+        buckets.append((f"otp-send:phone:{phone}", OTP_SEND_LIMIT))
+    await enforce_rate_limit(buckets)
+
+async def otp_verify_limit(request: Request, data: OTPVerify):
+    """Bound OTP guessing per email and per client IP."""
+    await enforce_rate_limit([
+        (f"otp-verify:email:{normalize_email(data.email)}", OTP_VERIFY_LIMIT),
+        (f"otp-verify:ip:{client_ip(request)}", OTP_VERIFY_IP_LIMIT),
+    ])
@@ -1,12 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.db.session import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import get_async_db
 from app.models.all_models import User, Application, Payment, Document, ApplicationCache, ApplicationStatus
 from app.core.security import create_access_token
+from app.core.responses import FastJSONResponse, fast_json
+from app.services.stats_service import stats_service
+from app.services.export_service import resolve_columns, stream_export
+from app.services.search_service import search_service
+from app.services.user_cache import user_cache
+from app.services.response_cache import response_cache
+from app.services.email_service import email_queue
+from app.services.step_service import cache_list_stmt, cache_row, step_buffer
+from app.services.compaction_service import compaction_service
+from app.services.blob_store import blob_service
+from app.services.download_service import document_response
+from app.api.deps import ADMIN_SUBJECT, get_current_admin
+from app.api.pagination import PageSize, decode_cursor, encode_cursor, keyset_before, date_range, set_next_cursor
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import Optional
+from datetime import date, datetime
 
 router = APIRouter()
 
@@ -18,103 +33,339 @@ class AdminLogin(BaseModel):
 async def admin_login(data: AdminLogin):
     if data.email == "admin@vignan.ac.in" and data.password == "admin123":
         # Using a special sub for admin, or we can use a fixed ID like 0 if we want
-        access_token = create_access_token(subject="admin_user")
+        access_token = create_access_token(subject=ADMIN_SUBJECT)
         return {"access_token": access_token, "token_type": "bearer"}
     raise HTTPException(status_code=401, detail="Invalid credentials")
 
 @router.get("/stats")
-async def get_stats(db: Session = Depends(get_db)):
-    registered_students = db.query(User).count()
-    payments_completed = db.query(Payment).filter(Payment.status == "success").count()
-    applications_filled = db.query(Application).filter(Application.status != ApplicationStatus.DRAFT).count()
-    applications_pending = db.query(ApplicationCache).count()
-    
-    # Get registration trend (last 7 days or all)
-    registration_trend = db.query(
-        func.date(User.created_at).label('date'),
-        func.count(User.id).label('count')
-    ).group_by(func.date(User.created_at)).order_by(func.date(User.created_at)).all()
-    
-    trend_data = [{"date": str(r.date), "count": r.count} for r in registration_trend]
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
+    # Served from the incrementally maintained counters, see stats_service
+    return await db.run_sync(stats_service.snapshot)
 
+@router.get("/cache-stats")
+async def get_cache_stats():
+    # Per-worker hit/miss counters of the in-process caches
     return {
-        "registered_students": registered_students,
-        "payments_completed": payments_completed,
-        "applications_filled": applications_filled,
-        "applications_pending": applications_pending,
-        "registration_trend": trend_data
+        "user_cache": user_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "step_buffer": step_buffer.stats(),
+    }
+
+@router.get("/email-queue")
+async def get_email_queue(admin: str = Depends(get_current_admin)):
+    return {
+        "metrics": email_queue.metrics(),
+        "dead_letters": [
+            {"to": job.message["To"], "subject": job.message["Subject"], "attempts": job.attempts, "error": job.last_error}
+            for job in email_queue.dead_letters
+        ]
     }
 
 @router.get("/users")
-async def get_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def get_users(db: AsyncSession = Depends(get_async_db)):
+    users = (await db.execute(select(User))).scalars().all()
     return users
 
-@router.get("/payments")
-async def get_payments(db: Session = Depends(get_db)):
-    payments = db.query(Payment).all()
-    # Include user email for better context
-    result = []
-    for p in payments:
-        user = db.query(User).filter(User.id == p.user_id).first()
-        result.append({
-            "id": p.id,
-            "user_email": user.email if user else "Unknown",
-            "transaction_id": p.transaction_id or "N/A",
-            "amount": float(p.amount) if p.amount is not None else 0.0,
-            "status": str(p.status).lower() if p.status else "pending",
-            "created_at": p.created_at.isoformat() if p.created_at else None
-        })
-    return result
-
-@router.get("/applications-pending")
-async def get_applications_pending(db: Session = Depends(get_db)):
-    pending = db.query(ApplicationCache).all()
-    return pending
-
-@router.get("/applications")
-async def get_applications(db: Session = Depends(get_db)):
-    apps = db.query(Application).all()
-    result = []
-    for app in apps:
-        user = db.query(User).filter(User.id == app.user_id).first()
-        result.append({
-            "id": app.id,
-            "user_email": user.email if user else "Unknown",
-            "campus": app.campus_preference,
-            "department": app.department,
-            "status": app.status,
-            "updated_at": app.updated_at
-        })
-    return result
-
-@router.get("/documents")
-async def get_documents_grouped(db: Session = Depends(get_db)):
-    # Group documents by user email
-    # Use an outer join to see all users with documents, or just query documents and group manually
-    docs = db.query(Document).all()
-    
-    # Simple manual grouping to be 100% sure of data structure
+def _application_filters(status: Optional[ApplicationStatus], campus: Optional[str], department: Optional[str]) -> list:
+    clauses = []
+    if status:
+        clauses.append(Application.status == status)
+    if campus:
+        clauses.append(Application.campus_preference == campus)
+    if department:
+        clauses.append(Application.department == department)
+    return clauses
+
+def _section_filters(
+    category: Optional[str], gender: Optional[str], ug_percentage_min: Optional[float],
+    ug_percentage_max: Optional[float], exam_slot: Optional[str]
+) -> list:
+    # Filters on the generated, B-tree indexed columns extracted from the JSON sections
+    clauses = []
+    if category:
+        clauses.append(Application.category == category)
+    if gender:
+        clauses.append(Application.gender == gender)
+    if ug_percentage_min is not None:
+        clauses.append(Application.ug_percentage >= ug_percentage_min)
+    if ug_percentage_max is not None:
+        clauses.append(Application.ug_percentage <= ug_percentage_max)
+    if exam_slot:
+        clauses.append(Application.exam_slot == exam_slot)
+    return clauses
+
+@router.get("/payments", response_class=FastJSONResponse)
+async def get_payments(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    status: Optional[str] = None,
+    campus: Optional[str] = None,
+    department: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # One joined, column-projected query per page, newest first on (created_at, id)
+    stmt = select(
+        Payment.id, Payment.transaction_id, Payment.amount, Payment.status, Payment.created_at,
+        User.email.label("user_email")
+    ).outerjoin(User, User.id == Payment.user_id)
+
+    if campus or department:
+        stmt = stmt.join(Application, Application.user_id == Payment.user_id)
+        stmt = stmt.where(*_application_filters(None, campus, department))
+    if status:
+        stmt = stmt.where(Payment.status == status.lower())
+    stmt = stmt.where(*date_range(Payment.created_at, date_from, date_to))
+
+    after = decode_cursor(cursor, datetime, int)
+    if after:
+        stmt = stmt.where(keyset_before([Payment.created_at, Payment.id], after))
+
+    stmt = stmt.order_by(Payment.created_at.desc(), Payment.id.desc()).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, encode_cursor(rows[-1].created_at, rows[-1].id))
+
+    return fast_json([{
+        "id": p.id,
+        "user_email": p.user_email or "Unknown",
+        "transaction_id": p.transaction_id or "N/A",
+        "amount": float(p.amount) if p.amount is not None else 0.0,
+        "status": str(p.status).lower() if p.status else "pending",
+        "created_at": p.created_at.isoformat() if p.created_at else None
+    } for p in rows], response)
+
+@router.get("/applications-pending", response_class=FastJSONResponse)
+async def get_applications_pending(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    user_id: Optional[str] = None,
+    updated_from: Optional[date] = None,
+    updated_to: Optional[date] = None,
+    summary: bool = True,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # By default only step names and sizes are returned; summary=false includes the drafts
+    filters = date_range(ApplicationCache.updated_at, updated_from, updated_to)
+    if user_id:
+        filters.append(ApplicationCache.user_id == user_id)
+    after = decode_cursor(cursor, int)
+    stmt = cache_list_stmt(db, summary, filters, after_id=after[0] if after else None, limit=limit + 1)
+
+    rows = (await db.execute(stmt)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, encode_cursor(rows[-1].id))
+    return fast_json([cache_row(row) for row in rows], response)
+
+@router.post("/applications-pending/compact")
+async def compact_applications_pending(admin: str = Depends(get_current_admin)):
+    """Run the step cache compaction now instead of waiting for the scheduled job."""
+    return await run_in_threadpool(compaction_service.compact)
+
+@router.get("/blobs")
+async def get_blob_stats(admin: str = Depends(get_current_admin), db: AsyncSession = Depends(get_async_db)):
+    """Deduplicated document storage: stored vs referenced bytes."""
+    return await db.run_sync(blob_service.stats)
+
+@router.post("/blobs/gc")
+async def collect_blobs(admin: str = Depends(get_current_admin)):
+    """Delete unreferenced document blobs now instead of waiting for the scheduled job."""
+    return await run_in_threadpool(blob_service.gc)
+
+@router.get("/applications", response_class=FastJSONResponse)
+async def get_applications(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    status: Optional[ApplicationStatus] = None,
+    campus: Optional[str] = None,
+    department: Optional[str] = None,
+    category: Optional[str] = None,
+    gender: Optional[str] = None,
+    ug_percentage_min: Optional[float] = None,
+    ug_percentage_max: Optional[float] = None,
+    exam_slot: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    stmt = select(
+        Application.id, Application.campus_preference, Application.department,
+        Application.category, Application.gender, Application.ug_percentage, Application.exam_slot,
+        Application.status, Application.updated_at, User.email.label("user_email")
+    ).outerjoin(User, User.id == Application.user_id)
+
+    stmt = stmt.where(*_application_filters(status, campus, department))
+    stmt = stmt.where(*_section_filters(category, gender, ug_percentage_min, ug_percentage_max, exam_slot))
+    stmt = stmt.where(*date_range(Application.updated_at, date_from, date_to))
+
+    # updated_at moves on every save, so applications page on the immutable id
+    after = decode_cursor(cursor, int)
+    if after:
+        stmt = stmt.where(keyset_before([Application.id], after))
+
+    rows = (await db.execute(stmt.order_by(Application.id.desc()).limit(limit + 1))).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, encode_cursor(rows[-1].id))
+
+    return fast_json([{
+        "id": app.id,
+        "user_email": app.user_email or "Unknown",
+        "campus": app.campus_preference,
+        "department": app.department,
+        "category": app.category,
+        "gender": app.gender,
+        "ug_percentage": app.ug_percentage,
+        "exam_slot": app.exam_slot,
+        "status": app.status,
+        "updated_at": app.updated_at
+    } for app in rows], response)
+
+@router.get("/search", response_class=FastJSONResponse)
+async def search_applicants(
+    response: Response,
+    q: str = Query(..., min_length=2, max_length=100),
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Ranked results can't be keyset-paginated, so the cursor carries the offset
+    # and the index (fts/trgm/like) that produced the first page.
+    offset, mode = decode_cursor(cursor, int, str) or (0, None)
+    rows, mode = await db.run_sync(search_service.search, q, offset, limit + 1, mode)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, encode_cursor(offset + limit, mode))
+
+    return fast_json([{
+        "application_id": r.application_id,
+        "user_id": r.user_id,
+        "full_name": r.full_name,
+        "email": r.email,
+        "phone": r.phone,
+        "campus": r.campus,
+        "department": r.department,
+        "specialization": r.specialization,
+        "status": r.status,
+        "rank": round(float(r.rank), 4) if "rank" in r._fields else None
+    } for r in rows], response)
+
+@router.get("/documents", response_class=FastJSONResponse)
+async def get_documents_grouped(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    document_type: Optional[str] = None,
+    status: Optional[ApplicationStatus] = None,
+    campus: Optional[str] = None,
+    department: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    # Documents are grouped by user, so a page is a window of users (by id, newest first)
+    # and all of their matching documents, fetched together in one joined statement.
+    doc_filters = date_range(Document.uploaded_at, date_from, date_to)
+    if document_type:
+        doc_filters.append(Document.document_type == document_type)
+
+    page_users = select(Document.user_id).where(*doc_filters)
+    if status or campus or department:
+        page_users = page_users.join(Application, Application.user_id == Document.user_id)
+        page_users = page_users.where(*_application_filters(status, campus, department))
+    after = decode_cursor(cursor, int)
+    if after:
+        page_users = page_users.where(keyset_before([Document.user_id], after))
+    page_users = page_users.group_by(Document.user_id).order_by(Document.user_id.desc()).limit(limit + 1).subquery()
+
+    rows = (await db.execute(select(
+        Document.id, Document.user_id, Document.document_type, Document.file_name,
+        Document.file_path, Document.uploaded_at, User.email, User.full_name
+    ).join(User, User.id == Document.user_id).where(
+        Document.user_id.in_(select(page_users.c.user_id)), *doc_filters
+    ).order_by(Document.user_id.desc(), Document.id))).all()
+
     grouped = {}
-    for d in docs:
-        user = db.query(User).filter(User.id == d.user_id).first()
-        if not user:
-            continue
-            
-        email = user.email
-        if email not in grouped:
-            grouped[email] = {
-                "email": email,
-                "full_name": user.full_name,
+    for d in rows:
+        if d.user_id not in grouped:
+            grouped[d.user_id] = {
+                "email": d.email,
+                "full_name": d.full_name,
                 "documents": []
             }
-        
-        grouped[email]["documents"].append({
+        grouped[d.user_id]["documents"].append({
             "id": d.id,
             "document_type": d.document_type,
             "file_name": d.file_name,
             "file_path": d.file_path,
+            "download_url": f"/api/admin/documents/{d.id}/download",
             "uploaded_at": d.uploaded_at.isoformat() if d.uploaded_at else None
         })
-    
-    return list(grouped.values())
+
+    groups = list(grouped.items())
+    if len(groups) > limit:
+        groups = groups[:limit]
+        set_next_cursor(response, encode_cursor(groups[-1][0]))
+
+    return fast_json([group for _, group in groups], response)
+
+@router.get("/documents/{document_id}/download")
+async def download_document(
+    document_id: int,
+    request: Request,
+    inline: bool = False,
+    admin: str = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Any applicant's document: streamed with Range / conditional GET support, or redirected to S3."""
+    doc = await db.get(Document, document_id)
+    response = await document_response(doc, request, inline) if doc else None
+    if response is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return response
+
+@router.get("/export")
+async def export_applications(
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    columns: Optional[str] = None,
+    gzip: bool = False,
+    status: Optional[ApplicationStatus] = None,
+    campus: Optional[str] = None,
+    department: Optional[str] = None,
+    category: Optional[str] = None,
+    gender: Optional[str] = None,
+    ug_percentage_min: Optional[float] = None,
+    ug_percentage_max: Optional[float] = None,
+    exam_slot: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    admin: str = Depends(get_current_admin),
+):
+    # Streams applications with user, latest payment and documents. Rows are
+    # produced batch by batch from a server-side cursor, never as one big list.
+    try:
+        selected = resolve_columns(columns)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = _application_filters(status, campus, department)
+    filters += _section_filters(category, gender, ug_percentage_min, ug_percentage_max, exam_slot)
+    filters += date_range(Application.updated_at, date_from, date_to)
+
+    filename = f"applications_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{fmt}"
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        stream_export(fmt, selected, filters, compress=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -1,24 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, UploadFile, File, status
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.db.session import get_db
-from app.models.all_models import User, Application, Document, ApplicationStatus, Message
-from app.schemas.all_schemas import ApplicationUpdate, ApplicationView, MessageView, DocumentView
-from app.api.deps import get_current_user
+from app.db.session import get_db, get_async_db
+from app.models.all_models import User, Application, Document, ApplicationStatus, Message, ResumableUpload
+from app.schemas.all_schemas import (
+    ApplicationUpdate, ApplicationView, MessageView, DocumentView, DocumentUploadRequest, DocumentUploadComplete,
+    DocumentReuse, ResumableUploadCreate
+)
+from app.api.deps import get_current_user, get_current_user_snapshot
 from app.core.config import settings
+from app.services.stats_service import stats_service, SUBMITTED
+from app.services.search_service import refresh_search_document
+from app.services.user_cache import UserSnapshot, user_cache
+from app.services.response_cache import find_version, response_cache
+from app.services.upload_service import MIME_TYPES, UploadRejected, canonical_extension, ingest_upload
+from app.services.document_service import record_document, user_upload_prefix
+from app.services.s3_service import s3_service
+from app.services.blob_store import BACKENDS, blob_service
+from app.services.resumable_upload import resumable_uploads
+from app.services.download_service import document_response
+from starlette.concurrency import run_in_threadpool
+import base64
+import binascii
+from email.utils import format_datetime
 import os
-import shutil
-from typing import List, Any
-from datetime import datetime
+import uuid
+from typing import List, Any, Optional
+from datetime import datetime, timezone
 
 router = APIRouter()
 
+ALLOWED_EXTENSIONS = ["pdf", "jpg", "jpeg", "png"]
+
 @router.get("/me", response_model=ApplicationView)
 def get_my_application(
-    current_user: User = Depends(get_current_user)
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
 ):
-    if not current_user.application:
+    version = find_version(db, User.id == current_user.id)
+    if not version or version.application_id is None:
         raise HTTPException(status_code=404, detail="Application profile not found")
-    return current_user.application
+    return response_cache.respond("me", version, if_none_match, lambda: ApplicationView.model_validate(
+        db.query(Application).filter(Application.id == version.application_id).one()
+    ))
 
 @router.put("/update", response_model=ApplicationView)
 def update_application_data(
@@ -33,8 +59,10 @@ def update_application_data(
     # Update fields if provided
     for field, value in data.model_dump(exclude_unset=True).items():
         setattr(app, field, value)
+    refresh_search_document(app, current_user)
             
     db.commit()
+    response_cache.invalidate(current_user.id)
     db.refresh(app)
     return app
 
@@ -53,16 +81,20 @@ def submit_application(
         # Here we'll require payment or at least mark it as payment pending
         pass
         
+    if app.status == ApplicationStatus.DRAFT:
+        stats_service.increment(db, SUBMITTED)
     app.status = ApplicationStatus.SUBMITTED
     app.submission_date = datetime.utcnow()
     current_user.application_status = "completed"
     
     db.commit()
+    user_cache.invalidate(current_user.id)
+    response_cache.invalidate(current_user.id)
     return {"message": "Application submitted successfully", "status": app.status}
 
 @router.get("/documents", response_model=List[DocumentView])
 def get_user_documents(
-    current_user: User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
     db: Session = Depends(get_db)
 ):
     return db.query(Document).filter(Document.user_id == current_user.id).all()
@@ -71,71 +103,264 @@ def get_user_documents(
 async def upload_student_document(
     document_type: str,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Security: limit file types
     ext = file.filename.split(".")[-1].lower()
-    if ext not in ["pdf", "jpg", "jpeg", "png"]:
+    if ext not in ALLOWED_EXTENSIONS:
         raise HTTPException(status_code=400, detail="Unsupported file format")
 
-    # Create storage path
-    user_storage = os.path.join(settings.UPLOAD_DIR, str(current_user.id))
-    os.makedirs(user_storage, exist_ok=True)
-    
-    # Unique file name to prevent caching/overwriting issues
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    safe_name = f"{document_type}_{timestamp}.{ext}"
-    dest_path = os.path.join(user_storage, safe_name)
-    
-    # Save file
-    file_size = 0
-    with open(dest_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        file_size = os.path.getsize(dest_path)
-        
-    # Check Max Size
-    if file_size > 5 * 1024 * 1024: # 5MB
-        os.remove(dest_path)
-        raise HTTPException(status_code=400, detail="File too large (Max 5MB)")
-
-    # Update metadata in DB
-    db_doc = db.query(Document).filter(
-        Document.user_id == current_user.id, 
-        Document.document_type == document_type
-    ).first()
-    
-    if db_doc:
-        # Remove old file if exists
-        try:
-            if os.path.exists(db_doc.file_path):
-                os.remove(db_doc.file_path)
-        except:
-            pass
-        db_doc.file_name = file.filename
-        db_doc.file_path = dest_path
-        db_doc.file_size = file_size
-        db_doc.mime_type = file.content_type
-        db_doc.uploaded_at = datetime.utcnow()
-    else:
-        db_doc = Document(
-            user_id=current_user.id,
-            document_type=document_type,
-            file_name=file.filename,
-            file_path=dest_path,
-            file_size=file_size,
-            mime_type=file.content_type
+    # Stream to a staging file: size cap, type sniffing and hashing happen while
+    # reading, and the file only appears once it is complete and valid
+    dest_path = os.path.join(BACKENDS["local"].staging_dir, f"{uuid.uuid4().hex}.{ext}")
+    try:
+        stored = await ingest_upload(file, dest_path, ALLOWED_EXTENSIONS)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    # Then into the content-addressed store, where identical bytes are kept once
+    location = await blob_service.store(db, "local", stored.sha256, stored.path, stored.size, stored.mime_type)
+
+    # One upsert on (user_id, document_type), so concurrent uploads of the same type can't collide
+    return await record_document(
+        db, current_user.id, document_type, file.filename, location, stored.size, stored.mime_type, stored.sha256
+    )
+
+@router.post("/documents/reuse", response_model=DocumentView)
+async def reuse_document(
+    data: DocumentReuse,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Record a file this user already uploaded (under any document type) as the
+    document of `document_type`, by its SHA-256, without sending it again.
+    404 means the content isn't stored for this user and must be uploaded.
+    """
+    blob = await db.run_sync(blob_service.find_reusable, current_user.id, data.sha256)
+    if blob is None or not await blob_service.reuse(db, blob.backend, blob.sha256):
+        raise HTTPException(status_code=404, detail="No stored file with this content")
+    return await record_document(
+        db, current_user.id, data.document_type, data.file_name, blob.location, blob.size, blob.mime_type, blob.sha256
+    )
+
+# --- Resumable uploads (tus-style): create, PATCH chunks at the current offset, complete ---
+
+TUS_HEADERS = {"Tus-Resumable": "1.0.0", "Cache-Control": "no-store"}
+
+def _upload_headers(upload: ResumableUpload) -> dict:
+    return {
+        **TUS_HEADERS,
+        "Upload-Offset": str(upload.received),
+        "Upload-Length": str(upload.length),
+        "Upload-Expires": format_datetime(upload.expires_at.replace(tzinfo=timezone.utc), usegmt=True),
+    }
+
+@router.post("/uploads", status_code=201)
+async def create_resumable_upload(
+    data: ResumableUploadCreate,
+    request: Request,
+    response: Response,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot)
+):
+    """
+    Start a resumable upload of `size` bytes. Send the bytes with PATCH to the
+    returned URL (Upload-Offset header, Content-Type application/offset+octet-stream)
+    in as many requests as needed; after a dropped connection, HEAD the URL
+    for the offset to resume from. Finish with POST <url>/complete.
+    """
+    try:
+        upload = await run_in_threadpool(
+            resumable_uploads.create, current_user.id, data.document_type, data.file_name, data.size
         )
-        db.add(db_doc)
-        
-    db.commit()
-    db.refresh(db_doc)
-    
-    return db_doc
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    url = str(request.url_for("get_resumable_upload_offset", upload_id=upload.id))
+    response.headers.update({**_upload_headers(upload), "Location": url})
+    return {"id": upload.id, "url": url, "offset": upload.received, "length": upload.length, "expires_at": upload.expires_at}
+
+@router.head("/uploads/{upload_id}")
+def get_resumable_upload_offset(
+    upload_id: str,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot)
+):
+    try:
+        upload = resumable_uploads.get(upload_id, current_user.id)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=200, headers=_upload_headers(upload))
+
+@router.patch("/uploads/{upload_id}", status_code=204)
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., ge=0),
+    content_type: Optional[str] = Header(None),
+    current_user: UserSnapshot = Depends(get_current_user_snapshot)
+):
+    """Append the request body at Upload-Offset; 409 if that isn't the current offset."""
+    if content_type != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream")
+    try:
+        offset = await resumable_uploads.append(upload_id, current_user.id, upload_offset, request.stream())
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=204, headers={**TUS_HEADERS, "Upload-Offset": str(offset)})
+
+@router.post("/uploads/{upload_id}/complete", response_model=DocumentView)
+async def complete_resumable_upload(
+    upload_id: str,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Turn a fully received upload into the user's document of its type."""
+    try:
+        upload = await run_in_threadpool(resumable_uploads.claim, upload_id, current_user.id)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        stored = await run_in_threadpool(resumable_uploads.assemble, upload)
+        if upload.storage == "s3":
+            location = s3_service.object_url(stored.path)
+        else:
+            location = await blob_service.store(db, "local", stored.sha256, stored.path, stored.size, stored.mime_type)
+        await db.execute(delete(ResumableUpload).where(ResumableUpload.id == upload.id))
+        return await record_document(
+            db, current_user.id, upload.document_type, upload.file_name,
+            location, stored.size, stored.mime_type, stored.sha256
+        )
+    except BaseException as e:
+        await db.rollback()
+        await run_in_threadpool(resumable_uploads.release, upload.id)
+        if isinstance(e, UploadRejected):
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        raise
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+def terminate_resumable_upload(
+    upload_id: str,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot)
+):
+    try:
+        resumable_uploads.terminate(upload_id, current_user.id)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return Response(status_code=204, headers=TUS_HEADERS)
+
+# --- Direct-to-S3 uploads: the API signs, the browser sends the bytes to the bucket ---
+
+def _require_s3():
+    if not s3_service.configured:
+        raise HTTPException(status_code=503, detail="Cloud storage (S3) is not configured")
+
+def _upload_prefix(user_id: int, document_type: str) -> str:
+    return f"{user_upload_prefix(user_id)}{document_type}_"
+
+@router.post("/documents/presign")
+def presign_document_upload(
+    data: DocumentUploadRequest,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot)
+):
+    """
+    Presigned POST (form fields) or PUT URL for uploading one document straight
+    to S3. Type and size are enforced by S3 through the signed conditions; call
+    /documents/complete with the returned key afterwards.
+
+    With `sha256` the upload is always a PUT whose checksum S3 verifies, and the
+    object is deduplicated on completion (try /documents/reuse first).
+    """
+    _require_s3()
+    ext = canonical_extension(data.file_name)
+    if ext not in MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file format")
+    content_type = MIME_TYPES[ext]
+    if data.content_type != content_type:
+        raise HTTPException(status_code=400, detail=f"Content type must be {content_type} for .{ext} files")
+    if data.size > settings.UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File too large (Max {settings.UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+
+    key = f"{_upload_prefix(current_user.id, data.document_type)}{uuid.uuid4().hex}.{ext}"
+    expires = settings.S3_UPLOAD_URL_EXPIRES_SECONDS
+    if data.method == "put" or data.sha256:
+        headers = {"Content-Type": content_type, "Content-Length": str(data.size)}
+        checksum = base64.b64encode(bytes.fromhex(data.sha256)).decode() if data.sha256 else None
+        if checksum:
+            headers["x-amz-checksum-sha256"] = checksum
+        return {
+            "method": "PUT",
+            "url": s3_service.presigned_put(key, content_type, data.size, expires, checksum),
+            "headers": headers,
+            "key": key,
+            "expires_in": expires,
+        }
+    post = s3_service.presigned_post(key, content_type, settings.UPLOAD_MAX_BYTES, expires)
+    return {"method": "POST", "url": post["url"], "fields": post["fields"], "key": key, "expires_in": expires}
+
+@router.post("/documents/complete", response_model=DocumentView)
+async def complete_document_upload(
+    data: DocumentUploadComplete,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Verify an uploaded object with a HEAD and record it as the user's document of that type."""
+    _require_s3()
+    prefix = _upload_prefix(current_user.id, data.document_type)
+    if not data.key.startswith(prefix) or "/" in data.key[len(prefix):]:
+        raise HTTPException(status_code=400, detail="Upload key does not belong to this document")
+
+    head = await run_in_threadpool(s3_service.head, data.key, True)
+    if head is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    size = head.get("ContentLength") or 0
+    mime_type = head.get("ContentType")
+    if not 0 < size <= settings.UPLOAD_MAX_BYTES or mime_type != MIME_TYPES.get(canonical_extension(data.key)):
+        await run_in_threadpool(s3_service.delete, data.key)
+        raise HTTPException(status_code=400, detail="Uploaded object failed verification")
+
+    # Objects uploaded with a (single-part) SHA-256 checksum move into the blob store
+    digest = _checksum_hex(head.get("ChecksumSHA256"))
+    if digest:
+        location = await blob_service.adopt_s3(db, data.key, digest, size, mime_type)
+    else:
+        location = s3_service.object_url(data.key)
+
+    return await record_document(
+        db, current_user.id, data.document_type, data.file_name, location, size, mime_type, digest
+    )
+
+def _checksum_hex(checksum: Optional[str]) -> Optional[str]:
+    # Multipart checksums ("...-3") are of the part checksums, not of the file
+    if not checksum or "-" in checksum:
+        return None
+    try:
+        raw = base64.b64decode(checksum, validate=True)
+    except binascii.Error:
+        return None
+    return raw.hex() if len(raw) == 32 else None
+
+@router.get("/documents/{document_id}/download")
+async def download_document(
+    document_id: int,
+    request: Request,
+    inline: bool = False,
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    S3 documents redirect to a short-lived presigned GET; local ones are
+    streamed from disk with Range, ETag / Last-Modified and 304 support.
+    """
+    doc = await db.get(Document, document_id)
+    if not doc or doc.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Document not found")
+    response = await document_response(doc, request, inline)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Document file not found")
+    return response
 
 @router.get("/messages", response_model=List[MessageView])
 def get_user_messages(
-    current_user: User = Depends(get_current_user),
+    current_user: UserSnapshot = Depends(get_current_user_snapshot),
     db: Session = Depends(get_db)
 ):
     return db.query(Message).filter(Message.user_id == current_user.id).order_by(Message.created_at.desc()).all()
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException
+from sqlalchemy.orm import Session, joinedload
 from app.db.session import get_db
-from app.models.all_models import User, Application, ApplicationStatus
+from app.models.all_models import User, Application, ApplicationCache, ApplicationStatus, Document
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 from datetime import datetime
+from app.services.stats_service import stats_service, SUBMITTED, PENDING
+from app.services.search_service import refresh_search_document
+from app.services.identity import find_user, normalize_phone
+from app.services.user_cache import user_cache
+from app.services.response_cache import response_cache
+from app.services.step_service import step_buffer
+from app.services.document_service import is_user_file, upsert_documents
+from app.services.idempotency import idempotency_service
 
 router = APIRouter()
 
@@ -20,23 +28,18 @@ class ApplicationSubmitPayload(BaseModel):
     examSchedule: Optional[Dict[str, Any]] = None
 
 @router.post("/submit")
-def submit_new_application(
+async def submit_new_application(
     payload: ApplicationSubmitPayload,
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
-    query = db.query(User)
-    user = None
-    if payload.email:
-        user = query.filter(User.email == payload.email).first()
-    
-    if not user and payload.phone:
-        # Robust phone matching: try direct and then partial match
-        clean_phone = "".join(filter(str.isdigit, payload.phone))
-        if len(clean_phone) >= 10:
-            last_10 = clean_phone[-10:]
-            user = query.filter(User.phone.like(f"%{last_10}")).first()
-        else:
-            user = query.filter(User.phone == payload.phone).first()
+    # Retries carrying the same Idempotency-Key get the first response replayed
+    return await idempotency_service.run(
+        "application-submit", idempotency_key, payload, lambda: _submit_application(payload, db)
+    )
+
+def _submit_application(payload: ApplicationSubmitPayload, db: Session):
+    user = find_user(db, payload.email, payload.phone, joinedload(User.application))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found for submission")
@@ -48,10 +51,8 @@ def submit_new_application(
 
     app = user.application
     if not app:
-        app = Application(user_id=user.id)
+        app = Application(user_id=user.id, status=ApplicationStatus.DRAFT)
         db.add(app)
-        db.commit()
-        db.refresh(app)
         
     # 1. Update Core Application Searchable Fields
     # These might come from the 'personal' object or represent changed preferences
@@ -76,29 +77,31 @@ def submit_new_application(
     # Store document metadata and exam schedule
     app.experience_details = {"documents": payload.documents}
     app.research_details = {"examSchedule": payload.examSchedule}
+    refresh_search_document(app, user)
     
     # 3. Handle Document Table Sync
     # If document metadata contains file paths, ensure they are reflected if possible
     # (Note: Files are uploaded separately, but we can verify links here)
     if payload.documents and "files" in payload.documents:
-        from app.models.all_models import Document
-        for doc_type, file_info in payload.documents["files"].items():
-            if isinstance(file_info, dict) and file_info.get("path"):
-                existing_doc = db.query(Document).filter(
-                    Document.user_id == user.id, 
-                    Document.document_type == doc_type
-                ).first()
-                if not existing_doc:
-                    new_doc = Document(
-                        user_id=user.id,
-                        document_type=doc_type,
-                        file_name=file_info.get("name", "uploaded_file"),
-                        file_path=file_info.get("path"),
-                        mime_type=file_info.get("type", "application/octet-stream")
-                    )
-                    db.add(new_doc)
+        # Paths come from the client: only the user's own uploads are recorded
+        known = {path for (path,) in db.query(Document.file_path).filter(Document.user_id == user.id)}
+        # One INSERT for all types; types that already have a row keep it
+        upsert_documents(db, [
+            {
+                "user_id": user.id,
+                "document_type": doc_type,
+                "file_name": file_info.get("name", "uploaded_file"),
+                "file_path": file_info["path"],
+                "mime_type": file_info.get("type", "application/octet-stream"),
+            }
+            for doc_type, file_info in payload.documents["files"].items()
+            if isinstance(file_info, dict) and isinstance(file_info.get("path"), str)
+            and (file_info["path"] in known or is_user_file(user.id, file_info["path"]))
+        ])
 
     # 4. Status and Housekeeping
+    if app.status == ApplicationStatus.DRAFT:
+        stats_service.increment(db, SUBMITTED)
     app.status = ApplicationStatus.SUBMITTED
     app.submission_date = datetime.utcnow()
     app.current_step = 5 # Final step
@@ -110,26 +113,38 @@ def submit_new_application(
     for field in ["personal_details", "academic_details", "experience_details", "research_details"]:
         flag_modified(app, field)
     
-    db.commit()
-
-    # 5. Clear Application Cache
+    # 5. Clear Application Cache, in the same transaction as the submission.
+    # Buffered drafts are taken out first, so a flush can't re-create the rows,
+    # and only dropped for good once the submission commits.
+    last_10 = normalize_phone(payload.phone)[1] or payload.phone
+    dropped = step_buffer.discard(
+        session_ids=[f"pending-{last_10}", f"pending-{payload.email}"],
+        user_ids=[last_10, payload.phone],
+    )
     try:
-        from app.models.all_models import ApplicationCache
         # Clear cache by session_id (pending-phone or pending-email)
-        clean_phone = "".join(filter(str.isdigit, payload.phone))
-        last_10 = clean_phone[-10:] if len(clean_phone) >= 10 else clean_phone
-        
-        db.query(ApplicationCache).filter(
-            (ApplicationCache.session_id == f"pending-{last_10}") |
-            (ApplicationCache.session_id == f"pending-{payload.email}") |
-            (ApplicationCache.user_id == last_10) |
-            (ApplicationCache.user_id == payload.phone)
-        ).delete(synchronize_session=False)
-        db.commit()
+        with db.begin_nested():
+            cleared = db.query(ApplicationCache).filter(
+                (ApplicationCache.session_id == f"pending-{last_10}") |
+                (ApplicationCache.session_id == f"pending-{payload.email}") |
+                (ApplicationCache.user_id == last_10) |
+                (ApplicationCache.user_id == payload.phone)
+            ).delete(synchronize_session=False)
+            stats_service.increment(db, PENDING, -cleared)
     except Exception as e:
         print(f"Failed to clear cache: {e}")
         # Don't fail the whole submission if cache clearing fails
-    
+        step_buffer.restore(dropped)
+        dropped = []
+
+    try:
+        db.commit()
+    except Exception:
+        step_buffer.restore(dropped)
+        raise
+    user_cache.invalidate(user.id)
+    response_cache.invalidate(user.id)
+
     return {
         "message": "Application submitted successfully", 
         "status": app.status,
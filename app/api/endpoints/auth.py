@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Query, UploadFile, File, Request
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from app.db.session import get_db
-from app.models.all_models import User, Application, Document, Payment, ApplicationStatus
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.db.session import get_db, get_async_db
+from app.models.all_models import User, Application, Payment, ApplicationStatus
 from app.schemas.all_schemas import UserRegister, OTPSend, OTPVerify, Token, UserView, ApplicationUpdate, PasswordChange
 from pydantic import BaseModel
 from app.services.otp_service import otp_service
+from app.services.identity import find_user_async, identity_criteria
+from app.services.user_cache import user_cache, user_claims
+from app.services.stats_service import stats_service
+from app.services.search_service import refresh_search_document
+from app.services.document_service import record_document
+from app.services.response_cache import find_version, response_cache
+from app.services.blob_store import BACKENDS, blob_service
+from app.services.upload_service import UploadRejected, ingest_upload, remove_file
 from app.core.security import create_access_token
-from app.api.deps import get_current_user
+from app.api.deps import get_current_user_async, otp_send_limit, otp_verify_limit
 from app.core.config import settings
 from typing import Any, Optional, List
 import os
@@ -20,62 +31,51 @@ router = APIRouter()
 
 # --- OTP ---
 
-@router.post("/otp/send")
-async def send_otp(data: OTPSend, db: Session = Depends(get_db)):
-    await otp_service.create_otp(db, email=data.email, phone=data.phone, purpose=data.purpose)
+@router.post("/otp/send", dependencies=[Depends(otp_send_limit)])
+async def send_otp(data: OTPSend):
+    await otp_service.create_otp(email=data.email, phone=data.phone, purpose=data.purpose)
     return {"message": "OTP sent"}
 
-@router.post("/otp/verify")
-async def verify_otp(data: OTPVerify, db: Session = Depends(get_db)):
+@router.post("/otp/verify", dependencies=[Depends(otp_verify_limit)])
+async def verify_otp(data: OTPVerify, db: AsyncSession = Depends(get_async_db)):
     print(f"Verifying OTP for {data.email}: {data.code}")
-    if not otp_service.verify_otp(db, code=data.code, email=data.email):
+    if not await otp_service.verify_otp(code=data.code, email=data.email):
         print(f"Verification failed for {data.email}")
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
     print(f"Verification success for {data.email}")
-    user = db.query(User).filter(User.email == data.email).first()
+    user = await find_user_async(db, email=data.email)
 
     if user:
-        access_token = create_access_token(user.id)
+        claims = user_claims(user) if settings.AUTH_EMBED_USER_CLAIMS else None
+        access_token = create_access_token(user.id, claims=claims)
         return {"access_token": access_token, "user": user, "success": True}
     return {"success": True}
 
 # --- REGISTRATION ---
 
 @router.post("/student/register", response_model=UserView)
-async def register(user_in: UserRegister, db: Session = Depends(get_db)):
-    if db.query(User).filter(User.email == user_in.email).first():
+async def register(user_in: UserRegister, db: AsyncSession = Depends(get_async_db)):
+    if await find_user_async(db, email=user_in.email):
         raise HTTPException(status_code=400, detail="Already registered")
     
     user = User(full_name=user_in.full_name, email=user_in.email, phone=user_in.phone, registration_status="completed")
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.flush()
     
     app = Application(user_id=user.id, campus_preference=user_in.campus, department=user_in.program, specialization=user_in.specialization)
     db.add(app)
-    db.commit()
+    refresh_search_document(app, user)
+    await db.run_sync(stats_service.record_registration)
+    await db.commit()
+    await db.refresh(user)
+    user_cache.invalidate(user.id)
     return user
 
-@router.get("/register/details/")
-def details(email: Optional[str] = None, phone: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(User)
-    user = None
-    
-    if email:
-        user = query.filter(User.email == email).first()
-    elif phone:
-        # Robust phone matching: try direct and then partial match
-        clean_phone = "".join(filter(str.isdigit, phone))
-        if len(clean_phone) >= 10:
-            last_10 = clean_phone[-10:]
-            user = query.filter(User.phone.like(f"%{last_10}")).first()
-        else:
-            user = query.filter(User.phone == phone).first()
-            
-    if not user: 
-        raise HTTPException(status_code=404, detail="User not found")
-        
+def _load_user(db: Session, user_id: int) -> User:
+    return db.query(User).options(joinedload(User.application)).filter(User.id == user_id).one()
+
+def _details_body(user: User) -> dict:
     return {
         "user": {
             "name": user.full_name, 
@@ -87,8 +87,21 @@ def details(email: Optional[str] = None, phone: Optional[str] = None, db: Sessio
         }
     }
 
+@router.get("/register/details/")
+def details(
+    email: Optional[str] = None, phone: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    version = find_version(db, *identity_criteria(email, phone))
+    if not version:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return response_cache.respond(
+        "register-details", version, if_none_match, lambda: _details_body(_load_user(db, version.user_id))
+    )
+
 @router.post("/student/change-password")
-async def change_password(data: PasswordChange, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def change_password(data: PasswordChange, db: AsyncSession = Depends(get_async_db), current_user: User = Depends(get_current_user_async)):
     if current_user.hashed_password:
         # If user has a password, they must provide the correct old one
         # For simplicity in this demo, we use plantext comparison or a simple hash
@@ -97,7 +110,8 @@ async def change_password(data: PasswordChange, db: Session = Depends(get_db), c
             raise HTTPException(status_code=400, detail="Incorrect old password")
     
     current_user.hashed_password = data.new_password
-    db.commit()
+    await db.commit()
+    user_cache.invalidate(current_user.id)
     return {"message": "Password updated successfully"}
 
 # --- PAYMENTS ---
@@ -124,9 +138,9 @@ def validate_coupon(data: dict):
 # --- DOCUMENTS ---
 
 @router.post("/upload_single_document")
-async def upload(file_key: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload(file_key: str, file: UploadFile = File(...), db: AsyncSession = Depends(get_async_db)):
     # In a real app, use get_current_user. For now, matching existing logic of last user.
-    user = db.query(User).order_by(User.id.desc()).first()
+    user = (await db.execute(select(User).order_by(User.id.desc()).limit(1))).scalars().first()
     if not user: raise HTTPException(status_code=404, detail="User not found")
     
     # Check if S3 is configured
@@ -136,51 +150,32 @@ async def upload(file_key: str, file: UploadFile = File(...), db: Session = Depe
             detail="Cloud storage (S3) is not configured. Please check environment variables."
         )
 
-    from app.services.s3_service import s3_service
-    
-    # Prepare unique object name for S3
+    # Stream to a staging file (size cap and hashing on the way), then store it
+    # in S3 under its SHA-256 unless identical bytes are already there. New
+    # clients should upload directly via /student/internal/documents/presign instead.
     ext = os.path.splitext(file.filename)[1]
-    object_name = f"documents/{user.id}/{file_key}_{uuid.uuid4().hex}{ext}"
-    
-    # Upload to S3
-    file_url = s3_service.upload_file(file.file, object_name)
-    
-    if not file_url:
+    dest_path = os.path.join(BACKENDS["local"].staging_dir, f"{uuid.uuid4().hex}{ext}")
+    try:
+        stored = await ingest_upload(file, dest_path, None)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        file_url = await blob_service.store(db, "s3", stored.sha256, stored.path, stored.size, stored.mime_type)
+    except Exception as e:
+        await run_in_threadpool(remove_file, stored.path)
+        print(f"S3 Upload Error: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload file to S3")
     
-    # Save the S3 URL in the database
-    doc = Document(
-        user_id=user.id, 
-        document_type=file_key, 
-        file_name=file.filename, 
-        file_path=file_url
+    # Save the S3 URL in the database, replacing (and removing) an earlier upload of the same type
+    doc = await record_document(
+        db, user.id, file_key, file.filename, file_url, stored.size, stored.mime_type, stored.sha256
     )
-    db.add(doc)
-    db.commit()
-    
+
     return {"id": doc.id, "url": file_url}
 
 # --- APPLICATIONS ---
 
-@router.get("/applications/")
-def get_apps(email: Optional[str] = None, phone: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(User)
-    user = None
-    
-    if email:
-        user = query.filter(User.email == email).first()
-    elif phone:
-        # Robust phone matching
-        clean_phone = "".join(filter(str.isdigit, phone))
-        if len(clean_phone) >= 10:
-            last_10 = clean_phone[-10:]
-            user = query.filter(User.phone.like(f"%{last_10}")).first()
-        else:
-            user = query.filter(User.phone == phone).first()
-
-    if not user: 
-        raise HTTPException(status_code=404, detail="User not found")
-    
+def _applications_body(user: User) -> dict:
     app = user.application
     if not app:
         return {
@@ -214,6 +209,20 @@ def get_apps(email: Optional[str] = None, phone: Optional[str] = None, db: Sessi
         "examSchedule": app.research_details.get("examSchedule", {})
     }
 
+@router.get("/applications/")
+def get_apps(
+    email: Optional[str] = None, phone: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    # Revalidation only reads the version; the application is loaded on a cache miss
+    version = find_version(db, *identity_criteria(email, phone))
+    if not version:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return response_cache.respond(
+        "applications", version, if_none_match, lambda: _applications_body(_load_user(db, version.user_id))
+    )
+
 class PhaseData(BaseModel):
     email: Optional[str] = None
     phone: Optional[str] = None
@@ -224,20 +233,22 @@ def record_phase(data: PhaseData, db: Session = Depends(get_db)):
     # Best effort phase logging based on frontend design
     return {"status": "success"}
 
-@router.get("/student/payment-status/")
-def get_payment_status(email: Optional[str] = None, phone: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(User)
-    if email:
-        user = query.filter(User.email == email).first()
-    elif phone:
-        user = query.filter(User.phone == phone).first()
-    else:
-        user = None
-
-    if not user:
-        return {"hasCompletedPayment": False}
-
-    payment = db.query(Payment).filter(Payment.user_id == user.id, Payment.status == "success").order_by(Payment.id.desc()).first()
+def _payment_status_body(db: Session, user_id: int) -> dict:
+    payment = db.query(Payment).filter(Payment.user_id == user_id, Payment.status == "success").order_by(Payment.id.desc()).first()
     if payment:
         return {"hasCompletedPayment": True, "transactionId": payment.transaction_id}
     return {"hasCompletedPayment": False}
+
+@router.get("/student/payment-status/")
+def get_payment_status(
+    email: Optional[str] = None, phone: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    version = find_version(db, *identity_criteria(email, phone))
+
+    if not version:
+        return {"hasCompletedPayment": False}
+
+    return response_cache.respond(
+        "payment-status", version, if_none_match, lambda: _payment_status_body(db, version.user_id)
+    )
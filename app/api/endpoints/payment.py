@@ -1,25 +1,38 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, Query
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from app.db.session import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from app.db.session import get_db, get_async_db
 from app.models.all_models import User, Payment
 from app.schemas.all_schemas import PaymentInit
 from app.api.deps import get_current_user
 from app.core.config import settings
+from app.services.stats_service import stats_service, PAID
+from app.services.identity import find_user
+from app.services.user_cache import user_cache
+from app.services.response_cache import response_cache
+from app.services.idempotency import idempotency_service
 import hashlib
 import uuid
+from typing import Optional
 
 router = APIRouter()
 
 @router.post("/init")
-def initiate_payu(
+async def initiate_payu(
     data: PaymentInit, 
+    idempotency_key: Optional[str] = Header(None),
     db: Session = Depends(get_db)
 ):
+    # A retried init returns the same txnid instead of minting another Payment
+    return await idempotency_service.run("payu-init", idempotency_key, data, lambda: _initiate_payu(data, db))
+
+def _initiate_payu(data: PaymentInit, db: Session):
     # Try to find user by email first, then fallback to last user
     user = None
     if data.email:
-        user = db.query(User).filter(User.email == data.email).first()
+        user = find_user(db, email=data.email)
     
     if not user:
         user = db.query(User).order_by(User.id.desc()).first()
@@ -89,8 +102,14 @@ def validate_coupon(data: dict):
         return {"valid": True, "discount": valid_coupons[code]}
     return {"valid": False, "message": "Invalid coupon"}
 
+async def _payment_with_user(db: AsyncSession, txnid: str) -> Optional[Payment]:
+    result = await db.execute(
+        select(Payment).options(joinedload(Payment.user)).where(Payment.transaction_id == txnid)
+    )
+    return result.scalars().first()
+
 @router.post("/success")
-async def success(request: Request, db: Session = Depends(get_db)):
+async def success(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         form = await request.form()
         form_data = dict(form)
@@ -99,8 +118,10 @@ async def success(request: Request, db: Session = Depends(get_db)):
         txnid = form_data.get("txnid")
         status = form_data.get("status")
         
-        payment = db.query(Payment).filter(Payment.transaction_id == txnid).first()
+        payment = await _payment_with_user(db, txnid)
         if payment:
+            if payment.status != "success":
+                await db.run_sync(stats_service.increment, PAID)
             payment.status = "success"
             payment.payu_id = form_data.get("mihpayid")
             payment.payment_mode = form_data.get("mode")
@@ -111,7 +132,9 @@ async def success(request: Request, db: Session = Depends(get_db)):
                 user.payment_status = "success"
                 user.application_status = "current"
                 
-            db.commit()
+            await db.commit()
+            user_cache.invalidate(payment.user_id)
+            response_cache.invalidate(payment.user_id)
             print(f"Payment {txnid} marked as SUCCESS for user {user.email if user else 'unknown'}")
         else:
             print(f"Payment record not found for txnid: {txnid}")
@@ -122,14 +145,14 @@ async def success(request: Request, db: Session = Depends(get_db)):
     return RedirectResponse(url=f"{settings.FRONTEND_URL}/dashboard?payment=success", status_code=303)
 
 @router.post("/failure")
-async def failure(request: Request, db: Session = Depends(get_db)):
+async def failure(request: Request, db: AsyncSession = Depends(get_async_db)):
     try:
         form = await request.form()
         form_data = dict(form)
         print("PAYU FAILURE CALLBACK - DATA:", form_data)
         
         txnid = form_data.get("txnid")
-        payment = db.query(Payment).filter(Payment.transaction_id == txnid).first()
+        payment = await _payment_with_user(db, txnid)
         if payment:
             payment.status = "failure"
             payment.error_message = form_data.get("field9") or form_data.get("error_Message") or "Transaction failed"
@@ -139,7 +162,9 @@ async def failure(request: Request, db: Session = Depends(get_db)):
             if user:
                 user.payment_status = "failed"
             
-            db.commit()
+            await db.commit()
+            user_cache.invalidate(payment.user_id)
+            response_cache.invalidate(payment.user_id)
             print(f"Payment {txnid} marked as FAILURE for user {user.email if user else 'unknown'}. Reason: {payment.error_message}")
             
     except Exception as e:
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends
+from datetime import date
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Response
+from jsonpatch import JsonPatchException
+from jsonpointer import JsonPointerException
 from sqlalchemy.orm import Session
+from app.api.pagination import PageSize, date_range, decode_cursor, encode_cursor, set_next_cursor
+from app.core.config import settings
 from app.db.session import get_db
 from app.models.all_models import ApplicationCache
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
-from sqlalchemy.orm.attributes import flag_modified
+from typing import Dict, Any, List, Optional
+from app.services.stats_service import stats_service, PENDING
+from app.services.step_service import (
+    StepDraft, VersionConflict, cache_list_stmt, cache_row, created_count, patch_step, step_buffer, upsert_steps
+)
 
 router = APIRouter()
 
@@ -14,31 +22,121 @@ class CacheStepDataPayload(BaseModel):
     step: str
     data: Dict[str, Any]
 
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+def parse_if_match(if_match: Optional[str]) -> int:
+    value = (if_match or "").strip()
+    if value.startswith("W/"):
+        value = value[2:]
+    value = value.strip('"')
+    if not value.isdigit():
+        raise HTTPException(status_code=428, detail="If-Match with the step cache version is required")
+    return int(value)
+
 @router.post("/{step_name}/")
-def save_step(step_name: str, payload: CacheStepDataPayload, db: Session = Depends(get_db)):
-    cache = db.query(ApplicationCache).filter(ApplicationCache.session_id == payload.session_id).first()
-    if not cache:
-        cache = ApplicationCache(session_id=payload.session_id, user_id=payload.user_id, steps={})
-        db.add(cache)
-        db.commit()
-        db.refresh(cache)
-    
-    steps_data = cache.steps or {}
-    steps_data[step_name] = payload.data
-    
-    cache.steps = steps_data
-    flag_modified(cache, "steps")
+def save_step(step_name: str, payload: CacheStepDataPayload, response: Response, db: Session = Depends(get_db)):
+    if settings.STEP_WRITE_BEHIND:
+        step_buffer.add(payload.session_id, payload.user_id, step_name, payload.data)
+        return {"message": "Step cached"}
+
+    # One round trip: only this step travels, and concurrent saves of
+    # different steps for a session can't overwrite each other
+    versions = upsert_steps(db, [StepDraft(payload.session_id, payload.user_id, {step_name: payload.data})])
+    if created_count(versions):
+        stats_service.increment(db, PENDING)
     db.commit()
-    return {"message": "Step cached"}
+    response.headers["ETag"] = version_etag(versions[payload.session_id])
+    return {"message": "Step cached", "version": versions[payload.session_id]}
+
+@router.patch("/{step_name}/")
+def patch_step_data(
+    step_name: str,
+    response: Response,
+    session_id: str = Query(...),
+    patch: List[Dict[str, Any]] = Body(..., media_type="application/json-patch+json"),
+    if_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Apply RFC 6902 operations to a single step. Send the version from the last
+    ETag as If-Match; a stale version gets 409 with the current ETag so the
+    client can re-fetch and retry.
+    """
+    version = parse_if_match(if_match)
+    if step_buffer.has_pending(session_id):
+        # The patch is checked against the stored version, so land buffered steps first
+        step_buffer.flush()
+    try:
+        new_version = patch_step(db, session_id, step_name, patch, version)
+    except VersionConflict as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Step cache has changed, re-fetch and retry", "version": e.current},
+            headers={"ETag": version_etag(e.current)},
+        )
+    except (JsonPatchException, JsonPointerException) as e:
+        db.rollback()
+        raise HTTPException(status_code=422, detail=f"Invalid patch: {e}")
+    if new_version is None:
+        raise HTTPException(status_code=404, detail="Step cache not found")
+    db.commit()
+    response.headers["ETag"] = version_etag(new_version)
+    return {"message": "Step patched", "version": new_version}
 
 @router.get("/cache/")
-def get_cache(db: Session = Depends(get_db)):
-    caches = db.query(ApplicationCache).all()
-    cached_applications = []
-    for c in caches:
-        cached_applications.append({
-            "session_id": c.session_id,
-            "user_id": c.user_id,
-            "steps": c.steps
-        })
+def get_cache(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = PageSize,
+    user_id: Optional[str] = None,
+    updated_from: Optional[date] = None,
+    updated_to: Optional[date] = None,
+    summary: bool = False,
+    db: Session = Depends(get_db),
+):
+    filters = date_range(ApplicationCache.updated_at, updated_from, updated_to)
+    if user_id:
+        filters.append(ApplicationCache.user_id == user_id)
+    after = decode_cursor(cursor, int)
+    rows = db.execute(cache_list_stmt(db, summary, filters, after_id=after[0] if after else None, limit=limit + 1)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        set_next_cursor(response, encode_cursor(rows[-1].id))
+
+    cached_applications = [
+        cache_row(row) if summary else cache_row(row, step_buffer.overlay(row.session_id, row.steps))
+        for row in rows
+    ]
+    if not cursor and not summary:
+        # Sessions whose first steps are still buffered in this worker
+        known = {row.session_id for row in rows}
+        for draft in step_buffer.unflushed(exclude=known):
+            if user_id is None or draft.user_id == user_id:
+                cached_applications.append({
+                    "id": None,
+                    "session_id": draft.session_id,
+                    "user_id": draft.user_id,
+                    "version": None,
+                    "updated_at": None,
+                    "steps": draft.steps
+                })
     return {"cached_applications": cached_applications}
+
+@router.get("/cache/{session_id}/")
+def get_session_cache(
+    session_id: str, response: Response, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    """One session's draft; answers 304 while the client's ETag is still the current version."""
+    if step_buffer.has_pending(session_id):
+        # The version only moves when buffered steps reach the database
+        step_buffer.flush()
+    row = db.query(ApplicationCache).filter(ApplicationCache.session_id == session_id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Step cache not found")
+    etag = version_etag(row.version)
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return cache_row(row)
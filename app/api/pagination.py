@@ -0,0 +1,60 @@
+"""
+Keyset (cursor) pagination helpers shared by the listing endpoints.
+
+A cursor is an opaque url-safe token wrapping the sort key of the last row of
+a page. The next page is fetched with a `WHERE (sort key) < (cursor)` predicate
+so every page is an index range scan, however deep the client pages.
+"""
+import base64
+import json
+from datetime import date, datetime, timedelta
+from typing import Any, List, Optional, Sequence
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, or_
+from app.core.config import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+PageSize = Query(settings.ADMIN_PAGE_SIZE, ge=1, le=settings.ADMIN_PAGE_SIZE_MAX)
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], *types: type) -> Optional[List[Any]]:
+    """Decode a cursor into values of the given types, or None for the first page."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(values) != len(types):
+            raise ValueError("cursor arity mismatch")
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for v, t in zip(values, types)]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_before(columns: Sequence[Any], values: Sequence[Any]):
+    """Row-value `(c1, c2, ...) < (v1, v2, ...)` for descending keyset pages."""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value
+    return or_(column < value, and_(column == value, keyset_before(columns[1:], values[1:])))
+
+
+def date_range(column, date_from: Optional[date], date_to: Optional[date]) -> list:
+    """Inclusive calendar-day range filter on a datetime column."""
+    clauses = []
+    if date_from:
+        clauses.append(column >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        clauses.append(column < datetime.combine(date_to + timedelta(days=1), datetime.min.time()))
+    return clauses
+
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
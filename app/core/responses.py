@@ -0,0 +1,70 @@
+"""
+Fast JSON rendering for routes returning large payloads.
+
+FastAPI runs whatever a handler returns through `jsonable_encoder`, which walks
+every value in Python, and then `json.dumps`. Handlers that already build plain
+data (dicts and lists of str/int/float/None, datetimes, enums, result rows) can
+return `fast_json(...)` instead: the content goes straight to orjson, which
+serializes those types natively. Without orjson installed the stdlib encoder
+is used, with the same output.
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Optional
+from uuid import UUID
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from sqlalchemy.engine import Row
+
+try:
+    import orjson
+except ImportError:  # optional, see requirements.txt
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    # Only called for values the encoder doesn't handle natively
+    if isinstance(value, Row):
+        return value._asdict()
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def fast_json(content: Any, response: Optional[Response] = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    Render `content` without the `jsonable_encoder` pass.
+
+    A returned Response replaces the one FastAPI injects into handlers, so
+    headers set on that `response` (e.g. the next page cursor) are copied over.
+    """
+    rendered = FastJSONResponse(content, status_code=status_code)
+    if response is not None:
+        rendered.headers.raw.extend(response.headers.raw)
+    return rendered
@@ -0,0 +1,73 @@
+"""
+Helpers for the few statements whose SQL differs between PostgreSQL (production)
+and SQLite (local runs and tests).
+"""
+from typing import Optional, Tuple
+from sqlalchemy import Float, String
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.expression import ColumnElement
+
+
+def dialect_name(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+
+def is_postgres(db: Session) -> bool:
+    return dialect_name(db) == "postgresql"
+
+
+def upsert_insert(db: Session):
+    """Return the dialect's `insert()` construct supporting ON CONFLICT, or None."""
+    name = dialect_name(db)
+    if name == "postgresql":
+        return postgresql.insert
+    if name == "sqlite":
+        return sqlite.insert
+    return None
+
+
+class json_path_value(ColumnElement):
+    """
+    First non-empty value found at any of `paths` in the JSON column `column`,
+    as text cut to `length` characters, or as a number when `numeric` (NULL if
+    it isn't one). The values come from clients, so a column with a bounded
+    type must pass its `length`: PostgreSQL fails the write otherwise.
+
+    Only uses immutable functions, so it can back a generated column.
+    """
+    inherit_cache = False
+
+    def __init__(self, column: str, *paths: Tuple[str, ...], numeric: bool = False, length: Optional[int] = None):
+        self.column = column
+        self.paths = paths
+        self.numeric = numeric
+        self.length = length
+        self.type = Float() if numeric else String(length)
+
+
+@compiles(json_path_value)
+def _json_path_value_default(element, compiler, **kw):
+    raise CompileError(f"json_path_value is not supported on {compiler.dialect.name}")
+
+
+@compiles(json_path_value, "postgresql")
+def _json_path_value_pg(element, compiler, **kw):
+    values = [f"NULLIF({element.column} #>> '{{{','.join(path)}}}', '')" for path in element.paths]
+    value = f"COALESCE({', '.join(values)})"
+    if not element.numeric:
+        return f"left({value}, {element.length})" if element.length else value
+    return f"CASE WHEN btrim({value}) ~ '^-?[0-9]+(\\.[0-9]+)?$' THEN btrim({value})::numeric END"
+
+
+@compiles(json_path_value, "sqlite")
+def _json_path_value_sqlite(element, compiler, **kw):
+    values = [f"NULLIF(json_extract({element.column}, '$.{'.'.join(path)}'), '')" for path in element.paths]
+    value = f"COALESCE({', '.join(values)})"
+    if not element.numeric:
+        return f"substr({value}, 1, {element.length})" if element.length else value
+    return (f"CASE WHEN typeof({value}) IN ('integer', 'real') THEN {value} "
+            f"WHEN trim({value}) GLOB '[0-9]*' AND trim({value}) NOT GLOB '*[^0-9.]*' "
+            f"THEN CAST(trim({value}) AS REAL) END")
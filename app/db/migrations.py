@@ -0,0 +1,215 @@
+"""
+Idempotent schema upgrades applied at startup.
+
+`Base.metadata.create_all` only creates missing tables, so indexes and columns
+added to existing models are brought onto deployed databases here. Every step
+must be safe to run on each boot.
+
+Upgrades run in three phases: missing columns are added first (and column
+types changed, then generated columns added over them), so the ORM-based
+backfills always see a schema matching the current models; then data
+backfills; then index creation, which can cover the new columns.
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.schema import CreateColumn
+from app.db.session import Base
+
+logger = logging.getLogger(__name__)
+
+# (table, column, type/default DDL) added to tables that predate the column
+COLUMNS = [
+    ("applications", "search_document", "TEXT"),
+    ("users", "email_key", "VARCHAR(255)"),
+    ("users", "phone_e164", "VARCHAR(20)"),
+    ("users", "phone_last10", "VARCHAR(10)"),
+    ("application_cache", "version", "INTEGER NOT NULL DEFAULT 1"),
+    ("documents", "content_hash", "VARCHAR(64)"),
+]
+
+# (table, column) created as JSON by older releases and declared JSONB on PostgreSQL now
+JSONB_COLUMNS = [
+    ("application_cache", "steps"),
+    ("applications", "personal_details"),
+    ("applications", "academic_details"),
+    ("applications", "experience_details"),
+    ("applications", "research_details"),
+]
+
+# JSONB sections searched by containment/key existence, GIN-indexed on PostgreSQL
+GIN_COLUMNS = [
+    ("applications", "personal_details"),
+    ("applications", "academic_details"),
+    ("applications", "experience_details"),
+    ("applications", "research_details"),
+]
+
+
+def add_columns(conn: Connection):
+    inspector = inspect(conn)
+    existing = {}
+    for table, column, ddl in COLUMNS:
+        if table not in existing:
+            existing[table] = {c["name"] for c in inspector.get_columns(table)}
+        if column not in existing[table]:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            existing[table].add(column)
+
+
+def convert_jsonb_columns(conn: Connection):
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column in JSONB_COLUMNS:
+        data_type = conn.execute(text(
+            "SELECT data_type FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+        ), {"table": table, "column": column}).scalar()
+        if data_type == "json":
+            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE jsonb USING {column}::jsonb"))
+
+
+def truncate_generated_columns(conn: Connection):
+    # Text generated columns were first created without cutting the value to the
+    # column size, so an over-long client value failed the whole write on
+    # PostgreSQL. A generated column's expression can't be altered before
+    # PostgreSQL 17: drop the old ones here (their indexes go with them) and let
+    # add_generated_columns and ensure_indexes create them again.
+    if conn.dialect.name != "postgresql":
+        return
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if column.computed is None or not getattr(column.computed.sqltext, "length", None):
+                continue
+            expression = conn.execute(text(
+                "SELECT generation_expression FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = :table AND column_name = :column"
+            ), {"table": table.name, "column": column.name}).scalar()
+            if expression and not expression.startswith('"left"('):
+                logger.info(f"Rebuilding generated column {table.name}.{column.name}")
+                conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {column.name}"))
+
+
+def add_generated_columns(conn: Connection):
+    # Generated (Computed) model columns the database is missing. Runs after
+    # convert_jsonb_columns: PostgreSQL can't change the type of a column a
+    # generated column depends on, and computes the values over the whole table
+    # when the column is added, so no backfill is needed.
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        computed = [c for c in table.columns if c.computed is not None]
+        if not computed or not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in computed:
+            if column.name in existing:
+                continue
+            ddl = str(CreateColumn(column).compile(dialect=conn.dialect))
+            if conn.dialect.name == "sqlite":
+                # SQLite can only add VIRTUAL generated columns to an existing table
+                ddl = ddl.replace(") STORED", ") VIRTUAL")
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def backfill_user_identity_keys(conn: Connection):
+    from app.models.all_models import User
+    from app.services.identity import apply_identity_keys
+
+    # Every user has an email, so a NULL email_key marks a row not yet backfilled
+    session = Session(bind=conn)
+    while True:
+        batch = session.query(User).filter(User.email_key.is_(None)).limit(1000).all()
+        if not batch:
+            break
+        for user in batch:
+            apply_identity_keys(user)
+        session.flush()
+        session.expunge_all()
+
+
+def backfill_search_documents(conn: Connection):
+    from app.models.all_models import Application
+    from app.services.search_service import refresh_search_document
+
+    # build_search_document never returns NULL, so this terminates
+    session = Session(bind=conn)
+    while True:
+        batch = session.query(Application).options(joinedload(Application.user)) \
+            .filter(Application.search_document.is_(None)).limit(500).all()
+        if not batch:
+            break
+        for app in batch:
+            refresh_search_document(app)
+        session.flush()
+        session.expunge_all()
+
+
+def dedupe_documents(conn: Connection):
+    # Keep the latest row per (user_id, document_type) so the unique index can be built;
+    # uploads used to append rows, so the highest id is the current file
+    conn.execute(text(
+        "DELETE FROM documents WHERE id IN ("
+        " SELECT id FROM (SELECT id, row_number() OVER ("
+        "  PARTITION BY user_id, document_type ORDER BY id DESC) AS rn"
+        "  FROM documents) ranked WHERE rn > 1)"
+    ))
+
+
+BACKFILLS = [
+    backfill_user_identity_keys,
+    backfill_search_documents,
+    dedupe_documents,
+]
+
+
+def search_indexes(conn: Connection):
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_applications_search_fts "
+        "ON applications USING gin (to_tsvector('simple', search_document))"
+    ))
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_applications_search_trgm "
+                "ON applications USING gin (search_document gin_trgm_ops)"
+            ))
+    except Exception as e:
+        logger.warning(f"pg_trgm unavailable, search will not use the trigram fallback: {e}")
+
+
+def section_indexes(conn: Connection):
+    if conn.dialect.name != "postgresql":
+        return
+    for table, column in GIN_COLUMNS:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{column}_gin ON {table} USING gin ({column})"))
+
+
+def ensure_indexes(conn: Connection):
+    # Creates any index declared on the models that the database is missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
+INDEXES = [
+    search_indexes,
+    section_indexes,
+    ensure_indexes,
+]
+
+
+def run_migrations(engine: Engine):
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # gunicorn boots several workers at once; let one of them migrate at a time
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('vignan_migrations'))"))
+        add_columns(conn)
+        convert_jsonb_columns(conn)
+        truncate_generated_columns(conn)
+        add_generated_columns(conn)
+        for step in BACKFILLS + INDEXES:
+            step(conn)
@@ -1,14 +1,51 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.endpoints import auth, application, payment, step, application_submit, admin
 from app.core.config import settings
-from app.db.session import engine
+from app.db.session import engine, async_engine
+from app.db.migrations import run_migrations
+from app.api.pagination import NEXT_CURSOR_HEADER
 from app.models import all_models
+from app.services.scheduler import scheduler
+from app.services.stats_service import stats_service
+from app.services.email_service import email_queue
+from app.services.otp_store import otp_store
+from app.services.step_service import step_buffer
+from app.services.compaction_service import compaction_service
+from app.services.blob_store import blob_service
+from app.services.resumable_upload import resumable_uploads
+from app.services.idempotency import idempotency_service, REPLAY_HEADER
 
 # Init DB
 all_models.Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
-app = FastAPI(title="Vignan PhD API", version="1.0.0")
+# Periodic maintenance jobs (run in every worker, so each must be idempotent)
+scheduler.add_job("stats-reconcile", settings.STATS_RECONCILE_INTERVAL_SECONDS, stats_service.reconcile_job)
+scheduler.add_job("otp-purge", settings.OTP_PURGE_INTERVAL_SECONDS, otp_store.purge_expired)
+scheduler.add_job("idempotency-purge", settings.IDEMPOTENCY_PURGE_INTERVAL_SECONDS, idempotency_service.purge_expired)
+scheduler.add_job("step-cache-compact", settings.STEP_CACHE_COMPACT_INTERVAL_SECONDS, compaction_service.compact_job)
+scheduler.add_job("blob-gc", settings.BLOB_GC_INTERVAL_SECONDS, blob_service.gc_job)
+scheduler.add_job("resumable-upload-purge", settings.RESUMABLE_UPLOAD_PURGE_INTERVAL_SECONDS, resumable_uploads.purge_expired)
+if settings.STEP_WRITE_BEHIND:
+    scheduler.add_job("step-flush", settings.STEP_FLUSH_INTERVAL_MS / 1000, step_buffer.flush)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Seed the dashboard counters on a fresh database before any writer bumps them
+    await run_in_threadpool(stats_service.reconcile_job, True)
+    await scheduler.start()
+    await email_queue.start()
+    yield
+    await email_queue.stop()
+    await scheduler.stop()
+    # Buffered autosaves would otherwise be lost on restart
+    await run_in_threadpool(step_buffer.flush)
+    await async_engine.dispose()
+
+app = FastAPI(title="Vignan PhD API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +61,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        NEXT_CURSOR_HEADER, "ETag", REPLAY_HEADER,
+        # Resumable uploads
+        "Location", "Upload-Offset", "Upload-Length", "Upload-Expires", "Tus-Resumable",
+    ],
 )
 
 # Unified Router for all /api calls
@@ -1,7 +1,9 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, JSON, Float, Enum
+from sqlalchemy import Column, Computed, Integer, String, Boolean, Date, DateTime, ForeignKey, Index, Text, JSON, Float, Enum
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
+from app.db.dialect import json_path_value
 from app.db.session import Base
 
 class ApplicationStatus(str, enum.Enum):
@@ -19,6 +21,10 @@ class User(Base):
     full_name = Column(String(255), nullable=False)
     email = Column(String(255), unique=True, index=True, nullable=False)
     phone = Column(String(20), index=True, nullable=True)
+    # Normalized lookup keys, maintained by app.services.identity
+    email_key = Column(String(255), index=True, nullable=True)
+    phone_e164 = Column(String(20), index=True, nullable=True)
+    phone_last10 = Column(String(10), index=True, nullable=True)
     hashed_password = Column(String(255), nullable=True) # Optional if only using OTP
     is_active = Column(Boolean(), default=True)
     is_admin = Column(Boolean(), default=False)
@@ -43,19 +49,38 @@ class Application(Base):
     user_id = Column(Integer, ForeignKey("users.id"), unique=True)
     
     # Form Sections (Stored as JSON for flexibility, but can be split if needed for querying)
-    campus_preference = Column(String(100)) # Visakhapatnam, Guntur, Hyderabad
+    campus_preference = Column(String(100), index=True) # Visakhapatnam, Guntur, Hyderabad
     program_type = Column(String(50)) # Full-time, Part-time
-    department = Column(String(100))
+    department = Column(String(100), index=True)
     specialization = Column(String(255))
     
-    # Detailed Data Objects
-    personal_details = Column(JSON, default={}) # gender, dob, category, address, etc.
-    academic_details = Column(JSON, default={}) # 10th, 12th, UG, PG details
-    experience_details = Column(JSON, default={}) # Work/Research experience
-    research_details = Column(JSON, default={}) # Research proposal, area of interest
+    # Detailed Data Objects (JSONB with GIN indexes on PostgreSQL)
+    personal_details = Column(JSON().with_variant(JSONB, "postgresql"), default={}) # gender, dob, category, address, etc.
+    academic_details = Column(JSON().with_variant(JSONB, "postgresql"), default={}) # 10th, 12th, UG, PG details
+    experience_details = Column(JSON().with_variant(JSONB, "postgresql"), default={}) # Work/Research experience
+    research_details = Column(JSON().with_variant(JSONB, "postgresql"), default={}) # Research proposal, area of interest
+
+    # Admin filter fields, generated by the database from the sections above. The
+    # submit flow nests them ({"personal": {...}}) while /student/internal/update
+    # stores them flat, so each reads both shapes. Over-long values are cut to the column size.
+    category = Column(String(50), Computed(
+        json_path_value("personal_details", ("personal", "category"), ("category",), length=50),
+        persisted=True), index=True)
+    gender = Column(String(20), Computed(
+        json_path_value("personal_details", ("personal", "gender"), ("gender",), length=20),
+        persisted=True), index=True)
+    ug_percentage = Column(Float, Computed(
+        json_path_value("academic_details", ("ugEducation", "percentage"), ("ug_percentage",), numeric=True),
+        persisted=True), index=True)
+    exam_slot = Column(String(100), Computed(
+        json_path_value("research_details", ("examSchedule", "slot"), ("exam_slot",), length=100),
+        persisted=True), index=True)
     
+    # Lower-cased applicant search text, indexed with tsvector/trigram GIN on PostgreSQL
+    search_document = Column(Text, nullable=True)
+
     current_step = Column(Integer, default=1)
-    status = Column(Enum(ApplicationStatus), default=ApplicationStatus.DRAFT)
+    status = Column(Enum(ApplicationStatus), default=ApplicationStatus.DRAFT, index=True)
     
     submission_date = Column(DateTime, nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -66,7 +91,7 @@ class Payment(Base):
     __tablename__ = "payments"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     transaction_id = Column(String(100), unique=True, index=True)
     payu_id = Column(String(100), nullable=True)
     amount = Column(Float)
@@ -74,24 +99,60 @@ class Payment(Base):
     payment_mode = Column(String(50))
     error_message = Column(String(255), nullable=True)
     raw_response = Column(JSON, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
     
     user = relationship("User", back_populates="payments")
 
 class Document(Base):
     __tablename__ = "documents"
+    # One current file per document type; re-uploads replace the row
+    __table_args__ = (Index("uq_documents_user_type", "user_id", "document_type", unique=True),)
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     document_type = Column(String(100)) # ssc_memo, ug_degree, etc.
     file_name = Column(String(255))
     file_path = Column(String(500))
     file_size = Column(Integer)
     mime_type = Column(String(100))
+    content_hash = Column(String(64), index=True, nullable=True)  # SHA-256 hex of the stored file
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="documents")
 
+class Blob(Base):
+    """
+    One stored copy of some file content, shared by every Document whose
+    content_hash and file_path point at it. Collected once no Document does.
+    """
+    __tablename__ = "blobs"
+    backend = Column(String(20), primary_key=True)  # local, s3
+    sha256 = Column(String(64), primary_key=True)
+    location = Column(String(500), nullable=False)  # the file_path Documents store for it
+    size = Column(Integer)
+    mime_type = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)  # protects fresh reuses from GC
+
+class ResumableUpload(Base):
+    """A document being uploaded in chunks, PATCHed at increasing offsets until complete."""
+    __tablename__ = "resumable_uploads"
+    id = Column(String(32), primary_key=True)  # random, it is also the upload URL
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    document_type = Column(String(100))
+    file_name = Column(String(255))
+    mime_type = Column(String(100))
+    length = Column(Integer, nullable=False)
+    received = Column(Integer, nullable=False, default=0)  # the current Upload-Offset
+    storage = Column(String(20), nullable=False)  # local, s3
+    s3_key = Column(String(500), nullable=True)
+    s3_upload_id = Column(String(255), nullable=True)
+    part_size = Column(Integer, nullable=True)
+    parts = Column(JSON, default=list)  # S3 parts sent so far: [{"PartNumber", "ETag"}]
+    locked_until = Column(DateTime, nullable=True)  # set while a PATCH is writing
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
 class Message(Base):
     __tablename__ = "messages"
 
@@ -135,5 +196,31 @@ class ApplicationCache(Base):
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(String(255), unique=True, index=True)
     user_id = Column(String(50), index=True)
-    steps = Column(JSON, default={})
+    # JSONB on PostgreSQL so a step can be merged in place with `||`
+    steps = Column(JSON().with_variant(JSONB, "postgresql"), default={})
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # bumped on every save
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
+class StatCounter(Base):
+    """Dashboard totals, maintained alongside the writes that change them."""
+    __tablename__ = "stat_counters"
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class DailyRegistration(Base):
+    __tablename__ = "daily_registrations"
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class IdempotencyRecord(Base):
+    """Stored outcome of a request sent with an Idempotency-Key, replayed to retries."""
+    __tablename__ = "idempotency_keys"
+    scope = Column(String(50), primary_key=True)  # endpoint the key was used on
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status = Column(String(20), nullable=False, default="in_progress")  # in_progress, completed
+    response_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 from app.models.all_models import ApplicationStatus
 
@@ -146,11 +146,37 @@ class DocumentView(BaseModel):
     id: int
     document_type: str
     file_name: str
+    file_size: Optional[int] = None
+    content_hash: Optional[str] = None
     uploaded_at: datetime
     
     class Config:
         from_attributes = True
 
+class DocumentUploadRequest(BaseModel):
+    document_type: str = Field(..., pattern=r"^[A-Za-z0-9_\-]{1,100}$")
+    file_name: str = Field(..., max_length=255)
+    content_type: str
+    size: int = Field(..., gt=0)
+    method: Literal["post", "put"] = "post"
+    # SHA-256 hex of the file; uploads carrying it are checksummed by S3 and deduplicated
+    sha256: Optional[str] = Field(None, pattern=r"^[0-9a-f]{64}$")
+
+class DocumentUploadComplete(BaseModel):
+    document_type: str = Field(..., pattern=r"^[A-Za-z0-9_\-]{1,100}$")
+    key: str
+    file_name: str = Field(..., max_length=255)
+
+class ResumableUploadCreate(BaseModel):
+    document_type: str = Field(..., pattern=r"^[A-Za-z0-9_\-]{1,100}$")
+    file_name: str = Field(..., max_length=255)
+    size: int = Field(..., gt=0)
+
+class DocumentReuse(BaseModel):
+    document_type: str = Field(..., pattern=r"^[A-Za-z0-9_\-]{1,100}$")
+    file_name: str = Field(..., max_length=255)
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$")
+
 # --- Message ---
 class MessageView(BaseModel):
     id: int
@@ -0,0 +1,241 @@
+"""
+Content-addressed storage for uploaded documents.
+
+Files are stored once per backend under their SHA-256, and every Document
+with that content points at the same copy (`file_path` = the blob's location,
+`content_hash` = its digest). Re-uploading identical bytes only touches the
+existing `Blob` row. An applicant who already stored a file can reuse it
+under another document type without sending the bytes again (`find_reusable`).
+
+References are counted from the Document rows themselves rather than kept in
+a counter, so nothing can drift: `gc` deletes blobs that no Document points
+at, once they have been unused for BLOB_GC_GRACE_SECONDS. Every reuse bumps
+`last_used_at` in the transaction that records the Document, which keeps a
+collection from racing a reuse.
+
+The backends do blocking I/O; async callers run them in the threadpool.
+"""
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from sqlalchemy import exists, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.db.dialect import is_postgres, upsert_insert
+from app.db.session import SessionLocal
+from app.models.all_models import Blob, Document
+from app.services.s3_service import s3_service
+from app.services.upload_service import remove_file
+
+logger = logging.getLogger(__name__)
+
+
+class BlobBackend(ABC):
+    name: str
+
+    @abstractmethod
+    def location(self, digest: str) -> str:
+        ...
+
+    @abstractmethod
+    def owns(self, location: str) -> bool:
+        """Whether `location` is inside this store."""
+
+    @abstractmethod
+    def exists(self, digest: str) -> bool:
+        ...
+
+    @abstractmethod
+    def put_file(self, digest: str, path: str, mime_type: Optional[str]):
+        """Move the finished file at `path` into the store."""
+
+    @abstractmethod
+    def delete(self, digest: str):
+        ...
+
+
+class LocalBlobBackend(BlobBackend):
+    name = "local"
+
+    @property
+    def root(self) -> str:
+        return settings.BLOB_DIR or os.path.join(settings.UPLOAD_DIR, "blobs")
+
+    @property
+    def staging_dir(self) -> str:
+        # Same filesystem as the blobs, so put_file is a rename
+        return os.path.join(self.root, ".staging")
+
+    def location(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def owns(self, location: str) -> bool:
+        return location.startswith(self.root + os.sep)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.isfile(self.location(digest))
+
+    def put_file(self, digest: str, path: str, mime_type: Optional[str]):
+        dest = self.location(digest)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(path, dest)
+
+    def delete(self, digest: str):
+        remove_file(self.location(digest))
+
+
+class S3BlobBackend(BlobBackend):
+    name = "s3"
+    prefix = "blobs/"
+
+    def key(self, digest: str) -> str:
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    def location(self, digest: str) -> str:
+        return s3_service.object_url(self.key(digest))
+
+    def owns(self, location: str) -> bool:
+        return location.startswith(s3_service.object_url(self.prefix))
+
+    def exists(self, digest: str) -> bool:
+        return s3_service.head(self.key(digest)) is not None
+
+    def put_file(self, digest: str, path: str, mime_type: Optional[str]):
+        s3_service.upload_path(path, self.key(digest), mime_type)
+        remove_file(path)
+
+    def adopt(self, digest: str, object_name: str):
+        """Move an object uploaded straight to S3 into the store, without the bytes leaving S3."""
+        s3_service.copy(object_name, self.key(digest))
+        s3_service.delete(object_name)
+
+    def delete(self, digest: str):
+        s3_service.delete(self.key(digest))
+
+
+BACKENDS: Dict[str, BlobBackend] = {backend.name: backend for backend in (LocalBlobBackend(), S3BlobBackend())}
+
+
+class BlobService:
+    @staticmethod
+    def _touch(db: Session, backend: str, digest: str) -> bool:
+        updated = db.query(Blob).filter(Blob.backend == backend, Blob.sha256 == digest) \
+            .update({"last_used_at": datetime.utcnow()}, synchronize_session=False)
+        return bool(updated)
+
+    @staticmethod
+    def _record(db: Session, backend: str, digest: str, size: int, mime_type: Optional[str]):
+        now = datetime.utcnow()
+        values = {
+            "backend": backend, "sha256": digest, "location": BACKENDS[backend].location(digest),
+            "size": size, "mime_type": mime_type, "created_at": now, "last_used_at": now,
+        }
+        insert = upsert_insert(db)
+        if insert is None:
+            db.merge(Blob(**values))
+            return
+        stmt = insert(Blob).values(values)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[Blob.backend, Blob.sha256], set_={"last_used_at": now}
+        ))
+
+    async def reuse(self, db: AsyncSession, backend: str, digest: str) -> bool:
+        """Mark a stored blob as used by the caller's transaction; False if there isn't one."""
+        if not await db.run_sync(self._touch, backend, digest):
+            return False
+        return await run_in_threadpool(BACKENDS[backend].exists, digest)
+
+    async def store(
+        self, db: AsyncSession, backend: str, digest: str, path: str, size: int, mime_type: Optional[str]
+    ) -> str:
+        """
+        Store the file at `path` (consumed) under `digest` unless the content is
+        already stored, and return the location Documents should reference. The
+        Blob row is written in the caller's transaction, which commits it
+        together with the Document. (Should that roll back, a newly stored file
+        stays unrecorded until the same content is stored again.)
+        """
+        store = BACKENDS[backend]
+        if await self.reuse(db, backend, digest):
+            await run_in_threadpool(remove_file, path)
+        else:
+            await run_in_threadpool(store.put_file, digest, path, mime_type)
+            await db.run_sync(self._record, backend, digest, size, mime_type)
+        return store.location(digest)
+
+    async def adopt_s3(self, db: AsyncSession, object_name: str, digest: str, size: int, mime_type: Optional[str]) -> str:
+        """`store` for an object the client uploaded straight to S3 under `object_name`."""
+        store: S3BlobBackend = BACKENDS["s3"]
+        if await self.reuse(db, "s3", digest):
+            await run_in_threadpool(s3_service.delete, object_name)
+        else:
+            await run_in_threadpool(store.adopt, digest, object_name)
+            await db.run_sync(self._record, "s3", digest, size, mime_type)
+        return store.location(digest)
+
+    @staticmethod
+    def is_blob(location: Optional[str]) -> bool:
+        """Whether a file_path belongs to the store (and so must only be removed by `gc`)."""
+        if not location:
+            return False
+        return any(backend.owns(location) for backend in BACKENDS.values())
+
+    @staticmethod
+    def find_reusable(db: Session, user_id: int, digest: str) -> Optional[Blob]:
+        """The stored blob with content `digest`, if one of this user's documents already references it."""
+        return db.query(Blob).filter(Blob.sha256 == digest, exists().where(
+            Document.user_id == user_id, Document.content_hash == Blob.sha256, Document.file_path == Blob.location
+        )).first()
+
+    @staticmethod
+    def _unreferenced():
+        return ~exists().where(Document.content_hash == Blob.sha256, Document.file_path == Blob.location)
+
+    def gc(self) -> dict:
+        report = {"blobs": 0, "bytes": 0}
+        cutoff = datetime.utcnow() - timedelta(seconds=settings.BLOB_GC_GRACE_SECONDS)
+        while True:
+            with SessionLocal() as db:
+                query = db.query(Blob).filter(Blob.last_used_at < cutoff, self._unreferenced()) \
+                    .order_by(Blob.last_used_at).limit(settings.BLOB_GC_BATCH)
+                if is_postgres(db):
+                    # A blob being reused right now stays locked, and is skipped
+                    query = query.with_for_update(skip_locked=True)
+                blobs = query.all()
+                if not blobs:
+                    return report
+                for blob in blobs:
+                    # Files go first, while the rows are still locked: a reuse
+                    # waiting on them finds no row afterwards and stores anew
+                    BACKENDS[blob.backend].delete(blob.sha256)
+                    db.delete(blob)
+                    report["blobs"] += 1
+                    report["bytes"] += blob.size or 0
+                db.commit()
+
+    def gc_job(self):
+        report = self.gc()
+        if report["blobs"]:
+            logger.info(f"Blob GC: {report}")
+
+    @staticmethod
+    def stats(db: Session) -> dict:
+        """Stored vs referenced bytes, i.e. what deduplication saves."""
+        stored = db.query(func.count(Blob.sha256), func.coalesce(func.sum(Blob.size), 0)).one()
+        referenced = db.query(func.count(Document.id), func.coalesce(func.sum(Document.file_size), 0)) \
+            .join(Blob, (Blob.sha256 == Document.content_hash) & (Blob.location == Document.file_path)).one()
+        unreferenced = db.query(func.count(Blob.sha256)).filter(BlobService._unreferenced()).scalar()
+        return {
+            "blobs": stored[0],
+            "stored_bytes": int(stored[1]),
+            "documents": referenced[0],
+            "referenced_bytes": int(referenced[1]),
+            "unreferenced_blobs": unreferenced,
+        }
+
+
+blob_service = BlobService()
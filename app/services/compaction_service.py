@@ -0,0 +1,199 @@
+import logging
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.dialect import is_postgres
+from app.db.session import SessionLocal, engine
+from app.models.all_models import Application, ApplicationCache, ApplicationStatus, User
+from app.services.identity import normalize_email, normalize_phone
+from app.services.stats_service import stats_service, PENDING
+
+logger = logging.getLogger(__name__)
+
+PENDING_PREFIX = "pending-"
+PHONE_PATTERN = re.compile(r"^\+?[\d\s\-()]{10,20}$")
+
+
+def cache_identity(session_id: Optional[str], user_id: Optional[str]) -> Optional[str]:
+    """
+    Normalized applicant key ("email:..." or "phone:<last 10 digits>") of a cache row.
+
+    The form stores the applicant's phone as `user_id` and uses "pending-<phone or
+    email>" session ids. Other session ids are opaque and never parsed, so a
+    random id can't be mistaken for a phone number.
+    """
+    candidates = [user_id]
+    if session_id and session_id.startswith(PENDING_PREFIX):
+        candidates.append(session_id[len(PENDING_PREFIX):])
+    for raw in candidates:
+        raw = (raw or "").strip()
+        if "@" in raw:
+            return f"email:{normalize_email(raw)}"
+        if PHONE_PATTERN.match(raw):
+            _, last10 = normalize_phone(raw)
+            return f"phone:{last10}"
+    return None
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class CacheCompactionService:
+    """
+    Reclaims `application_cache` rows that no applicant will come back to:
+
+    - drafts idle for longer than STEP_CACHE_TTL_DAYS,
+    - drafts of applicants whose application is already submitted,
+    - duplicate drafts of one applicant (e.g. saved under a phone and an email
+      session id), merged into the most recently updated one.
+
+    Every batch of at most STEP_CACHE_COMPACT_BATCH rows is its own short
+    transaction, and on PostgreSQL rows an autosave is holding are skipped
+    (SKIP LOCKED) until the next run instead of waited for. Steps still in a
+    worker's write-behind buffer may re-create a removed row on their flush;
+    the next run removes it again.
+    """
+
+    @staticmethod
+    def _stored_size(db: Session):
+        if is_postgres(db):
+            return func.pg_column_size(ApplicationCache.steps)
+        return func.length(ApplicationCache.steps)
+
+    def _lock(self, db: Session, query):
+        return query.with_for_update(skip_locked=True) if is_postgres(db) else query
+
+    def _delete(self, db: Session, sizes: Dict[int, int], report: dict, reason: str):
+        """Delete rows by id; `sizes` maps each id to its stored size."""
+        deleted = db.query(ApplicationCache).filter(ApplicationCache.id.in_(list(sizes))) \
+            .delete(synchronize_session=False)
+        stats_service.increment(db, PENDING, -deleted)
+        report[reason] += deleted
+        report["rows"] += deleted
+        report["bytes"] += sum(size or 0 for size in sizes.values())
+
+    def _expire(self, cutoff: datetime, report: dict):
+        while True:
+            with SessionLocal() as db:
+                rows = self._lock(db, db.query(ApplicationCache.id, self._stored_size(db).label("size"))
+                                  .filter(ApplicationCache.updated_at < cutoff)
+                                  .order_by(ApplicationCache.id)
+                                  .limit(settings.STEP_CACHE_COMPACT_BATCH)).all()
+                if not rows:
+                    return
+                self._delete(db, dict(rows), report, "expired")
+                db.commit()
+
+    def _identities(self) -> Dict[str, List[int]]:
+        # Keyset scan over the narrow columns only; steps are never loaded here
+        groups = defaultdict(list)
+        after = 0
+        while True:
+            with SessionLocal() as db:
+                rows = db.query(ApplicationCache.id, ApplicationCache.session_id, ApplicationCache.user_id) \
+                    .filter(ApplicationCache.id > after).order_by(ApplicationCache.id) \
+                    .limit(settings.STEP_CACHE_COMPACT_BATCH).all()
+            if not rows:
+                return groups
+            after = rows[-1].id
+            for row in rows:
+                key = cache_identity(row.session_id, row.user_id)
+                if key:
+                    groups[key].append(row.id)
+
+    def _resolve(self, groups: Dict[str, List[int]]) -> Tuple[Dict[str, List[int]], List[int]]:
+        """
+        Regroup identity keys by registered user, so an applicant's email- and
+        phone-keyed drafts merge together; also returns the row ids belonging to
+        users who have already submitted.
+        """
+        users = {}
+        keys = list(groups)
+        for chunk in _chunks(keys, settings.STEP_CACHE_COMPACT_BATCH):
+            emails = [k[len("email:"):] for k in chunk if k.startswith("email:")]
+            phones = [k[len("phone:"):] for k in chunk if k.startswith("phone:")]
+            with SessionLocal() as db:
+                rows = db.execute(
+                    select(User.id, User.email_key, User.phone_last10, Application.status)
+                    .outerjoin(Application, Application.user_id == User.id)
+                    .where(or_(User.email_key.in_(emails), User.phone_last10.in_(phones)))
+                    .order_by(User.id)
+                ).all()
+            for row in rows:
+                submitted = row.status is not None and row.status != ApplicationStatus.DRAFT
+                for key in (f"email:{row.email_key}", f"phone:{row.phone_last10}"):
+                    users.setdefault(key, (row.id, submitted))
+
+        regrouped = defaultdict(list)
+        submitted_ids = []
+        for key, ids in groups.items():
+            user_id, submitted = users.get(key, (None, False))
+            if submitted:
+                submitted_ids += ids
+            else:
+                regrouped[f"user:{user_id}" if user_id else key] += ids
+        return regrouped, submitted_ids
+
+    def _remove_submitted(self, ids: List[int], report: dict):
+        for chunk in _chunks(ids, settings.STEP_CACHE_COMPACT_BATCH):
+            with SessionLocal() as db:
+                rows = self._lock(db, db.query(ApplicationCache.id, self._stored_size(db).label("size"))
+                                  .filter(ApplicationCache.id.in_(chunk))).all()
+                if rows:
+                    self._delete(db, dict(rows), report, "submitted")
+                db.commit()
+
+    def _merge(self, db: Session, ids: List[int], report: dict):
+        """Fold one applicant's drafts into the most recently updated one."""
+        rows = self._lock(db, db.query(ApplicationCache, self._stored_size(db).label("size"))
+                          .filter(ApplicationCache.id.in_(ids))).all()
+        if len(rows) < 2:
+            return
+        # Oldest first, so a step saved in a newer session wins
+        rows.sort(key=lambda r: (r.ApplicationCache.updated_at or datetime.min, r.ApplicationCache.id))
+        *older, (survivor, _) = rows
+        merged = {}
+        for cache, _ in rows:
+            merged.update(cache.steps or {})
+        survivor.steps = merged
+        survivor.version += 1
+        self._delete(db, {cache.id: size for cache, size in older}, report, "merged")
+
+    def compact(self) -> dict:
+        report = {"expired": 0, "submitted": 0, "merged": 0, "rows": 0, "bytes": 0, "skipped": False}
+        with engine.connect() as lock_conn:
+            if lock_conn.dialect.name == "postgresql":
+                # Every worker schedules this job; one compaction at a time is enough
+                if not lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext('vignan_cache_compaction'))")).scalar():
+                    report["skipped"] = True
+                    return report
+                lock_conn.commit()  # the lock is session-level; don't sit idle in a transaction
+            try:
+                self._expire(datetime.utcnow() - timedelta(days=settings.STEP_CACHE_TTL_DAYS), report)
+                groups, submitted_ids = self._resolve(self._identities())
+                self._remove_submitted(submitted_ids, report)
+
+                duplicates = [ids for ids in groups.values() if len(ids) > 1]
+                for batch in _chunks(duplicates, max(1, settings.STEP_CACHE_COMPACT_BATCH // 10)):
+                    with SessionLocal() as db:
+                        for ids in batch:
+                            self._merge(db, ids, report)
+                        db.commit()
+            finally:
+                if lock_conn.dialect.name == "postgresql":
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext('vignan_cache_compaction'))"))
+        return report
+
+    def compact_job(self):
+        report = self.compact()
+        if report["rows"]:
+            logger.info(f"Step cache compaction: {report}")
+
+
+compaction_service = CacheCompactionService()
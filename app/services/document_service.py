@@ -0,0 +1,117 @@
+import os
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.db.dialect import upsert_insert
+from app.models.all_models import Document
+from app.services.blob_store import blob_service
+from app.services.s3_service import s3_service
+from app.services.upload_service import remove_file
+
+UPDATABLE = ("file_name", "file_path", "file_size", "mime_type", "content_hash", "uploaded_at")
+
+
+def upsert_documents(db: Session, rows: List[dict], replace: bool = False) -> List[int]:
+    """
+    Write document rows keyed on (user_id, document_type) in one statement.
+
+    With `replace` an existing row for the type takes the new file; otherwise
+    it is left alone. Returns the ids of the rows written. The caller commits.
+    """
+    if not rows:
+        return []
+    insert = upsert_insert(db)
+    if insert is None:
+        ids = []
+        for row in rows:
+            doc = db.query(Document).filter(
+                Document.user_id == row["user_id"], Document.document_type == row["document_type"]
+            ).with_for_update().first()
+            if doc is None:
+                doc = Document(**row)
+                db.add(doc)
+            elif replace:
+                for column in UPDATABLE:
+                    setattr(doc, column, row.get(column))
+            else:
+                continue
+            db.flush()
+            ids.append(doc.id)
+        return ids
+
+    # Every row must carry the same keys for a multi-row VALUES clause
+    columns = set().union(*rows)
+    stmt = insert(Document).values([{c: row.get(c) for c in columns} for row in rows])
+    keys = [Document.user_id, Document.document_type]
+    if replace:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={c: getattr(stmt.excluded, c) for c in UPDATABLE if c in columns},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+    return list(db.execute(stmt.returning(Document.id)).scalars())
+
+
+def user_upload_prefix(user_id: int) -> str:
+    """S3 key prefix of the objects uploaded for one user."""
+    return f"documents/{user_id}/"
+
+
+def is_user_file(user_id: int, location: Optional[str]) -> bool:
+    """
+    Whether `location` is a file of this user's own: an S3 object under
+    documents/{user_id}/ or a file under UPLOAD_DIR/{user_id}/. Document paths
+    can come from clients, so nothing else may be deleted on their behalf.
+    """
+    if not location:
+        return False
+    key = s3_service.key_from_url(location)
+    if key is not None:
+        return key.startswith(user_upload_prefix(user_id)) and ".." not in key.split("/")
+    root = os.path.realpath(os.path.join(settings.UPLOAD_DIR, str(user_id)))
+    return os.path.realpath(location).startswith(root + os.sep)
+
+
+async def remove_replaced(user_id: int, previous: Optional[str], current: str):
+    """
+    Remove a document's previous file once its row points at `current`.
+    Stored blobs may be shared and are left to blob GC, and only the user's
+    own files are ever removed.
+    """
+    if not previous or previous == current or blob_service.is_blob(previous):
+        return
+    if not is_user_file(user_id, previous):
+        return
+    key = s3_service.key_from_url(previous)
+    if key:
+        await run_in_threadpool(s3_service.delete, key)
+    else:
+        await run_in_threadpool(remove_file, previous)
+
+
+async def record_document(
+    db: AsyncSession, user_id: int, document_type: str, file_name: str,
+    location: str, size: Optional[int], mime_type: Optional[str], content_hash: Optional[str]
+) -> Document:
+    """Point the user's document of this type at `location`, commit, then remove the file it replaced."""
+    previous = (await db.execute(select(Document.file_path).where(
+        Document.user_id == user_id, Document.document_type == document_type
+    ))).scalar()
+    doc_ids = await db.run_sync(upsert_documents, [{
+        "user_id": user_id,
+        "document_type": document_type,
+        "file_name": file_name,
+        "file_path": location,
+        "file_size": size,
+        "mime_type": mime_type,
+        "content_hash": content_hash,
+        "uploaded_at": datetime.utcnow(),
+    }], True)
+    await db.commit()
+    await remove_replaced(user_id, previous, location)
+    return await db.get(Document, doc_ids[0])
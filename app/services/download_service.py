@@ -0,0 +1,106 @@
+"""
+Serving stored document files.
+
+S3 documents redirect to a short-lived presigned GET. Local ones go out as a
+FileResponse: the file is sent with ASGI pathsend where the server supports
+it and otherwise streamed in chunks, never read into memory, and Range /
+If-Range requests get 206 responses. This module adds validators that follow
+the document rather than the file (blobs are shared, see blob_store), and
+conditional GET: If-None-Match / If-Modified-Since answer 304 with no body.
+
+With DOCUMENT_ACCEL_REDIRECT_PREFIX set, nginx sends files under UPLOAD_DIR
+itself via X-Accel-Redirect (an `internal` location must map the prefix to
+UPLOAD_DIR on a host that sees the files) and the worker only authorizes the
+request and answers the conditional part.
+"""
+import hashlib
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional
+from urllib.parse import quote
+from fastapi import Request, Response
+from fastapi.responses import FileResponse, RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.models.all_models import Document
+from app.services.blob_store import BACKENDS
+from app.services.response_cache import etag_matches
+from app.services.s3_service import s3_service
+
+CACHE_CONTROL = "private, no-cache"
+
+
+def _roots() -> list:
+    return [os.path.realpath(root) for root in (settings.UPLOAD_DIR, BACKENDS["local"].root)]
+
+
+def local_path(doc: Document) -> Optional[str]:
+    """The document's file if it is a regular file inside the upload directories."""
+    if not doc.file_path:
+        return None
+    path = os.path.realpath(doc.file_path)
+    if not any(path.startswith(root + os.sep) for root in _roots()):
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def _validators(doc: Document, stat: os.stat_result) -> tuple:
+    # The file name is part of the version: the same blob can be re-recorded under another name
+    content = doc.content_hash or f"{stat.st_mtime_ns}-{stat.st_size}"
+    etag = '"' + hashlib.sha1(f"{content}:{doc.file_name}".encode()).hexdigest()[:20] + '"'
+    modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    if doc.uploaded_at:
+        modified = max(modified, doc.uploaded_at.replace(tzinfo=timezone.utc, microsecond=0))
+    return etag, modified
+
+
+def _not_modified(request: Request, etag: str, modified: datetime) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        # If-Modified-Since is ignored when If-None-Match is sent
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if not if_modified_since:
+        return False
+    try:
+        return modified <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+
+def _disposition(file_name: Optional[str], inline: bool) -> str:
+    kind = "inline" if inline else "attachment"
+    if not file_name:
+        return kind
+    return f"{kind}; filename*=utf-8''{quote(file_name)}"
+
+
+async def document_response(doc: Document, request: Request, inline: bool = False) -> Optional[Response]:
+    """The download response for `doc`, or None if its file can't be found."""
+    key = s3_service.key_from_url(doc.file_path)
+    if key:
+        url = await run_in_threadpool(
+            s3_service.presigned_get, key, settings.S3_DOWNLOAD_URL_EXPIRES_SECONDS, doc.file_name
+        )
+        return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+
+    path = await run_in_threadpool(local_path, doc)
+    if path is None:
+        return None
+    stat = await run_in_threadpool(os.stat, path)
+    etag, modified = _validators(doc, stat)
+    headers = {"ETag": etag, "Last-Modified": format_datetime(modified, usegmt=True), "Cache-Control": CACHE_CONTROL}
+    if _not_modified(request, etag, modified):
+        return Response(status_code=304, headers=headers)
+
+    media_type = doc.mime_type or "application/octet-stream"
+    upload_root = os.path.realpath(settings.UPLOAD_DIR)
+    if settings.DOCUMENT_ACCEL_REDIRECT_PREFIX and path.startswith(upload_root + os.sep):
+        internal = settings.DOCUMENT_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + quote(os.path.relpath(path, upload_root))
+        headers.update({"X-Accel-Redirect": internal, "Content-Disposition": _disposition(doc.file_name, inline)})
+        return Response(media_type=media_type, headers=headers)
+    return FileResponse(
+        path, media_type=media_type, headers=headers, filename=doc.file_name, stat_result=stat,
+        content_disposition_type="inline" if inline else "attachment",
+    )
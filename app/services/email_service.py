@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from typing import Deque, Dict, List, Optional
+import aiosmtplib
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class EmailJob:
+    message: EmailMessage
+    attempts: int = 0
+    last_error: Optional[str] = None
+    enqueued_at: float = field(default_factory=time.time)
+
+
+class EmailQueue:
+    """
+    In-process delivery queue for outgoing mail.
+
+    Callers `enqueue` a message and return immediately. A few worker tasks each
+    keep one authenticated SMTP connection open and reuse it across messages,
+    so the TLS handshake and login are paid once per connection rather than once
+    per email. Failed sends are retried with exponential backoff; messages that
+    exhaust their retries are kept in a bounded dead-letter list for inspection.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_tls: bool = False,
+        start_tls: bool = False,
+        workers: int = 1,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        idle_timeout: float = 120.0,
+        dead_letter_size: int = 100,
+        maxsize: int = 10000,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle_timeout = idle_timeout
+        self.dead_letters: Deque[EmailJob] = deque(maxlen=dead_letter_size)
+        self.sent = 0
+        self.failed_attempts = 0
+        self.connections_opened = 0
+        self._maxsize = maxsize
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Dict[asyncio.Task, EmailJob] = {}
+        self._sent_times: Deque[float] = deque()
+
+    @classmethod
+    def from_settings(cls) -> "EmailQueue":
+        # Port 465: implicit TLS; port 587: STARTTLS
+        return cls(
+            hostname=settings.SMTP_HOST,
+            port=settings.SMTP_PORT,
+            username=settings.SMTP_USER,
+            password=settings.SMTP_PASSWORD,
+            use_tls=settings.SMTP_PORT == 465,
+            start_tls=settings.SMTP_PORT == 587,
+            workers=settings.EMAIL_WORKERS,
+            max_retries=settings.EMAIL_MAX_RETRIES,
+        )
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._maxsize)
+        return self._queue
+
+    async def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"email-worker-{i}"))
+
+    async def stop(self, drain_timeout: float = 10.0):
+        """
+        Give queued mail a chance to go out, then shut the workers down. Mail
+        still queued or waiting out a retry backoff is dead-lettered.
+        """
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self.queue.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+        retries = dict(self._retries)
+        for task in list(self._tasks) + list(retries):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *retries, return_exceptions=True)
+        self._tasks = []
+        self._retries = {}
+
+        undelivered = list(retries.values())
+        while not self.queue.empty():
+            undelivered.append(self.queue.get_nowait())
+            self.queue.task_done()
+        for job in undelivered:
+            job.last_error = f"shutdown ({job.last_error})" if job.last_error else "shutdown"
+            self.dead_letters.append(job)
+        if undelivered:
+            logger.warning(
+                f"Email queue stopped with {len(undelivered)} messages undelivered "
+                f"({len(retries)} waiting to retry)"
+            )
+
+    def enqueue(self, message: EmailMessage) -> bool:
+        try:
+            self.queue.put_nowait(EmailJob(message))
+            return True
+        except asyncio.QueueFull:
+            self.dead_letters.append(EmailJob(message, last_error="queue full"))
+            logger.error(f"Email queue full, dropped message to {message['To']}")
+            return False
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            username=self.username,
+            password=self.password,
+            use_tls=self.use_tls,
+            start_tls=self.start_tls,
+        )
+        await client.connect()
+        self.connections_opened += 1
+        return client
+
+    @staticmethod
+    async def _close(client: Optional[aiosmtplib.SMTP]):
+        if client and client.is_connected:
+            try:
+                await client.quit()
+            except aiosmtplib.SMTPException:
+                client.close()
+
+    async def _worker(self):
+        client: Optional[aiosmtplib.SMTP] = None
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(self.queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    # Don't hold an idle connection the server will drop anyway
+                    await self._close(client)
+                    client = None
+                    continue
+                try:
+                    if client is None or not client.is_connected:
+                        client = await self._connect()
+                    await client.send_message(job.message)
+                    self._record_sent()
+                except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                    await self._close(client)
+                    client = None
+                    self._retry(job, e)
+                except Exception as e:
+                    # A bad message or a client bug must not take the worker down with it
+                    logger.exception(f"Unexpected error sending email to {job.message['To']}")
+                    await self._close(client)
+                    client = None
+                    self._retry(job, e)
+                finally:
+                    self.queue.task_done()
+        finally:
+            await self._close(client)
+
+    def _retry(self, job: EmailJob, error: Exception):
+        self.failed_attempts += 1
+        job.attempts += 1
+        job.last_error = str(error)
+        if job.attempts > self.max_retries:
+            self.dead_letters.append(job)
+            logger.error(f"Giving up on email to {job.message['To']} after {job.attempts} attempts: {error}")
+            return
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+        logger.warning(f"Email to {job.message['To']} failed ({error}), retrying in {delay:.0f}s")
+        task = asyncio.create_task(self._requeue(job, delay))
+        self._retries[task] = job
+        task.add_done_callback(lambda t: self._retries.pop(t, None))
+
+    async def _requeue(self, job: EmailJob, delay: float):
+        await asyncio.sleep(delay)
+        await self.queue.put(job)
+
+    def _record_sent(self):
+        now = time.monotonic()
+        self.sent += 1
+        self._sent_times.append(now)
+        while self._sent_times and self._sent_times[0] < now - 60:
+            self._sent_times.popleft()
+
+    def metrics(self) -> dict:
+        now = time.monotonic()
+        recent = sum(1 for t in self._sent_times if t >= now - 60)
+        return {
+            "queued": self.queue.qsize(),
+            "retrying": len(self._retries),
+            "sent": self.sent,
+            "sent_last_minute": recent,
+            "failed_attempts": self.failed_attempts,
+            "dead_lettered": len(self.dead_letters),
+            "connections_opened": self.connections_opened,
+            "workers": len(self._tasks),
+        }
+
+
+email_queue = EmailQueue.from_settings()
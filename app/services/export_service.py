@@ -0,0 +1,169 @@
+import csv
+import io
+import json
+import zlib
+from collections import defaultdict
+from enum import Enum
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+from sqlalchemy import func, select
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.all_models import User, Application, Payment, Document
+
+# Column name -> extractor over (application row, latest payment, documents)
+EXPORT_COLUMNS: Dict[str, Callable[[Any, Any, list], Any]] = {
+    "application_id": lambda r, p, d: r.id,
+    "user_id": lambda r, p, d: r.user_id,
+    "full_name": lambda r, p, d: r.full_name,
+    "email": lambda r, p, d: r.email,
+    "phone": lambda r, p, d: r.phone,
+    "registered_at": lambda r, p, d: r.registered_at,
+    "campus": lambda r, p, d: r.campus_preference,
+    "program_type": lambda r, p, d: r.program_type,
+    "department": lambda r, p, d: r.department,
+    "specialization": lambda r, p, d: r.specialization,
+    "category": lambda r, p, d: r.category,
+    "gender": lambda r, p, d: r.gender,
+    "ug_percentage": lambda r, p, d: r.ug_percentage,
+    "exam_slot": lambda r, p, d: r.exam_slot,
+    "status": lambda r, p, d: r.status,
+    "current_step": lambda r, p, d: r.current_step,
+    "submission_date": lambda r, p, d: r.submission_date,
+    "updated_at": lambda r, p, d: r.updated_at,
+    "payment_status": lambda r, p, d: r.payment_status,
+    "payment_transaction_id": lambda r, p, d: p.transaction_id if p else None,
+    "payment_amount": lambda r, p, d: p.amount if p else None,
+    "payment_state": lambda r, p, d: p.status if p else None,
+    "payment_date": lambda r, p, d: p.created_at if p else None,
+    "documents": lambda r, p, d: d,
+    "personal_details": lambda r, p, d: r.personal_details,
+    "academic_details": lambda r, p, d: r.academic_details,
+    "experience_details": lambda r, p, d: r.experience_details,
+    "research_details": lambda r, p, d: r.research_details,
+}
+PAYMENT_COLUMNS = {"payment_transaction_id", "payment_amount", "payment_state", "payment_date"}
+
+
+def resolve_columns(columns: Optional[str]) -> List[str]:
+    """Parse a comma separated column list; raises ValueError on unknown names."""
+    if not columns:
+        return list(EXPORT_COLUMNS)
+    selected = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in selected if c not in EXPORT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+    return selected
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, Enum):
+        return value.value
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+async def _latest_payments(db, user_ids: List[int]) -> Dict[int, Any]:
+    ranked = select(
+        Payment.user_id, Payment.transaction_id, Payment.amount, Payment.status, Payment.created_at,
+        func.row_number().over(
+            partition_by=Payment.user_id, order_by=(Payment.created_at.desc(), Payment.id.desc())
+        ).label("rn")
+    ).where(Payment.user_id.in_(user_ids)).subquery()
+    rows = (await db.execute(select(ranked).where(ranked.c.rn == 1))).all()
+    return {row.user_id: row for row in rows}
+
+
+async def _documents(db, user_ids: List[int]) -> Dict[int, list]:
+    rows = (await db.execute(
+        select(Document.user_id, Document.document_type, Document.file_name, Document.file_path, Document.uploaded_at)
+        .where(Document.user_id.in_(user_ids)).order_by(Document.user_id, Document.id)
+    )).all()
+    grouped = defaultdict(list)
+    for d in rows:
+        grouped[d.user_id].append({
+            "document_type": d.document_type,
+            "file_name": d.file_name,
+            "file_path": d.file_path,
+            "uploaded_at": _plain(d.uploaded_at),
+        })
+    return grouped
+
+
+async def iter_export_rows(columns: List[str], filters: Iterable = ()) -> AsyncIterator[List[dict]]:
+    """
+    Yield export rows in batches of EXPORT_BATCH_SIZE.
+
+    Applications are read through a server-side cursor (`stream` + `yield_per`), and the
+    latest payment and documents are fetched once per batch, so memory is bound
+    by the batch size rather than by the number of applicants.
+    """
+    want_payment = bool(PAYMENT_COLUMNS.intersection(columns))
+    want_documents = "documents" in columns
+
+    stmt = select(
+        Application.id, Application.user_id, Application.campus_preference, Application.program_type,
+        Application.department, Application.specialization, Application.category, Application.gender,
+        Application.ug_percentage, Application.exam_slot, Application.status, Application.current_step,
+        Application.submission_date, Application.updated_at, Application.personal_details,
+        Application.academic_details, Application.experience_details, Application.research_details,
+        User.full_name, User.email, User.phone, User.payment_status, User.created_at.label("registered_at")
+    ).join(User, User.id == Application.user_id).where(*filters).order_by(Application.id)
+
+    # The generator outlives the request handler, so it owns its session
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        async for batch in result.partitions():
+            user_ids = [r.user_id for r in batch]
+            payments = await _latest_payments(db, user_ids) if want_payment else {}
+            documents = await _documents(db, user_ids) if want_documents else {}
+            yield [
+                {
+                    name: _plain(EXPORT_COLUMNS[name](r, payments.get(r.user_id), documents.get(r.user_id, [])))
+                    for name in columns
+                }
+                for r in batch
+            ]
+
+
+async def _csv_chunks(columns: List[str], batches: AsyncIterator[List[dict]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for batch in batches:
+        for row in batch:
+            writer.writerow([
+                json.dumps(v, default=str) if isinstance(v, (dict, list)) else ("" if v is None else v)
+                for v in row.values()
+            ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def _ndjson_chunks(batches: AsyncIterator[List[dict]]) -> AsyncIterator[str]:
+    async for batch in batches:
+        yield "".join(json.dumps(row, default=str) + "\n" for row in batch)
+
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def _encode(text: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    async for chunk in text:
+        if chunk:
+            yield chunk.encode("utf-8")
+
+
+def stream_export(fmt: str, columns: List[str], filters: Iterable = (), compress: bool = False) -> AsyncIterator[bytes]:
+    batches = iter_export_rows(columns, filters)
+    text = _csv_chunks(columns, batches) if fmt == "csv" else _ndjson_chunks(batches)
+    chunks = _encode(text)
+    return _gzip(chunks) if compress else chunks
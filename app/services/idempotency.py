@@ -0,0 +1,169 @@
+"""
+Idempotency-Key support for endpoints that clients retry over flaky networks.
+
+The first request with a key claims it by inserting an `in_progress` row, runs
+normally and stores its response. A retry with the same key and body gets the
+stored response back without running the endpoint again; a retry that arrives
+while the first request is still running waits for it, up to
+IDEMPOTENCY_WAIT_SECONDS, and then gets 409 with Retry-After. The wait polls
+asynchronously and holds no threadpool thread; the (blocking) handlers run in
+the threadpool. Reusing a key with a different body is rejected. Claims of
+requests that died mid-way lapse after IDEMPOTENCY_LOCK_SECONDS, completed
+responses after IDEMPOTENCY_TTL_SECONDS.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def request_fingerprint(body: Any) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(body), sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyService:
+    def _claim(self, scope: str, key: str, fingerprint: str) -> Optional[IdempotencyRecord]:
+        """Claim the key; returns None if claimed, else the record of the request that holds it."""
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            db.add(IdempotencyRecord(
+                scope=scope, key=key, request_hash=fingerprint, status=IN_PROGRESS,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+            ))
+            try:
+                db.commit()
+                return None
+            except IntegrityError:
+                db.rollback()
+
+            record = db.get(IdempotencyRecord, (scope, key))
+            if record is None or record.expires_at <= now:
+                # Lapsed: take it over, unless another retry just did
+                taken = db.query(IdempotencyRecord).filter(
+                    IdempotencyRecord.scope == scope, IdempotencyRecord.key == key,
+                    IdempotencyRecord.expires_at <= now,
+                ).update({
+                    "request_hash": fingerprint, "status": IN_PROGRESS, "response_code": None,
+                    "response_body": None, "created_at": now,
+                    "expires_at": now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+                }, synchronize_session=False)
+                db.commit()
+                if taken:
+                    return None
+                record = db.get(IdempotencyRecord, (scope, key), populate_existing=True)
+            db.expunge(record)
+            return record
+
+    @staticmethod
+    def _load(scope: str, key: str) -> Optional[IdempotencyRecord]:
+        with SessionLocal() as db:
+            record = db.get(IdempotencyRecord, (scope, key))
+            if record is not None:
+                db.expunge(record)
+            return record
+
+    async def _wait(self, scope: str, key: str) -> Optional[IdempotencyRecord]:
+        """Poll until the holder completes (the record) or releases the key (None); gives up after IDEMPOTENCY_WAIT_SECONDS."""
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            record = await run_in_threadpool(self._load, scope, key)
+            if record is None or record.status == COMPLETED or time.monotonic() >= deadline:
+                return record
+
+    def _complete(self, scope: str, key: str, code: int, body: Any):
+        with SessionLocal() as db:
+            db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.scope == scope, IdempotencyRecord.key == key
+            ).update({
+                "status": COMPLETED, "response_code": code, "response_body": json.dumps(body),
+                "expires_at": datetime.utcnow() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+            }, synchronize_session=False)
+            db.commit()
+
+    def _release(self, scope: str, key: str):
+        with SessionLocal() as db:
+            db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.scope == scope, IdempotencyRecord.key == key,
+                IdempotencyRecord.status == IN_PROGRESS,
+            ).delete(synchronize_session=False)
+            db.commit()
+
+    @staticmethod
+    def _replay(record: IdempotencyRecord) -> JSONResponse:
+        return JSONResponse(
+            content=json.loads(record.response_body),
+            status_code=record.response_code,
+            headers={REPLAY_HEADER: "true"},
+        )
+
+    async def run(self, scope: str, key: Optional[str], body: Any, handler: Callable[[], Any]):
+        """
+        Call the blocking `handler` at most once per (scope, key), in the
+        threadpool; without a key it simply runs.
+
+        Only successful responses are stored. If the handler raises, the claim is
+        released so a retry runs the request again.
+        """
+        if not key:
+            return await run_in_threadpool(handler)
+        if len(key) > 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+        fingerprint = request_fingerprint(body)
+        record = await run_in_threadpool(self._claim, scope, key, fingerprint)
+        if record is not None:
+            if record.request_hash != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+            if record.status == IN_PROGRESS:
+                record = await self._wait(scope, key)
+                if record is None:
+                    # The first request failed and released its claim; run this one instead
+                    return await self.run(scope, key, body, handler)
+                if record.status != COMPLETED:
+                    raise HTTPException(
+                        status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                        headers={"Retry-After": "1"},
+                    )
+            return self._replay(record)
+
+        try:
+            result = await run_in_threadpool(handler)
+        except BaseException:
+            await run_in_threadpool(self._release, scope, key)
+            raise
+        await run_in_threadpool(self._complete, scope, key, 200, jsonable_encoder(result))
+        return result
+
+    def purge_expired(self) -> int:
+        with SessionLocal() as db:
+            # Lapsed in_progress claims belong to requests that died, so they go too
+            purged = db.query(IdempotencyRecord).filter(
+                IdempotencyRecord.expires_at < datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+        if purged:
+            logger.info(f"Purged {purged} expired idempotency keys")
+        return purged
+
+
+idempotency_service = IdempotencyService()
@@ -0,0 +1,94 @@
+"""
+Normalized identity keys for users and the single lookup used by every endpoint
+that resolves an applicant from an email address or phone number.
+
+`users.email_key` holds the lower-cased email, `users.phone_last10` the last ten
+digits of the phone and `users.phone_e164` its +91 E.164 form. All three are
+indexed and kept in sync by ORM listeners, so each lookup is an index probe
+instead of a leading-wildcard LIKE scan.
+"""
+from typing import List, Optional, Tuple
+from sqlalchemy import Select, event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.models.all_models import User
+
+DEFAULT_COUNTRY_CODE = "91"
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    if not email:
+        return None
+    return email.strip().lower() or None
+
+
+def normalize_phone(phone: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Return (e164, last10) for a free-form phone number; (None, None) if it has no digits."""
+    digits = "".join(filter(str.isdigit, phone or ""))
+    if not digits:
+        return None, None
+    if len(digits) == 10:
+        e164 = f"+{DEFAULT_COUNTRY_CODE}{digits}"
+    elif len(digits) == 11 and digits.startswith("0"):
+        e164 = f"+{DEFAULT_COUNTRY_CODE}{digits[1:]}"
+    else:
+        e164 = f"+{digits}"
+    return e164, digits[-10:]
+
+
+def apply_identity_keys(user: User):
+    user.email_key = normalize_email(user.email)
+    user.phone_e164, user.phone_last10 = normalize_phone(user.phone)
+
+
+@event.listens_for(User, "before_insert")
+@event.listens_for(User, "before_update")
+def _sync_identity_keys(mapper, connection, user: User):
+    apply_identity_keys(user)
+
+
+def identity_filter(email: Optional[str] = None, phone: Optional[str] = None):
+    """SQL predicate matching a user by email, else by phone; None if neither is usable."""
+    email_key = normalize_email(email)
+    if email_key:
+        return User.email_key == email_key
+    _, last10 = normalize_phone(phone)
+    if last10:
+        return User.phone_last10 == last10
+    return None
+
+
+def identity_criteria(email: Optional[str] = None, phone: Optional[str] = None) -> list:
+    """The predicates `find_user` tries, in order: by email, then by phone."""
+    criteria = (identity_filter(email=email), identity_filter(phone=phone))
+    return [criterion for criterion in criteria if criterion is not None]
+
+
+def _lookups(email: Optional[str], phone: Optional[str], options) -> List[Select]:
+    return [
+        select(User).options(*options).where(criterion).order_by(User.id).limit(1)
+        for criterion in identity_criteria(email, phone)
+    ]
+
+
+def find_user(db: Session, email: Optional[str] = None, phone: Optional[str] = None, *options) -> Optional[User]:
+    """
+    Resolve a user by email and, failing that, by phone.
+
+    Extra loader `options` (e.g. `joinedload(User.application)`) are applied to
+    the lookup query so callers can fetch related rows in the same round trip.
+    """
+    for stmt in _lookups(email, phone, options):
+        user = db.execute(stmt).scalars().first()
+        if user:
+            return user
+    return None
+
+
+async def find_user_async(db: AsyncSession, email: Optional[str] = None, phone: Optional[str] = None, *options) -> Optional[User]:
+    """`find_user` for AsyncSession callers."""
+    for stmt in _lookups(email, phone, options):
+        user = (await db.execute(stmt)).scalars().first()
+        if user:
+            return user
+    return None
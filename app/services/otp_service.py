@@ -1,14 +1,11 @@
 import random
 import string
-from datetime import datetime, timedelta
-from typing import Optional
-from sqlalchemy.orm import Session
-from app.models.all_models import OTP
 from app.core.config import settings
-import aiosmtplib
+from app.services.otp_store import otp_store
+from app.services.email_service import email_queue
 from email.message import EmailMessage
 
-async def send_otp_email(email_to: str, otp_code: str):
+def send_otp_email(email_to: str, otp_code: str):
     message = EmailMessage()
     message["From"] = f"{settings.SMTP_FROM_NAME} <{settings.SMTP_FROM}>"
     message["To"] = email_to
@@ -24,7 +21,7 @@ async def send_otp_email(email_to: str, otp_code: str):
                 <div style="background-color: #f8fafc; padding: 15px; text-align: center; border-radius: 8px; margin: 20px 0;">
                     <span style="font-size: 32px; font-weight: bold; letter-spacing: 5px; color: #1e3a8a;">{otp_code}</span>
                 </div>
-                <p>This code will expire in 10 minutes.</p>
+                <p>This code will expire in {settings.OTP_TTL_SECONDS // 60} minutes.</p>
                 <p>If you did not request this code, please ignore this email.</p>
                 <hr style="border: none; border-top: 1px solid #e2e8f0; margin: 20px 0;" />
                 <p style="font-size: 12px; color: #64748b;">This is an automated message. Please do not reply.</p>
@@ -35,39 +32,9 @@ async def send_otp_email(email_to: str, otp_code: str):
     message.add_alternative(content, subtype="html")
 
     if settings.SMTP_HOST and settings.SMTP_USER:
-        print("--- DEBUG: OTP CONFIGURATION ---")
-        print(f"SMTP HOST: {settings.SMTP_HOST}")
-        print(f"SMTP PORT: {settings.SMTP_PORT}")
-        print(f"SMTP USER: {settings.SMTP_USER}")
-        print(f"SMTP FROM: {settings.SMTP_FROM}")
-        print(f"FRONTEND_URL: {settings.FRONTEND_URL}")
-        print("--------------------------------")
-        
-        print(f"Attempting to send OTP email to {email_to} via {settings.SMTP_HOST}:{settings.SMTP_PORT}")
-        try:
-            # Determine TLS settings based on port
-            # Port 465: SSL/TLS (Implicit)
-            # Port 587: STARTTLS (Explicit)
-            use_ssl = settings.SMTP_PORT == 465
-            use_starttls = settings.SMTP_PORT == 587
-            
-            print(f"Using SSL: {use_ssl}, STARTTLS: {use_starttls}")
-            
-            await aiosmtplib.send(
-                message,
-                hostname=settings.SMTP_HOST,
-                port=settings.SMTP_PORT,
-                username=settings.SMTP_USER,
-                password=settings.SMTP_PASSWORD,
-                use_tls=use_ssl, 
-                start_tls=use_starttls,
-            )
-            print(f"✅ OTP email sent successfully to {email_to}")
-        except Exception as e:
-            print(f"❌ Failed to send OTP email to {email_to}: {str(e)}")
-            # Log the full error for debugging
-            import traceback
-            traceback.print_exc()
+        # Delivery happens on the background queue over a pooled SMTP connection
+        if email_queue.enqueue(message):
+            print(f"Queued OTP email to {email_to} via {settings.SMTP_HOST}:{settings.SMTP_PORT}")
     else:
         print(f"Skipping email sent (SMTP not configured). OTP for {email_to}: {otp_code}")
 
@@ -77,33 +44,15 @@ class OTPService:
         return "".join(random.choices(string.digits, k=length))
 
     @staticmethod
-    async def create_otp(db: Session, email: str, phone: str = None, purpose: str = None) -> str:
+    async def create_otp(email: str, phone: str = None, purpose: str = None) -> str:
         code = OTPService.generate_otp()
-        expires = datetime.utcnow() + timedelta(minutes=10)
-        
-        # Deactivate/Remove old OTPs for this target
-        db.query(OTP).filter(OTP.email == email, OTP.is_used == False).delete()
-        
-        db_otp = OTP(email=email, phone=phone, purpose=purpose, code=code, expires_at=expires)
-        db.add(db_otp)
-        db.commit()
-        
-        await send_otp_email(email, code)
+        # Replaces any earlier code for this email
+        await otp_store.put(email, code, settings.OTP_TTL_SECONDS, phone=phone, purpose=purpose)
+        send_otp_email(email, code)
         return code
 
     @staticmethod
-    def verify_otp(db: Session, code: str, email: str) -> bool:
-        db_otp = db.query(OTP).filter(
-            OTP.email == email,
-            OTP.code == code,
-            OTP.expires_at > datetime.utcnow(),
-            OTP.is_used == False
-        ).first()
-        
-        if db_otp:
-            db_otp.is_used = True
-            db.commit()
-            return True
-        return False
+    async def verify_otp(code: str, email: str) -> bool:
+        return await otp_store.consume(email, code)
 
 otp_service = OTPService()
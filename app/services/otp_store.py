@@ -0,0 +1,120 @@
+"""
+Storage backends for one-time passwords.
+
+Every backend keeps at most one live code per email address: `put` replaces
+any previous code and `consume` is a single atomic compare-and-delete, so a
+code can be redeemed exactly once even when two requests race.
+
+- `memory`: per-process TTL cache, for single-worker deployments.
+- `redis`:  shared store for multi-worker deployments; keys expire on their own.
+- `sql`:    the `otps` table, as a fallback when neither is available. Expired
+            rows are removed by the `otp-purge` scheduler job.
+"""
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import delete, or_
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal
+from app.models.all_models import OTP
+
+logger = logging.getLogger(__name__)
+
+
+class OTPStore(ABC):
+    @abstractmethod
+    async def put(self, email: str, code: str, ttl: int, phone: Optional[str] = None, purpose: Optional[str] = None):
+        ...
+
+    @abstractmethod
+    async def consume(self, email: str, code: str) -> bool:
+        """Delete the code for `email` if it matches and has not expired; True if it did."""
+
+    async def purge_expired(self) -> int:
+        return 0
+
+
+class MemoryOTPStore(OTPStore):
+    def __init__(self, maxsize: int = 100000):
+        self._cache = TTLCache(maxsize=maxsize, ttl=settings.OTP_TTL_SECONDS)
+
+    async def put(self, email, code, ttl, phone=None, purpose=None):
+        self._cache.set(email, code, ttl=ttl)
+
+    async def consume(self, email, code):
+        return self._cache.pop_if_equal(email, code)
+
+    async def purge_expired(self):
+        return self._cache.expire()
+
+
+class RedisOTPStore(OTPStore):
+    # GET + DEL in one server-side step so a code can't be redeemed twice
+    CONSUME_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "otp:"):
+        import redis.asyncio as redis  # only needed when this backend is selected
+
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+        self._consume = self._client.register_script(self.CONSUME_SCRIPT)
+
+    async def put(self, email, code, ttl, phone=None, purpose=None):
+        await self._client.set(self.prefix + email, code, ex=ttl)
+
+    async def consume(self, email, code):
+        return bool(await self._consume(keys=[self.prefix + email], args=[code]))
+
+
+class SQLOTPStore(OTPStore):
+    async def put(self, email, code, ttl, phone=None, purpose=None):
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(OTP).where(OTP.email == email))
+            db.add(OTP(email=email, phone=phone, purpose=purpose, code=code,
+                       expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+            await db.commit()
+
+    async def consume(self, email, code):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(OTP).where(
+                OTP.email == email,
+                OTP.code == code,
+                OTP.expires_at > datetime.utcnow(),
+                OTP.is_used == False
+            ))
+            await db.commit()
+            return result.rowcount > 0
+
+    async def purge_expired(self):
+        async with AsyncSessionLocal() as db:
+            # is_used rows are left over from before codes were deleted on use
+            result = await db.execute(delete(OTP).where(
+                or_(OTP.expires_at <= datetime.utcnow(), OTP.is_used == True)
+            ))
+            await db.commit()
+        if result.rowcount:
+            logger.info(f"Purged {result.rowcount} expired OTPs")
+        return result.rowcount
+
+
+def create_otp_store() -> OTPStore:
+    backend = settings.OTP_STORE.lower()
+    if backend == "memory":
+        return MemoryOTPStore()
+    if backend == "redis":
+        if not settings.REDIS_URL:
+            raise RuntimeError("OTP_STORE=redis requires REDIS_URL")
+        return RedisOTPStore(settings.REDIS_URL)
+    if backend == "sql":
+        return SQLOTPStore()
+    raise RuntimeError(f"Unknown OTP_STORE {settings.OTP_STORE!r}; expected memory, redis or sql")
+
+
+otp_store = create_otp_store()
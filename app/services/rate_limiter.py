@@ -0,0 +1,128 @@
+"""
+Token-bucket rate limiting.
+
+A limit is written "<burst>/<seconds>": a bucket holds up to `burst` tokens
+and refills at burst/seconds tokens per second. `hit` takes one token from
+every bucket it is given, or from none of them, and returns how long the
+caller has to wait (0 when the request is allowed).
+
+- `memory`: per-process buckets, for single-worker deployments. Each worker
+            counts on its own, so under gunicorn -w 4 a client gets up to four
+            times the configured limit.
+- `redis`:  buckets shared by all workers, updated by one Lua script per hit.
+"""
+import math
+from abc import ABC, abstractmethod
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Tuple
+from app.core.cache import TTLCache
+from app.core.config import settings
+
+
+@dataclass(frozen=True)
+class Limit:
+    burst: int
+    seconds: float
+
+    @classmethod
+    def parse(cls, spec: str) -> "Limit":
+        burst, seconds = spec.split("/")
+        return cls(int(burst), float(seconds))
+
+    @property
+    def rate(self) -> float:
+        return self.burst / self.seconds
+
+
+class RateLimiter(ABC):
+    @abstractmethod
+    async def hit(self, buckets: List[Tuple[str, Limit]]) -> float:
+        """Consume one token per bucket if all have one; else return seconds until they do."""
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, maxsize: int = 100000):
+        self._buckets = TTLCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    async def hit(self, buckets):
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, limit in buckets:
+                tokens, ts = self._buckets.get(key, (limit.burst, now))
+                tokens = min(limit.burst, tokens + (now - ts) * limit.rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / limit.rate)
+                levels.append(tokens)
+            if wait:
+                return wait
+            for (key, limit), tokens in zip(buckets, levels):
+                # An untouched bucket is full again after `seconds`, so it can be dropped then
+                self._buckets.set(key, (tokens - 1, now), ttl=limit.seconds)
+            return 0.0
+
+
+class RedisRateLimiter(RateLimiter):
+    # KEYS: bucket keys; ARGV: burst, period_ms for each key. Returns wait in ms.
+    HIT_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+    local wait = 0
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local burst = tonumber(ARGV[2 * i - 1])
+        local rate = burst / tonumber(ARGV[2 * i])
+        local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+        local tokens = tonumber(bucket[1]) or burst
+        local ts = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + (now - ts) * rate)
+        if tokens < 1 then
+            wait = math.max(wait, math.ceil((1 - tokens) / rate))
+        end
+        levels[i] = tokens
+    end
+    if wait > 0 then
+        return wait
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'ts', now)
+        redis.call('PEXPIRE', key, ARGV[2 * i])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:"):
+        import redis.asyncio as redis  # only needed when this backend is selected
+
+        self.prefix = prefix
+        self._client = redis.from_url(url, decode_responses=True)
+        self._hit = self._client.register_script(self.HIT_SCRIPT)
+
+    async def hit(self, buckets):
+        args = []
+        for _, limit in buckets:
+            args += [limit.burst, int(limit.seconds * 1000)]
+        wait_ms = await self._hit(keys=[self.prefix + key for key, _ in buckets], args=args)
+        return wait_ms / 1000
+
+
+def retry_after(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
+
+
+def create_rate_limiter() -> RateLimiter:
+    backend = settings.RATE_LIMIT_STORE.lower()
+    if backend == "memory":
+        return MemoryRateLimiter()
+    if backend == "redis":
+        if not settings.REDIS_URL:
+            raise RuntimeError("RATE_LIMIT_STORE=redis requires REDIS_URL")
+        return RedisRateLimiter(settings.REDIS_URL)
+    raise RuntimeError(f"Unknown RATE_LIMIT_STORE {settings.RATE_LIMIT_STORE!r}; expected memory or redis")
+
+
+rate_limiter = create_rate_limiter()
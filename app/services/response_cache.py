@@ -0,0 +1,101 @@
+"""
+Conditional GET support for the applicant read endpoints.
+
+Each response is tagged with a version of the applicant's data: a hash of the
+user's status fields and `Application.updated_at` (which moves on every write
+to the application), read with one narrow query. A client presenting that tag
+in If-None-Match gets a 304 without the application being loaded; otherwise
+the serialized body is served from a per-worker cache keyed by user, endpoint
+and version, so a body is only built once per version.
+
+A stale cache entry can never be served, since its version no longer matches;
+writers still call `invalidate` so dead bodies don't sit in memory until they
+expire.
+"""
+import hashlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+from fastapi import Response
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.responses import dumps
+from app.models.all_models import Application, Payment, User
+
+
+@dataclass(frozen=True)
+class ResourceVersion:
+    user_id: int
+    application_id: Optional[int]
+    tag: str
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.tag}"'
+
+
+def _version_stmt(criterion):
+    latest_payment = select(func.max(Payment.id)).where(
+        Payment.user_id == User.id, Payment.status == "success"
+    ).scalar_subquery()
+    return select(
+        User.id, User.full_name, User.email, User.phone, User.payment_status, User.application_status,
+        Application.id.label("application_id"), Application.updated_at, latest_payment.label("payment_id")
+    ).outerjoin(Application, Application.user_id == User.id).where(criterion).order_by(User.id).limit(1)
+
+
+def find_version(db: Session, *criteria) -> Optional[ResourceVersion]:
+    """Version of the first user matching any of `criteria`, tried in order; None if no user matches."""
+    for criterion in criteria:
+        row = db.execute(_version_stmt(criterion)).first()
+        if row:
+            digest = hashlib.sha1(repr(tuple(row)).encode()).hexdigest()[:20]
+            return ResourceVersion(row.id, row.application_id, digest)
+    return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
+
+class ResponseCache:
+    """Per-worker LRU/TTL cache of {endpoint: (version tag, body)} per user id."""
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.RESPONSE_CACHE_TTL_SECONDS)
+
+    def get(self, user_id: int, endpoint: str, tag: str) -> Optional[bytes]:
+        entry = (self._cache.get(user_id) or {}).get(endpoint)
+        return entry[1] if entry and entry[0] == tag else None
+
+    def put(self, user_id: int, endpoint: str, tag: str, body: bytes):
+        # Entries are replaced, never mutated, so readers need no lock
+        bodies: Dict[str, tuple] = dict(self._cache.get(user_id) or {})
+        bodies[endpoint] = (tag, body)
+        self._cache.set(user_id, bodies)
+
+    def invalidate(self, user_id: Optional[int]):
+        if user_id is not None:
+            self._cache.pop(user_id)
+
+    def respond(self, endpoint: str, version: ResourceVersion, if_none_match: Optional[str],
+                build: Callable[[], Any]) -> Response:
+        """304 if the client has `version`, else the cached body, built by `build()` on a miss."""
+        headers = {"ETag": version.etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, version.etag):
+            return Response(status_code=304, headers=headers)
+        body = self.get(version.user_id, endpoint, version.tag)
+        if body is None:
+            body = dumps(build())
+            self.put(version.user_id, endpoint, version.tag, body)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+response_cache = ResponseCache()
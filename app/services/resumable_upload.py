@@ -0,0 +1,347 @@
+"""
+Resumable (tus-style) uploads for large documents over unreliable connections.
+
+The client creates an upload with its total length and then PATCHes the
+bytes, in as many requests as it needs, each one starting at the current
+offset (HEAD reports it). A dropped request keeps everything that arrived
+before the drop, so the client resumes from there instead of from zero.
+Once every byte is in, the upload is completed into a Document.
+
+Chunks are appended to a part file in the blob store's staging directory.
+With RESUMABLE_UPLOAD_STORAGE=s3 they are sent on as S3 multipart parts of
+RESUMABLE_UPLOAD_PART_BYTES, and only the part being filled waits in a
+local spill file. Memory use is one chunk either way, and completing never
+reads the file into memory. These files must be on storage every worker
+sees.
+
+Progress is checkpointed to the database every RESUMABLE_UPLOAD_PART_BYTES
+and at the end of each PATCH. A PATCH holds the upload for up to
+RESUMABLE_UPLOAD_LOCK_SECONDS, renewed at every checkpoint, so two requests
+can't write it at once. Uploads idle for RESUMABLE_UPLOAD_EXPIRES_SECONDS
+are purged by a scheduled job.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional
+from botocore.exceptions import ClientError
+from sqlalchemy import or_
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.all_models import ResumableUpload
+from app.services.blob_store import BACKENDS
+from app.services.document_service import user_upload_prefix
+from app.services.s3_service import s3_service
+from app.services.upload_service import (
+    MIME_TYPES, SNIFF_BYTES, StoredUpload, UploadRejected, canonical_extension, check_kind, remove_file
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _buffer_path(upload: ResumableUpload) -> str:
+    # The whole file for local uploads, the part being filled for S3 ones
+    suffix = "spill" if upload.storage == "s3" else "part"
+    return os.path.join(BACKENDS["local"].staging_dir, f"{upload.id}.{suffix}")
+
+
+def _check_head(upload: ResumableUpload, head: bytes):
+    ext = canonical_extension(upload.file_name)
+    check_kind(head, ext, {ext})
+
+
+class ChunkWriter:
+    """
+    Appends the body of one PATCH at the upload's offset. Blocking; async
+    callers run every call in the threadpool.
+
+    Bytes past the last checkpoint (left by a crash) are dropped on open.
+    The offset clients see is the checkpointed one, so nothing is lost.
+    """
+
+    def __init__(self, upload: ResumableUpload, checkpoint: Callable[[int, List[dict]], None]):
+        self.upload = upload
+        self.checkpoint = checkpoint
+        self.parts = list(upload.parts or [])
+        self.part_size = upload.part_size or settings.RESUMABLE_UPLOAD_PART_BYTES
+        # Every part but the last is part_size; parts recorded before sizes were kept are all full ones
+        self.sent = sum(part.get("Size", self.part_size) for part in self.parts)
+        path = _buffer_path(upload)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.handle = open(path, "r+b" if os.path.exists(path) else "w+b")
+        on_disk = os.fstat(self.handle.fileno()).st_size
+        self.received = self.sent + min(upload.received - self.sent, on_disk)
+        self.handle.seek(self.received - self.sent)
+        self.handle.truncate()
+        self.since_checkpoint = 0
+        # The type is checked once the leading bytes are in, before anything goes to S3
+        self.checked = self.received >= SNIFF_BYTES
+        self.head = b""
+        if not self.checked:
+            self.handle.seek(0)
+            self.head = self.handle.read()
+            self.handle.seek(self.received)
+
+    @property
+    def buffered(self) -> int:
+        return self.received - self.sent
+
+    def write(self, chunk: bytes):
+        if self.received + len(chunk) > self.upload.length:
+            raise UploadRejected(413, "Upload exceeds its declared length")
+        if not self.checked:
+            self.head = (self.head + chunk)[:SNIFF_BYTES]
+            if len(self.head) >= SNIFF_BYTES:
+                _check_head(self.upload, self.head)
+                self.checked = True
+        view = memoryview(chunk)
+        while view:
+            take = view
+            if self.upload.storage == "s3":
+                take = view[:self.part_size - self.buffered]
+            self.handle.write(take)
+            self.received += len(take)
+            self.since_checkpoint += len(take)
+            view = view[len(take):]
+            if self.upload.storage == "s3" and self.buffered == self.part_size:
+                self._send_part()
+            elif self.since_checkpoint >= self.part_size:
+                self._sync()
+                self.checkpoint(self.received, self.parts)
+                self.since_checkpoint = 0
+
+    def _sync(self):
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def _send_part(self):
+        self.handle.flush()
+        self.handle.seek(0)
+        number = len(self.parts) + 1
+        etag = s3_service.upload_part(self.upload.s3_key, self.upload.s3_upload_id, number, self.handle)
+        self.parts.append({"PartNumber": number, "ETag": etag, "Size": self.buffered})
+        self.sent = self.received
+        self.handle.seek(0)
+        self.handle.truncate()
+        self.checkpoint(self.received, self.parts)
+        self.since_checkpoint = 0
+
+    def finish(self):
+        """Check what couldn't be checked while writing and send the last S3 part."""
+        if not self.checked:
+            # Files shorter than SNIFF_BYTES
+            _check_head(self.upload, self.head)
+            self.checked = True
+        if self.upload.storage == "s3" and (self.buffered or not self.parts):
+            self._send_part()
+
+    def close(self):
+        if self.handle.closed:
+            return
+        self._sync()
+        self.handle.close()
+
+
+class ResumableUploadService:
+    @staticmethod
+    def _load(db, upload_id: str, user_id: int) -> Optional[ResumableUpload]:
+        return db.query(ResumableUpload).filter(
+            ResumableUpload.id == upload_id,
+            ResumableUpload.user_id == user_id,
+            ResumableUpload.expires_at > datetime.utcnow(),
+        ).first()
+
+    def create(self, user_id: int, document_type: str, file_name: str, length: int) -> ResumableUpload:
+        ext = canonical_extension(file_name)
+        if ext not in MIME_TYPES:
+            raise UploadRejected(400, "Unsupported file format")
+        if length > settings.RESUMABLE_UPLOAD_MAX_BYTES:
+            raise UploadRejected(413, f"File too large (Max {settings.RESUMABLE_UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+        storage = settings.RESUMABLE_UPLOAD_STORAGE
+        if storage == "s3" and not s3_service.configured:
+            raise UploadRejected(503, "Cloud storage (S3) is not configured")
+
+        now = datetime.utcnow()
+        upload = ResumableUpload(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            document_type=document_type,
+            file_name=file_name,
+            mime_type=MIME_TYPES[ext],
+            length=length,
+            received=0,
+            storage=storage,
+            parts=[],
+            created_at=now,
+            expires_at=now + timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES_SECONDS),
+        )
+        if storage == "s3":
+            upload.s3_key = f"{user_upload_prefix(user_id)}{document_type}_{upload.id}.{ext}"
+            upload.part_size = settings.RESUMABLE_UPLOAD_PART_BYTES
+            upload.s3_upload_id = s3_service.create_multipart(upload.s3_key, upload.mime_type)
+        with SessionLocal() as db:
+            db.add(upload)
+            db.commit()
+            db.refresh(upload)
+            db.expunge(upload)
+        return upload
+
+    def get(self, upload_id: str, user_id: int) -> ResumableUpload:
+        with SessionLocal() as db:
+            upload = self._load(db, upload_id, user_id)
+            if upload is None:
+                raise UploadRejected(404, "Upload not found")
+            db.expunge(upload)
+        return upload
+
+    def claim(self, upload_id: str, user_id: int) -> ResumableUpload:
+        """Hold the upload for one writing request; 423 while another one does."""
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            claimed = db.query(ResumableUpload).filter(
+                ResumableUpload.id == upload_id,
+                ResumableUpload.user_id == user_id,
+                ResumableUpload.expires_at > now,
+                or_(ResumableUpload.locked_until.is_(None), ResumableUpload.locked_until < now),
+            ).update(
+                {"locked_until": now + timedelta(seconds=settings.RESUMABLE_UPLOAD_LOCK_SECONDS)},
+                synchronize_session=False,
+            )
+            db.commit()
+            upload = self._load(db, upload_id, user_id)
+            if upload is None:
+                raise UploadRejected(404, "Upload not found")
+            if not claimed:
+                raise UploadRejected(423, "Upload is busy with another request")
+            db.expunge(upload)
+        return upload
+
+    @staticmethod
+    def _save(upload_id: str, received: Optional[int], parts: Optional[List[dict]], locked: bool):
+        now = datetime.utcnow()
+        values = {"locked_until": now + timedelta(seconds=settings.RESUMABLE_UPLOAD_LOCK_SECONDS) if locked else None}
+        if received is not None:
+            values.update({
+                "received": received,
+                "parts": parts,
+                "expires_at": now + timedelta(seconds=settings.RESUMABLE_UPLOAD_EXPIRES_SECONDS),
+            })
+        with SessionLocal() as db:
+            db.query(ResumableUpload).filter(ResumableUpload.id == upload_id).update(values, synchronize_session=False)
+            db.commit()
+
+    def _checkpoint(self, upload: ResumableUpload) -> Callable[[int, List[dict]], None]:
+        return partial(self._save, upload.id, locked=True)
+
+    def release(self, upload_id: str, received: Optional[int] = None, parts: Optional[List[dict]] = None):
+        """Unlock the upload, recording the progress made if given."""
+        self._save(upload_id, received, parts, locked=False)
+
+    async def append(self, upload_id: str, user_id: int, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """
+        Write one PATCH body at `offset` and return the new offset. Whatever
+        arrived before an error or a dropped connection is kept. Content that
+        turns out not to match the file type ends the upload.
+        """
+        upload = await run_in_threadpool(self.claim, upload_id, user_id)
+        writer = None
+        try:
+            writer = await run_in_threadpool(ChunkWriter, upload, self._checkpoint(upload))
+            if offset != writer.received:
+                raise UploadRejected(409, f"Upload-Offset must be {writer.received}")
+            async for chunk in chunks:
+                if chunk:
+                    await run_in_threadpool(writer.write, chunk)
+        except UploadRejected as e:
+            if e.status_code == 400:
+                await run_in_threadpool(self.discard, upload, writer)
+            raise
+        finally:
+            if writer is None:
+                await run_in_threadpool(self.release, upload.id)
+            elif not writer.handle.closed:
+                await run_in_threadpool(writer.close)
+                await run_in_threadpool(self.release, upload.id, writer.received, writer.parts)
+        return writer.received
+
+    def assemble(self, upload: ResumableUpload) -> StoredUpload:
+        """
+        Put a fully received (and claimed) upload together: the local file,
+        hashed while streaming it from disk, or the completed S3 object
+        (`path` is then its key and there is no hash).
+        """
+        writer = ChunkWriter(upload, self._checkpoint(upload))
+        try:
+            if writer.received != upload.length:
+                raise UploadRejected(409, f"Upload is incomplete ({writer.received} of {upload.length} bytes)")
+            try:
+                writer.finish()
+            except UploadRejected:
+                self.discard(upload, writer)
+                raise
+        finally:
+            writer.close()
+
+        if upload.storage == "s3":
+            self._complete_multipart(upload, writer.parts)
+            remove_file(_buffer_path(upload))
+            return StoredUpload(path=upload.s3_key, size=upload.length, sha256=None, mime_type=upload.mime_type)
+
+        path = _buffer_path(upload)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(settings.UPLOAD_CHUNK_BYTES):
+                digest.update(chunk)
+        return StoredUpload(path=path, size=upload.length, sha256=digest.hexdigest(), mime_type=upload.mime_type)
+
+    @staticmethod
+    def _complete_multipart(upload: ResumableUpload, parts: List[dict]):
+        try:
+            s3_service.complete_multipart(
+                upload.s3_key, upload.s3_upload_id, [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in parts]
+            )
+        except ClientError:
+            # Already completed by an earlier attempt whose database write failed
+            head = s3_service.head(upload.s3_key)
+            if not head or head.get("ContentLength") != upload.length:
+                raise
+
+    @staticmethod
+    def _cleanup(upload: ResumableUpload):
+        remove_file(_buffer_path(upload))
+        if upload.s3_upload_id:
+            s3_service.abort_multipart(upload.s3_key, upload.s3_upload_id)
+
+    def discard(self, upload: ResumableUpload, writer: Optional[ChunkWriter] = None):
+        """Drop the upload and everything received for it."""
+        if writer is not None:
+            writer.close()
+        self._cleanup(upload)
+        with SessionLocal() as db:
+            db.query(ResumableUpload).filter(ResumableUpload.id == upload.id).delete(synchronize_session=False)
+            db.commit()
+
+    def terminate(self, upload_id: str, user_id: int):
+        self.discard(self.claim(upload_id, user_id))
+
+    def purge_expired(self) -> int:
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            expired = db.query(ResumableUpload).filter(
+                ResumableUpload.expires_at < now,
+                or_(ResumableUpload.locked_until.is_(None), ResumableUpload.locked_until < now),
+            ).all()
+            for upload in expired:
+                self._cleanup(upload)
+                db.delete(upload)
+            db.commit()
+        if expired:
+            logger.info(f"Purged {len(expired)} expired resumable uploads")
+        return len(expired)
+
+
+resumable_uploads = ResumableUploadService()
@@ -1,20 +1,54 @@
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from app.core.config import settings
+from typing import Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
 class S3Service:
+    """
+    Document storage in S3 (or an S3-compatible endpoint such as MinIO, via
+    AWS_S3_ENDPOINT_URL).
+
+    Uploads and downloads go straight between the browser and the bucket on
+    presigned requests; the API only signs them and checks the result with a
+    HEAD. Every method here is a blocking boto3 call, so async handlers run
+    them in the threadpool.
+    """
+
     def __init__(self):
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-            region_name=settings.AWS_S3_REGION
+            region_name=settings.AWS_S3_REGION,
+            endpoint_url=settings.AWS_S3_ENDPOINT_URL,
+            config=Config(
+                signature_version="s3v4",
+                # Local stand-ins don't resolve bucket subdomains
+                s3={"addressing_style": "path" if settings.AWS_S3_ENDPOINT_URL else "auto"},
+            ),
         )
         self.bucket_name = settings.AWS_S3_BUCKET
 
+    @property
+    def configured(self) -> bool:
+        return bool(settings.AWS_ACCESS_KEY_ID and self.bucket_name)
+
+    def object_url(self, object_name: str) -> str:
+        if settings.AWS_S3_ENDPOINT_URL:
+            return f"{settings.AWS_S3_ENDPOINT_URL.rstrip('/')}/{self.bucket_name}/{object_name}"
+        return f"https://{self.bucket_name}.s3.{settings.AWS_S3_REGION}.amazonaws.com/{object_name}"
+
+    def key_from_url(self, url: Optional[str]) -> Optional[str]:
+        """Object key of a URL built by `object_url`, or None for anything else (e.g. local paths)."""
+        prefix = self.object_url("")
+        if url and url.startswith(prefix) and len(url) > len(prefix):
+            return url[len(prefix):]
+        return None
+
     def upload_file(self, file_obj, object_name):
         """Upload a file to an S3 bucket and return the public URL"""
         try:
@@ -24,12 +58,85 @@ class S3Service:
                 object_name,
                 # ExtraArgs={'ACL': 'public-read'} # Uncomment if bucket allows public read
             )
-            
-            # Generate the URL
-            url = f"https://{self.bucket_name}.s3.{settings.AWS_S3_REGION}.amazonaws.com/{object_name}"
-            return url
+            return self.object_url(object_name)
         except ClientError as e:
             logger.error(f"S3 Upload Error: {e}")
             return None
 
+    def presigned_post(self, object_name: str, content_type: str, max_bytes: int, expires: int) -> dict:
+        """Form POST upload; S3 itself rejects other content types and sizes outside 1..max_bytes."""
+        return self.s3_client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=object_name,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_bytes]],
+            ExpiresIn=expires,
+        )
+
+    def presigned_put(
+        self, object_name: str, content_type: str, size: int, expires: int, sha256_b64: Optional[str] = None
+    ) -> str:
+        """
+        PUT upload; Content-Type and Content-Length are signed, so the client must send exactly these.
+        With `sha256_b64` the x-amz-checksum-sha256 header is signed too and S3 verifies the content against it.
+        """
+        params = {"Bucket": self.bucket_name, "Key": object_name, "ContentType": content_type, "ContentLength": size}
+        if sha256_b64:
+            params["ChecksumSHA256"] = sha256_b64
+        return self.s3_client.generate_presigned_url("put_object", Params=params, ExpiresIn=expires)
+
+    def presigned_get(self, object_name: str, expires: int, file_name: Optional[str] = None) -> str:
+        params = {"Bucket": self.bucket_name, "Key": object_name}
+        if file_name:
+            safe_name = file_name.replace('"', "").replace("\\", "")
+            params["ResponseContentDisposition"] = f'attachment; filename="{safe_name}"'
+        return self.s3_client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+    def upload_path(self, path: str, object_name: str, content_type: Optional[str] = None):
+        extra = {"ContentType": content_type} if content_type else None
+        self.s3_client.upload_file(path, self.bucket_name, object_name, ExtraArgs=extra)
+
+    def copy(self, source_name: str, object_name: str):
+        # Server-side copy, the bytes never leave S3
+        self.s3_client.copy_object(
+            Bucket=self.bucket_name, Key=object_name, CopySource={"Bucket": self.bucket_name, "Key": source_name}
+        )
+
+    def head(self, object_name: str, checksum: bool = False) -> Optional[dict]:
+        """Object metadata (with its stored checksums if `checksum`), or None if it doesn't exist."""
+        try:
+            params = {"ChecksumMode": "ENABLED"} if checksum else {}
+            return self.s3_client.head_object(Bucket=self.bucket_name, Key=object_name, **params)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def create_multipart(self, object_name: str, content_type: str) -> str:
+        return self.s3_client.create_multipart_upload(
+            Bucket=self.bucket_name, Key=object_name, ContentType=content_type
+        )["UploadId"]
+
+    def upload_part(self, object_name: str, upload_id: str, number: int, body) -> str:
+        return self.s3_client.upload_part(
+            Bucket=self.bucket_name, Key=object_name, UploadId=upload_id, PartNumber=number, Body=body
+        )["ETag"]
+
+    def complete_multipart(self, object_name: str, upload_id: str, parts: list):
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket_name, Key=object_name, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+
+    def abort_multipart(self, object_name: str, upload_id: str):
+        try:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket_name, Key=object_name, UploadId=upload_id)
+        except ClientError as e:
+            logger.error(f"S3 Abort Error: {e}")
+
+    def delete(self, object_name: str):
+        try:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=object_name)
+        except ClientError as e:
+            logger.error(f"S3 Delete Error: {e}")
+
 s3_service = S3Service()
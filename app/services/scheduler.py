@@ -0,0 +1,48 @@
+import asyncio
+import inspect
+import logging
+from typing import Callable, List, Tuple
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicScheduler:
+    """
+    Runs maintenance jobs on a fixed interval inside each API worker.
+
+    Jobs must be idempotent: with several gunicorn workers every worker runs
+    its own copy. Synchronous jobs are executed in the threadpool so they never
+    block the event loop.
+    """
+
+    def __init__(self):
+        self._jobs: List[Tuple[str, float, Callable]] = []
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(self, name: str, interval_seconds: float, func: Callable):
+        self._jobs.append((name, interval_seconds, func))
+
+    async def start(self):
+        for name, interval, func in self._jobs:
+            self._tasks.append(asyncio.create_task(self._run(name, interval, func), name=name))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, name: str, interval: float, func: Callable):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if inspect.iscoroutinefunction(func):
+                    await func()
+                else:
+                    await run_in_threadpool(func)
+            except Exception:
+                logger.exception(f"Scheduled job {name} failed")
+
+
+scheduler = PeriodicScheduler()
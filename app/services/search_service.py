@@ -0,0 +1,101 @@
+import re
+from typing import Any, List, Optional, Tuple
+from sqlalchemy import func, literal, literal_column, text
+from sqlalchemy.orm import Session
+from app.db.dialect import is_postgres
+from app.models.all_models import User, Application
+
+# Keys read from the JSON sections. The submit flow stores nested objects
+# ({"personal": {...}}) while /student/internal/update stores flat fields, so
+# each entry lists (section, path) candidates in both shapes.
+SECTION_FIELDS = {
+    "father_name": [("personal_details", ("personal", "fatherName")), ("personal_details", ("personal", "father_name")),
+                    ("personal_details", ("father_name",))],
+    "category": [("personal_details", ("personal", "category")), ("personal_details", ("category",))],
+    "ug_university": [("academic_details", ("ugEducation", "university")), ("academic_details", ("ug_university",))],
+    "pg_university": [("academic_details", ("pgEducation", "university")), ("academic_details", ("pg_university",))],
+}
+
+_TOKEN = re.compile(r"[\w@.+-]+", re.UNICODE)
+_TSQUERY_SAFE = re.compile(r"[^\w]+", re.UNICODE)
+_LIKE_SPECIAL = re.compile(r"([\\%_])")
+
+
+def like_pattern(term: str) -> str:
+    """A `%term%` LIKE pattern matching `term` literally (use with escape="\\")."""
+    return "%" + _LIKE_SPECIAL.sub(r"\\\1", term) + "%"
+
+
+def section_value(app: Application, field: str) -> Optional[Any]:
+    for section, path in SECTION_FIELDS[field]:
+        value = getattr(app, section) or {}
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def build_search_document(user: Optional[User], app: Application) -> str:
+    parts = [app.department, app.specialization]
+    if user:
+        digits = "".join(filter(str.isdigit, user.phone or ""))
+        parts += [user.full_name, user.email, digits, digits[-10:]]
+    parts += [section_value(app, field) for field in SECTION_FIELDS]
+    return " ".join(str(p).strip().lower() for p in parts if p)
+
+
+def refresh_search_document(app: Application, user: Optional[User] = None):
+    """Recompute the stored search text; call before committing changes to an application."""
+    app.search_document = build_search_document(user or app.user, app)
+
+
+class SearchService:
+    def __init__(self):
+        self._has_trigram = None
+
+    def has_trigram(self, db: Session) -> bool:
+        if self._has_trigram is None:
+            self._has_trigram = bool(db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first())
+        return self._has_trigram
+
+    def search(self, db: Session, q: str, offset: int, limit: int, mode: Optional[str] = None) -> Tuple[List[Any], str]:
+        """
+        Return one page of ranked matches and the mode that produced them.
+
+        On PostgreSQL the tsvector index is tried first (prefix matching on every
+        term). If that finds nothing the trigram index handles typos and partial
+        phone numbers. Other databases fall back to a substring scan.
+        """
+        columns = [
+            Application.id.label("application_id"), Application.user_id, User.full_name, User.email, User.phone,
+            Application.campus_preference.label("campus"), Application.department, Application.specialization,
+            Application.status
+        ]
+        base = db.query(*columns).join(User, User.id == Application.user_id)
+        document = Application.search_document
+        q = q.strip().lower()
+
+        if is_postgres(db):
+            terms = [t for t in (_TSQUERY_SAFE.sub("", t) for t in _TOKEN.findall(q)) if t]
+            if mode in (None, "fts") and terms:
+                vector = func.to_tsvector(literal_column("'simple'"), document)
+                query = func.to_tsquery(literal_column("'simple'"), " & ".join(f"{t}:*" for t in terms))
+                rank = func.ts_rank(vector, query)
+                rows = base.add_columns(rank.label("rank")).filter(vector.op("@@")(query)) \
+                    .order_by(rank.desc(), Application.id.desc()).offset(offset).limit(limit).all()
+                if rows or mode == "fts":
+                    return rows, "fts"
+            if self.has_trigram(db):
+                similarity = func.word_similarity(q, document)
+                rows = base.add_columns(similarity.label("rank")).filter(literal(q).op("<%")(document)) \
+                    .order_by(similarity.desc(), Application.id.desc()).offset(offset).limit(limit).all()
+                return rows, "trgm"
+
+        terms = _TOKEN.findall(q) or [q]
+        rows = base.filter(*[document.like(like_pattern(t), escape="\\") for t in terms]) \
+            .order_by(Application.id.desc()).offset(offset).limit(limit).all()
+        return rows, "like"
+
+
+search_service = SearchService()
@@ -0,0 +1,150 @@
+import logging
+from datetime import date, datetime
+from typing import Optional
+from sqlalchemy import func, literal, select, text, true, union_all
+from sqlalchemy.orm import Session
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.dialect import is_postgres, upsert_insert
+from app.db.session import SessionLocal
+from app.models.all_models import (
+    User, Application, ApplicationCache, ApplicationStatus, Payment, StatCounter, DailyRegistration
+)
+
+logger = logging.getLogger(__name__)
+
+REGISTERED = "registered_students"
+PAID = "payments_completed"
+SUBMITTED = "applications_filled"
+PENDING = "applications_pending"
+COUNTERS = (REGISTERED, PAID, SUBMITTED, PENDING)
+
+
+class StatsService:
+    """
+    Admin dashboard counters kept in `stat_counters` / `daily_registrations`.
+
+    Writers call the `record_*` / `increment` helpers on their own session so the
+    counter moves in the same transaction as the change it counts. `reconcile`
+    recomputes everything from the source tables to repair any drift.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=1, ttl=settings.STATS_CACHE_TTL_SECONDS)
+
+    @staticmethod
+    def _add(db: Session, model, key_column: str, key, value_column: str, delta: int):
+        insert = upsert_insert(db)
+        if insert is not None:
+            stmt = insert(model).values({key_column: key, value_column: delta})
+            column = getattr(model, value_column)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[key_column],
+                set_={value_column: column + getattr(stmt.excluded, value_column)}
+            ))
+            return
+        updated = db.query(model).filter(getattr(model, key_column) == key).update(
+            {value_column: getattr(model, value_column) + delta}, synchronize_session=False
+        )
+        if not updated:
+            db.add(model(**{key_column: key, value_column: delta}))
+
+    def increment(self, db: Session, name: str, delta: int = 1):
+        if delta:
+            self._add(db, StatCounter, "name", name, "value", delta)
+
+    def record_registration(self, db: Session, when: datetime = None):
+        day = (when or datetime.utcnow()).date()
+        self.increment(db, REGISTERED)
+        self._add(db, DailyRegistration, "day", day, "count", 1)
+
+    @staticmethod
+    def _totals_select():
+        # One row per counter, computed by the statement that writes them
+        return union_all(
+            select(literal(REGISTERED).label("name"), select(func.count(User.id)).scalar_subquery().label("value")),
+            select(literal(PAID), select(func.count(Payment.id)).where(Payment.status == "success").scalar_subquery()),
+            select(literal(SUBMITTED), select(func.count(Application.id))
+                   .where(Application.status != ApplicationStatus.DRAFT).scalar_subquery()),
+            select(literal(PENDING), select(func.count(ApplicationCache.id)).scalar_subquery()),
+        ).subquery()
+
+    @staticmethod
+    def _trend_select():
+        day = func.date(User.created_at)
+        return select(day.label("day"), func.count(User.id).label("count")) \
+            .where(User.created_at.isnot(None)).group_by(day).subquery()
+
+    def _write_totals(self, db: Session):
+        """Upsert the recomputed totals, counting and writing in single statements."""
+        insert = upsert_insert(db)
+        totals, trend = self._totals_select(), self._trend_select()
+        # SQLite needs a WHERE on INSERT ... SELECT ... ON CONFLICT to parse it
+        stmt = insert(StatCounter).from_select(["name", "value"], select(totals.c.name, totals.c.value).where(true()))
+        db.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"value": stmt.excluded.value}))
+        stmt = insert(DailyRegistration).from_select(["day", "count"], select(trend.c.day, trend.c.count).where(true()))
+        db.execute(stmt.on_conflict_do_update(index_elements=["day"], set_={"count": stmt.excluded.count}))
+        db.query(DailyRegistration).filter(DailyRegistration.day.notin_(select(trend.c.day))) \
+            .delete(synchronize_session=False)
+
+    def _write_totals_orm(self, db: Session):
+        totals = db.execute(select(self._totals_select())).all()
+        for name, value in totals:
+            counter = db.get(StatCounter, name)
+            if counter:
+                counter.value = value
+            else:
+                db.add(StatCounter(name=name, value=value))
+        db.query(DailyRegistration).delete(synchronize_session=False)
+        for row in db.execute(select(self._trend_select())).all():
+            day = row.day if isinstance(row.day, date) else date.fromisoformat(str(row.day))
+            db.add(DailyRegistration(day=day, count=row.count))
+
+    def reconcile(self, db: Session, only_if_empty: bool = False) -> Optional[dict]:
+        """
+        Recompute every counter from the source tables. Returns the totals, or
+        None when `only_if_empty` and the counters are already seeded.
+
+        Every worker runs this, at startup and on a schedule, so on PostgreSQL
+        the runs are serialized with an advisory lock. The existing counter
+        rows are locked before counting: an increment still in flight commits
+        first and is counted, and later ones wait and then add on top.
+        """
+        if is_postgres(db):
+            db.execute(text("SELECT pg_advisory_xact_lock(hashtext('vignan_stats_reconcile'))"))
+            db.query(StatCounter).order_by(StatCounter.name).with_for_update().all()
+            db.query(DailyRegistration).order_by(DailyRegistration.day).with_for_update().all()
+        if only_if_empty and db.query(StatCounter).first():
+            db.rollback()
+            return None
+        if upsert_insert(db) is None:
+            self._write_totals_orm(db)
+        else:
+            self._write_totals(db)
+        db.commit()
+        self._cache.clear()
+        return {c.name: c.value for c in db.query(StatCounter).all()}
+
+    def reconcile_job(self, only_if_empty: bool = False):
+        db = SessionLocal()
+        try:
+            totals = self.reconcile(db, only_if_empty)
+            if totals is not None:
+                logger.info(f"Stats reconciled: {totals}")
+        finally:
+            db.close()
+
+    def snapshot(self, db: Session) -> dict:
+        cached = self._cache.get("stats")
+        if cached is not None:
+            return cached
+
+        counters = {c.name: c.value for c in db.query(StatCounter).all()}
+        trend = db.query(DailyRegistration).order_by(DailyRegistration.day).all()
+        result = {name: counters.get(name, 0) for name in COUNTERS}
+        result["registration_trend"] = [{"date": str(r.day), "count": r.count} for r in trend if r.count]
+        self._cache.set("stats", result)
+        return result
+
+
+stats_service = StatsService()
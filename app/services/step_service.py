@@ -0,0 +1,301 @@
+"""
+Persistence for autosaved application steps (`application_cache`).
+
+`upsert_steps` merges drafts into their session rows with INSERT ... ON CONFLICT,
+touching only the posted steps. With STEP_WRITE_BEHIND on, `save_step` hands
+drafts to `step_buffer` instead, which keeps the latest data per
+(session_id, step) in memory and writes them out in one multi-row upsert every
+STEP_FLUSH_INTERVAL_MS or once STEP_FLUSH_MAX_ENTRIES steps are waiting.
+
+Every write bumps the row's `version`. `patch_step` applies a JSON Patch to a
+single step against a known version, which clients send as If-Match.
+
+The buffer is per worker: a worker sees its own unflushed steps, other workers
+see them after the next flush.
+"""
+import json
+import logging
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import jsonpatch
+from sqlalchemy import JSON, Text, cast, func, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.db.dialect import is_postgres, upsert_insert
+from app.db.session import SessionLocal
+from app.models.all_models import ApplicationCache
+from app.services.stats_service import stats_service, PENDING
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StepDraft:
+    session_id: str
+    user_id: str
+    steps: Dict[str, Any] = field(default_factory=dict)
+
+
+def _upsert_orm(db: Session, draft: StepDraft) -> ApplicationCache:
+    # Databases without ON CONFLICT: lock the row and rewrite the blob
+    cache = db.query(ApplicationCache).filter(ApplicationCache.session_id == draft.session_id).with_for_update().first()
+    if cache is None:
+        cache = ApplicationCache(session_id=draft.session_id, user_id=draft.user_id, steps={})
+        db.add(cache)
+    else:
+        cache.version += 1
+    cache.steps = {**(cache.steps or {}), **draft.steps}
+    return cache
+
+
+def _merged_steps(db: Session, steps: Dict[str, Any], pg_steps=None):
+    """SQL expression for the stored `steps` with the top-level keys of `steps` replaced."""
+    if is_postgres(db):
+        # jsonb || replaces just the top-level keys present on the right
+        patch = pg_steps if pg_steps is not None else cast(steps, JSONB)
+        return func.coalesce(ApplicationCache.steps, cast({}, JSONB)).op("||")(patch)
+    args = []
+    for step_name, data in steps.items():
+        args += [f'$."{step_name}"', func.json(json.dumps(data))]
+    return func.json_set(func.coalesce(ApplicationCache.steps, "{}"), *args)
+
+
+def upsert_steps(db: Session, drafts: List[StepDraft]) -> Dict[str, int]:
+    """
+    Merge each draft's steps into its session row, creating rows as needed.
+
+    Returns the new version of every session; version 1 means the row was just
+    created, which callers use to move the pending counter. The caller commits.
+    Session ids must be unique within `drafts`.
+    """
+    insert = upsert_insert(db)
+    if insert is None:
+        versions = {}
+        for draft in drafts:
+            cache = _upsert_orm(db, draft)
+            db.flush()
+            versions[draft.session_id] = cache.version
+        return versions
+
+    now = datetime.utcnow()
+
+    def statement(batch: List[StepDraft]):
+        return insert(ApplicationCache).values([
+            {"session_id": d.session_id, "user_id": d.user_id, "steps": d.steps, "version": 1, "updated_at": now}
+            for d in batch
+        ])
+
+    def upsert(stmt, merged_steps) -> Dict[str, int]:
+        rows = db.execute(stmt.on_conflict_do_update(
+            index_elements=[ApplicationCache.session_id],
+            set_={"steps": merged_steps, "version": ApplicationCache.version + 1, "updated_at": now},
+        ).returning(ApplicationCache.session_id, ApplicationCache.version)).all()
+        return {row.session_id: row.version for row in rows}
+
+    if is_postgres(db):
+        stmt = statement(drafts)
+        return upsert(stmt, _merged_steps(db, {}, pg_steps=stmt.excluded.steps))
+
+    # SQLite: json_set takes the paths as arguments, so each row gets its own statement
+    versions = {}
+    for draft in drafts:
+        versions.update(upsert(statement([draft]), _merged_steps(db, draft.steps)))
+    return versions
+
+
+def step_sizes_column(db: Session):
+    """Per-row {step name: size of its JSON in bytes}, computed in the database so the blobs never leave it."""
+    if is_postgres(db):
+        each = func.jsonb_each(ApplicationCache.steps).table_valued("key", "value")
+        agg = func.jsonb_object_agg(each.c.key, func.octet_length(cast(each.c.value, Text)), type_=JSONB)
+    else:
+        each = func.json_each(ApplicationCache.steps).table_valued("key", "value")
+        agg = func.json_group_object(each.c.key, func.length(each.c.value), type_=JSON)
+    return select(agg).select_from(each).scalar_subquery().label("step_sizes")
+
+
+def cache_list_stmt(db: Session, summary: bool, filters: Iterable = (), after_id: Optional[int] = None, limit: int = 50):
+    """Newest-first page of cache rows; `summary` swaps the steps blob for step sizes."""
+    blob = step_sizes_column(db) if summary else ApplicationCache.steps
+    stmt = select(
+        ApplicationCache.id, ApplicationCache.session_id, ApplicationCache.user_id,
+        ApplicationCache.version, ApplicationCache.updated_at, blob
+    ).where(*filters)
+    # updated_at moves on every save, so pages are keyed on the immutable id
+    if after_id:
+        stmt = stmt.where(ApplicationCache.id < after_id)
+    return stmt.order_by(ApplicationCache.id.desc()).limit(limit)
+
+
+def cache_row(row, steps: Optional[dict] = None) -> dict:
+    entry = {
+        "id": row.id,
+        "session_id": row.session_id,
+        "user_id": row.user_id,
+        "version": row.version,
+        "updated_at": row.updated_at,
+    }
+    if hasattr(row, "step_sizes"):
+        entry["step_sizes"] = row.step_sizes or {}
+    else:
+        entry["steps"] = row.steps if steps is None else steps
+    return entry
+
+
+def created_count(versions: Dict[str, int]) -> int:
+    # A fresh row keeps version 1; an updated one is at least 2
+    return sum(1 for v in versions.values() if v == 1)
+
+
+class VersionConflict(Exception):
+    def __init__(self, current: int):
+        super().__init__(f"Step cache is at version {current}")
+        self.current = current
+
+
+def patch_step(db: Session, session_id: str, step_name: str, patch: List[dict], version: int) -> Optional[int]:
+    """
+    Apply an RFC 6902 JSON Patch to one step of a session, if it is still at `version`.
+
+    Only that step is read and written back, and the write is a compare-and-set
+    on the version, so a concurrent save makes this raise VersionConflict
+    instead of being overwritten. Returns the new version, or None if the
+    session doesn't exist. Invalid patches raise jsonpatch.JsonPatchException or
+    jsonpointer.JsonPointerException. The caller commits.
+    """
+    row = db.query(ApplicationCache.version, ApplicationCache.steps[step_name].label("step")) \
+        .filter(ApplicationCache.session_id == session_id).first()
+    if row is None:
+        return None
+    if row.version != version:
+        raise VersionConflict(row.version)
+
+    step = jsonpatch.apply_patch(row.step if row.step is not None else {}, patch)
+    updated = db.query(ApplicationCache).filter(
+        ApplicationCache.session_id == session_id, ApplicationCache.version == version
+    ).update({
+        "steps": _merged_steps(db, {step_name: step}),
+        "version": ApplicationCache.version + 1,
+        "updated_at": datetime.utcnow(),
+    }, synchronize_session=False)
+    if not updated:
+        current = db.query(ApplicationCache.version).filter(ApplicationCache.session_id == session_id).scalar()
+        raise VersionConflict(current)
+    return version + 1
+
+
+class StepWriteBuffer:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.writes = 0
+        self.flushes = 0
+        self.rows_flushed = 0
+        self._pending: Dict[str, StepDraft] = {}
+        # The batch a running flush is writing: still read through until it commits
+        self._in_flight: Dict[str, StepDraft] = {}
+        self._entries = 0
+        self._lock = threading.Lock()
+        # Serializes flushes so an older batch never lands after a newer one
+        self._flush_lock = threading.Lock()
+
+    def add(self, session_id: str, user_id: str, step_name: str, data: Dict[str, Any]):
+        with self._lock:
+            draft = self._pending.setdefault(session_id, StepDraft(session_id, user_id))
+            if step_name not in draft.steps:
+                self._entries += 1
+            draft.steps[step_name] = data
+            self.writes += 1
+            full = self._entries >= self.max_entries
+        if full:
+            self.flush()
+
+    def has_pending(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._pending or session_id in self._in_flight
+
+    def overlay(self, session_id: str, steps: Optional[dict]) -> dict:
+        """`steps` as stored, with this worker's unflushed steps for the session applied."""
+        with self._lock:
+            merged = dict(steps or {})
+            for drafts in (self._in_flight, self._pending):
+                if session_id in drafts:
+                    merged.update(drafts[session_id].steps)
+            return merged
+
+    def unflushed(self, exclude: Iterable[str] = ()) -> List[StepDraft]:
+        """Buffered sessions not in `exclude`, i.e. sessions with no row yet."""
+        exclude = set(exclude)
+        with self._lock:
+            merged: Dict[str, StepDraft] = {}
+            for drafts in (self._in_flight, self._pending):
+                for d in drafts.values():
+                    if d.session_id not in exclude:
+                        merged.setdefault(d.session_id, StepDraft(d.session_id, d.user_id)).steps.update(d.steps)
+            return list(merged.values())
+
+    def discard(self, session_ids: Iterable[str] = (), user_ids: Iterable[str] = ()) -> List[StepDraft]:
+        """
+        Drop buffered steps, e.g. for sessions whose cache rows are being
+        deleted, and return them so they can be restored should that fail.
+        """
+        session_ids, user_ids = set(session_ids), set(user_ids)
+        dropped = []
+        # Waiting out an in-flight flush keeps it from re-creating rows deleted after this
+        with self._flush_lock, self._lock:
+            for key, draft in list(self._pending.items()):
+                if key in session_ids or draft.user_id in user_ids:
+                    self._entries -= len(draft.steps)
+                    dropped.append(self._pending.pop(key))
+        return dropped
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                self._in_flight, self._pending = self._pending, {}
+                drafts = list(self._in_flight.values())
+                self._entries = 0
+            if not drafts:
+                return
+            try:
+                with SessionLocal() as db:
+                    versions = upsert_steps(db, drafts)
+                    stats_service.increment(db, PENDING, created_count(versions))
+                    db.commit()
+            except Exception:
+                logger.exception(f"Step flush of {len(drafts)} sessions failed, keeping them buffered")
+                self.restore(drafts)
+                with self._lock:
+                    self._in_flight = {}
+                return
+            with self._lock:
+                self._in_flight = {}
+            self.flushes += 1
+            self.rows_flushed += len(drafts)
+
+    def restore(self, drafts: List[StepDraft]):
+        """Put back drafts taken out by a flush or `discard` that failed."""
+        # Steps saved in the meantime are newer and win
+        with self._lock:
+            for old in drafts:
+                draft = self._pending.setdefault(old.session_id, StepDraft(old.session_id, old.user_id))
+                for step_name, data in old.steps.items():
+                    if step_name not in draft.steps:
+                        draft.steps[step_name] = data
+                        self._entries += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": settings.STEP_WRITE_BEHIND,
+                "pending_sessions": len(self._pending),
+                "pending_steps": self._entries,
+                "writes": self.writes,
+                "flushes": self.flushes,
+                "rows_flushed": self.rows_flushed,
+            }
+
+
+step_buffer = StepWriteBuffer(max_entries=settings.STEP_FLUSH_MAX_ENTRIES)
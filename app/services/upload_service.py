@@ -0,0 +1,142 @@
+"""
+Streaming ingest of uploaded documents to local storage.
+
+The upload is read in UPLOAD_CHUNK_BYTES chunks. In the same pass the size is
+checked against the cap, the type is sniffed from the leading bytes and the
+SHA-256 is computed. Chunks go to a temp file next to the destination through
+the threadpool, so the event loop never blocks on disk. Only a complete,
+valid file is fsynced and atomically renamed into place. A rejected or
+failed upload leaves nothing behind.
+"""
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import Iterable, Optional
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+from app.core.config import settings
+
+# Leading bytes of the accepted formats -> (canonical extension, mime type)
+SIGNATURES = [
+    (b"%PDF-", ("pdf", "application/pdf")),
+    (b"\x89PNG\r\n\x1a\n", ("png", "image/png")),
+    (b"\xff\xd8\xff", ("jpg", "image/jpeg")),
+]
+SNIFF_BYTES = max(len(magic) for magic, _ in SIGNATURES)
+EXTENSION_ALIASES = {"jpeg": "jpg"}
+MIME_TYPES = {ext: mime for _, (ext, mime) in SIGNATURES}
+
+
+def canonical_extension(file_name: Optional[str]) -> str:
+    ext = os.path.splitext(file_name or "")[1].lstrip(".").lower()
+    return EXTENSION_ALIASES.get(ext, ext)
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    size: int
+    sha256: Optional[str]
+    mime_type: str
+
+
+def sniff(head: bytes) -> Optional[tuple]:
+    for magic, kind in SIGNATURES:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def check_kind(head: bytes, claimed: str, allowed: set) -> tuple:
+    kind = sniff(head)
+    if kind is None or kind[0] not in allowed or kind[0] != claimed:
+        raise UploadRejected(400, "File content does not match a supported format")
+    return kind
+
+
+def _open_temp(directory: str):
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    return os.fdopen(fd, "wb"), path
+
+
+def _finish(handle, temp_path: str, dest_path: str):
+    handle.flush()
+    os.fsync(handle.fileno())
+    handle.close()
+    os.replace(temp_path, dest_path)
+
+
+def _discard(handle, temp_path: str):
+    handle.close()
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+async def ingest_upload(
+    upload: UploadFile, dest_path: str, extensions: Optional[Iterable[str]], max_bytes: Optional[int] = None
+) -> StoredUpload:
+    """
+    Stream `upload` to `dest_path`, accepting only the given extensions.
+
+    The sniffed type must agree with the file name's extension (jpg and jpeg
+    are the same type). With `extensions=None` any content is accepted under
+    the client's content type. Raises UploadRejected (413 when the file is over
+    `max_bytes`, 400 when its content isn't an accepted type).
+    """
+    max_bytes = settings.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    allowed = None if extensions is None else {EXTENSION_ALIASES.get(ext, ext) for ext in extensions}
+    claimed = canonical_extension(upload.filename)
+
+    limit = f"{max_bytes // (1024 * 1024)}MB" if max_bytes >= 1024 * 1024 else f"{max_bytes // 1024}KB"
+    too_large = UploadRejected(413, f"File too large (Max {limit})")
+    if upload.size is not None and upload.size > max_bytes:
+        raise too_large
+
+    handle, temp_path = await run_in_threadpool(_open_temp, os.path.dirname(dest_path) or ".")
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    kind = None if allowed is not None else (claimed, upload.content_type or "application/octet-stream")
+    try:
+        while True:
+            chunk = await upload.read(settings.UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large
+            if kind is None:
+                head = (head + chunk)[:SNIFF_BYTES]
+                if len(head) >= SNIFF_BYTES:
+                    kind = check_kind(head, claimed, allowed)
+            digest.update(chunk)
+            await run_in_threadpool(handle.write, chunk)
+        if kind is None:
+            # Files shorter than SNIFF_BYTES
+            kind = check_kind(head, claimed, allowed)
+        await run_in_threadpool(_finish, handle, temp_path, dest_path)
+    except BaseException:
+        # Also on cancellation, so not offloaded: closing and unlinking don't block for long
+        _discard(handle, temp_path)
+        raise
+    return StoredUpload(path=dest_path, size=size, sha256=digest.hexdigest(), mime_type=kind[1])
+
+
+def remove_file(path: Optional[str]):
+    # Best effort: a leftover file is harmless, a failed request is not
+    try:
+        if path and os.path.isfile(path):
+            os.remove(path)
+    except OSError:
+        pass
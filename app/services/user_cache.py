@@ -0,0 +1,71 @@
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Optional
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.models.all_models import User
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """
+    Read-only copy of the columns of a `User` row that authenticated endpoints need.
+
+    Snapshots built from token claims (AUTH_EMBED_USER_CLAIMS) only carry the
+    stable identity fields; the progress statuses are then None.
+    """
+    id: int
+    email: str
+    full_name: str
+    is_admin: bool = False
+    phone: Optional[str] = None
+    is_active: Optional[bool] = None
+    registration_status: Optional[str] = None
+    login_status: Optional[str] = None
+    payment_status: Optional[str] = None
+    application_status: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(**{f.name: getattr(user, f.name) for f in fields(cls)})
+
+    @classmethod
+    def from_claims(cls, user_id: int, claims: dict) -> "UserSnapshot":
+        return cls(id=user_id, email=claims["email"], full_name=claims["name"], is_admin=bool(claims.get("adm")))
+
+
+def user_claims(user: User) -> dict:
+    """Stable claims embedded in access tokens when AUTH_EMBED_USER_CLAIMS is on."""
+    return {"usr": {"email": user.email, "name": user.full_name, "adm": bool(user.is_admin)}}
+
+
+class UserCache:
+    """
+    Per-worker LRU/TTL cache of user snapshots keyed by user id.
+
+    Writers call `invalidate` after committing changes to a user row. Other
+    workers keep their copy until it expires, so USER_CACHE_TTL_SECONDS bounds
+    how stale a snapshot can be.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+    def get(self, user_id: int) -> Optional[UserSnapshot]:
+        return self._cache.get(user_id)
+
+    def put(self, user: User) -> UserSnapshot:
+        snapshot = UserSnapshot.from_user(user)
+        self._cache.set(user.id, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id: Optional[int]):
+        if user_id is not None:
+            self._cache.pop(user_id)
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+user_cache = UserCache()
@@ -0,0 +1,74 @@
+"""
+CPU cost of rendering one admin listing page: FastAPI's default path
+(`jsonable_encoder` + `JSONResponse`) against `fast_json`.
+
+    python -m benchmarks.serialization [--rows 10000] [--repeat 20]
+
+Rows have the shape `GET /api/admin/applications` returns. No database or
+server is needed; only the serialization step is timed, with process CPU time.
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.core import responses
+from app.core.responses import fast_json
+from app.models.all_models import ApplicationStatus
+
+CAMPUSES = ["Visakhapatnam", "Guntur", "Hyderabad"]
+STATUSES = list(ApplicationStatus)
+
+
+def listing_rows(count: int) -> list:
+    start = datetime(2026, 1, 1, 9, 30)
+    return [{
+        "id": i,
+        "user_email": f"applicant{i}@example.com",
+        "campus": CAMPUSES[i % len(CAMPUSES)],
+        "department": "Computer Science and Engineering",
+        "category": ["OC", "OBC", "SC", "ST"][i % 4],
+        "gender": "Female" if i % 2 else "Male",
+        "ug_percentage": 60 + (i % 400) / 10,
+        "exam_slot": f"2026-11-{1 + i % 28:02d} AM",
+        "status": STATUSES[i % len(STATUSES)],
+        "updated_at": start + timedelta(seconds=37 * i, microseconds=i),
+    } for i in range(count)]
+
+
+def cpu_ms(render, repeat: int) -> float:
+    render()  # warm up
+    started = time.process_time()
+    for _ in range(repeat):
+        render()
+    return (time.process_time() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rows = listing_rows(args.rows)
+    default_body = JSONResponse(jsonable_encoder(rows)).body
+    fast_body = fast_json(rows).body
+    assert json.loads(default_body) == json.loads(fast_body), "renderers disagree"
+
+    default_ms = cpu_ms(lambda: JSONResponse(jsonable_encoder(rows)), args.repeat)
+    fast_ms = cpu_ms(lambda: fast_json(rows), args.repeat)
+
+    encoder = "orjson" if responses.orjson is not None else "stdlib json"
+    print(f"{args.rows} rows, {len(fast_body) / 1024:.0f} KiB, averaged over {args.repeat} renders")
+    print(f"  jsonable_encoder + JSONResponse: {default_ms:8.2f} ms CPU/request")
+    print(f"  fast_json ({encoder}):{' ' * max(1, 18 - len(encoder))}{fast_ms:8.2f} ms CPU/request")
+    print(f"  saved:                           {default_ms - fast_ms:8.2f} ms CPU/request ({default_ms / fast_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+The tests run against a throwaway SQLite database by default. Set
+TEST_DATABASE_URL to a scratch PostgreSQL database to run them there instead;
+its tables are dropped and recreated.
+"""
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="vignan-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or f"sqlite:///{_scratch}/test.db"
+os.environ["UPLOAD_DIR"] = os.path.join(_scratch, "uploads")
+os.environ.setdefault("PAYU_MERCHANT_KEY", "test")
+os.environ.setdefault("PAYU_MERCHANT_SALT", "test")
+# S3 is exercised against moto's in-process mock; nothing here reaches AWS
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_S3_BUCKET", "test-documents")
+
+import itertools
+import pytest
+from fastapi.testclient import TestClient
+from app.api.deps import ADMIN_SUBJECT
+from app.core.security import create_access_token
+from app.db.migrations import run_migrations
+from app.db.session import Base, SessionLocal, engine
+from app.main import app
+from app.models.all_models import User
+
+_numbers = itertools.count(1)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@pytest.fixture(scope="session")
+def client(schema):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_user(db):
+    """Creates an applicant; returns (user, bearer headers)."""
+    def make(paid: bool = False):
+        n = next(_numbers)
+        user = User(
+            full_name=f"Applicant {n}", email=f"applicant{n}@example.com", phone=f"9{n:09d}",
+            payment_status="success" if paid else "pending",
+        )
+        db.add(user)
+        db.commit()
+        return user, {"Authorization": f"Bearer {create_access_token(user.id)}"}
+    return make
+
+
+@pytest.fixture
+def admin_headers():
+    return {"Authorization": f"Bearer {create_access_token(ADMIN_SUBJECT)}"}
@@ -0,0 +1,28 @@
+import pytest
+
+ADMIN_ENDPOINTS = [
+    ("get", "/api/admin/email-queue"),
+    ("post", "/api/admin/applications-pending/compact"),
+    ("get", "/api/admin/blobs"),
+    ("post", "/api/admin/blobs/gc"),
+    ("get", "/api/admin/export"),
+    ("get", "/api/admin/documents/0/download"),
+]
+
+
+@pytest.mark.parametrize("method,path", ADMIN_ENDPOINTS)
+def test_admin_endpoints_require_a_token(client, method, path):
+    assert client.request(method, path).status_code == 401
+
+
+@pytest.mark.parametrize("method,path", ADMIN_ENDPOINTS)
+def test_admin_endpoints_reject_applicant_tokens(client, make_user, method, path):
+    _, headers = make_user()
+    assert client.request(method, path, headers=headers).status_code == 403
+
+
+@pytest.mark.parametrize("method,path", ADMIN_ENDPOINTS)
+def test_admin_endpoints_accept_the_admin_token(client, admin_headers, method, path):
+    response = client.request(method, path, headers=admin_headers)
+    # The download of a missing document still gets past authorization
+    assert response.status_code == (404 if path.endswith("/download") else 200)
@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import boto3
+import pytest
+from moto import mock_aws
+from app.core.config import settings
+from app.db.session import AsyncSessionLocal, async_engine
+from app.models.all_models import Blob, User
+from app.services.blob_store import BACKENDS, blob_service
+from app.services.document_service import record_document
+from app.services.s3_service import s3_service
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    with mock_aws():
+        client = boto3.client("s3", region_name=settings.AWS_S3_REGION)
+        client.create_bucket(Bucket=settings.AWS_S3_BUCKET)
+        monkeypatch.setattr(s3_service, "s3_client", client)
+        yield client
+
+
+def _s3_blob(db, s3, content: bytes) -> str:
+    digest = hashlib.sha256(content).hexdigest()
+    backend = BACKENDS["s3"]
+    s3.put_object(Bucket=settings.AWS_S3_BUCKET, Key=backend.key(digest), Body=content)
+    blob_service._record(db, "s3", digest, len(content), "application/pdf")
+    db.commit()
+    return digest
+
+
+async def _record(user_id: int, *digests: str):
+    # Pooled connections may belong to the test client's event loop; start a fresh pool
+    await async_engine.dispose(close=False)
+    try:
+        for digest in digests:
+            async with AsyncSessionLocal() as session:
+                await record_document(
+                    session, user_id, "ssc", "ssc.pdf", BACKENDS["s3"].location(digest), 4, "application/pdf", digest
+                )
+    finally:
+        await async_engine.dispose()
+
+
+def test_is_blob_recognizes_both_stores():
+    digest = "ab" * 32
+    assert blob_service.is_blob(BACKENDS["local"].location(digest))
+    assert blob_service.is_blob(BACKENDS["s3"].location(digest))
+    assert not blob_service.is_blob(s3_service.object_url("documents/1/ssc.pdf"))
+    assert not blob_service.is_blob(None)
+
+
+def test_replacing_an_s3_blob_document_keeps_the_shared_object(db, s3):
+    user = User(full_name="Blob Owner", email="blob-owner@example.com", phone="9876500000")
+    db.add(user)
+    db.commit()
+    first = _s3_blob(db, s3, b"first")
+    second = _s3_blob(db, s3, b"second")
+
+    asyncio.run(_record(user.id, first, second))
+
+    # Other documents may share the first blob; only blob GC may delete it
+    assert s3_service.head(BACKENDS["s3"].key(first)) is not None
+    assert db.query(Blob).filter(Blob.sha256 == first).count() == 1
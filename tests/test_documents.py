@@ -0,0 +1,70 @@
+import os
+from app.core.config import settings
+from app.models.all_models import Document
+
+PDF = b"%PDF-1.4\n%test document\n%%EOF\n"
+
+
+def _legacy_file(user_id, name):
+    directory = os.path.join(settings.UPLOAD_DIR, str(user_id))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(PDF)
+    return path
+
+
+def _document(db, user, document_type, path):
+    db.add(Document(user_id=user.id, document_type=document_type, file_name=os.path.basename(path), file_path=path))
+    db.commit()
+
+
+def _upload(client, headers, document_type):
+    return client.post(
+        "/api/student/internal/upload_document", params={"document_type": document_type},
+        files={"file": ("marksheet.pdf", PDF, "application/pdf")}, headers=headers,
+    )
+
+
+def test_replacing_a_document_removes_the_users_old_file(client, db, make_user):
+    user, headers = make_user()
+    old = _legacy_file(user.id, "old-marksheet.pdf")
+    _document(db, user, "marksheet", old)
+
+    response = _upload(client, headers, "marksheet")
+
+    assert response.status_code == 200
+    assert not os.path.exists(old)
+    db.expire_all()
+    [doc] = db.query(Document).filter(Document.user_id == user.id).all()
+    assert doc.id == response.json()["id"] and doc.file_path != old
+
+
+def test_replacing_a_document_keeps_files_that_are_not_the_users(client, db, make_user):
+    owner, _ = make_user()
+    user, headers = make_user()
+    foreign = _legacy_file(owner.id, "owners-marksheet.pdf")
+    _document(db, user, "marksheet", foreign)
+
+    assert _upload(client, headers, "marksheet").status_code == 200
+    assert os.path.exists(foreign)
+
+
+def test_submit_ignores_document_paths_outside_the_users_uploads(client, db, make_user):
+    owner, _ = make_user()
+    user, _ = make_user(paid=True)
+    foreign = _legacy_file(owner.id, "owners-photo.pdf")
+    own = _legacy_file(user.id, "photo.pdf")
+
+    response = client.post("/api/application/submit", json={
+        "email": user.email, "phone": user.phone,
+        "documents": {"files": {
+            "photo": {"name": "photo.pdf", "path": own},
+            "signature": {"name": "signature.pdf", "path": foreign},
+            "passwd": {"name": "passwd", "path": "/etc/passwd"},
+        }},
+    })
+
+    assert response.status_code == 200
+    recorded = {doc.document_type: doc.file_path for doc in db.query(Document).filter(Document.user_id == user.id)}
+    assert recorded == {"photo": own}
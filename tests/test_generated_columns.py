@@ -0,0 +1,32 @@
+from app.models.all_models import Application, User
+
+
+def _application(db, email: str, **sections) -> Application:
+    user = User(full_name="Test Applicant", email=email, phone="9876543210")
+    db.add(user)
+    db.flush()
+    application = Application(user_id=user.id, **sections)
+    db.add(application)
+    db.commit()
+    db.refresh(application)
+    return application
+
+
+def test_generated_filter_columns_read_both_shapes(db):
+    nested = _application(db, "nested@example.com", personal_details={"personal": {"category": "OBC", "gender": "F"}})
+    flat = _application(db, "flat@example.com", personal_details={"category": "SC"}, research_details={"exam_slot": "A"})
+
+    assert (nested.category, nested.gender, nested.exam_slot) == ("OBC", "F", None)
+    assert (flat.category, flat.exam_slot) == ("SC", "A")
+
+
+def test_over_long_values_are_cut_to_the_column_size(db):
+    application = _application(
+        db, "long@example.com",
+        personal_details={"personal": {"category": "é" * 80, "gender": "g" * 300}},
+        research_details={"examSchedule": {"slot": "s" * 5000}},
+    )
+
+    assert application.category == "é" * 50
+    assert application.gender == "g" * 20
+    assert application.exam_slot == "s" * 100
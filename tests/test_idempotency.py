@@ -0,0 +1,42 @@
+import uuid
+from app.models.all_models import Payment
+
+
+def _init(client, key, email, amount=1500.0):
+    return client.post(
+        "/api/payu/init", json={"amount": amount, "productinfo": "Application fee", "email": email},
+        headers={"Idempotency-Key": key},
+    )
+
+
+def test_retried_payment_init_replays_the_first_response(client, db, make_user):
+    user, _ = make_user()
+    key = uuid.uuid4().hex
+
+    first = _init(client, key, user.email)
+    retry = _init(client, key, user.email)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.json()["txnid"] == first.json()["txnid"]
+    assert db.query(Payment).filter(Payment.user_id == user.id).count() == 1
+
+
+def test_reusing_a_key_with_another_body_is_rejected(client, make_user):
+    user, _ = make_user()
+    key = uuid.uuid4().hex
+
+    assert _init(client, key, user.email).status_code == 200
+    assert _init(client, key, user.email, amount=1.0).status_code == 422
+
+
+def test_requests_without_a_key_run_every_time(client, db, make_user):
+    user, _ = make_user()
+    body = {"amount": 1500.0, "productinfo": "Application fee", "email": user.email}
+
+    first = client.post("/api/payu/init", json=body)
+    second = client.post("/api/payu/init", json=body)
+
+    assert first.json()["txnid"] != second.json()["txnid"]
+    assert db.query(Payment).filter(Payment.user_id == user.id).count() == 2
@@ -0,0 +1,82 @@
+import hashlib
+import pytest
+from app.models.all_models import Document
+
+PDF = b"%PDF-1.4\n" + b"%" + b"x" * 4000 + b"\n%%EOF\n"
+CHUNK = {"Content-Type": "application/offset+octet-stream"}
+
+
+@pytest.fixture
+def upload(client, make_user):
+    user, headers = make_user()
+    response = client.post("/api/student/internal/uploads", json={
+        "document_type": "marksheet", "file_name": "marksheet.pdf", "size": len(PDF),
+    }, headers=headers)
+    assert response.status_code == 201
+    return user, headers, response.json()["url"]
+
+
+def _append(client, headers, url, offset, body):
+    return client.patch(url, content=body, headers={**headers, **CHUNK, "Upload-Offset": str(offset)})
+
+
+def _offset(client, headers, url):
+    return int(client.head(url, headers=headers).headers["Upload-Offset"])
+
+
+def test_chunks_resume_from_the_reported_offset(client, db, upload):
+    user, headers, url = upload
+    assert _offset(client, headers, url) == 0
+
+    first = _append(client, headers, url, 0, PDF[:1000])
+    assert first.status_code == 204 and first.headers["Upload-Offset"] == "1000"
+    assert _offset(client, headers, url) == 1000
+
+    assert _append(client, headers, url, 1000, PDF[1000:]).status_code == 204
+    response = client.post(f"{url}/complete", headers=headers)
+
+    assert response.status_code == 200
+    doc = db.get(Document, response.json()["id"])
+    assert doc.user_id == user.id and doc.file_size == len(PDF)
+    assert doc.content_hash == hashlib.sha256(PDF).hexdigest()
+
+
+def test_chunk_at_the_wrong_offset_conflicts_and_keeps_the_offset(client, upload):
+    _, headers, url = upload
+    _append(client, headers, url, 0, PDF[:1000])
+
+    assert _append(client, headers, url, 0, PDF[:1000]).status_code == 409
+    assert _append(client, headers, url, 2000, PDF[2000:3000]).status_code == 409
+    assert _offset(client, headers, url) == 1000
+
+
+def test_chunk_past_the_declared_length_is_rejected(client, upload):
+    _, headers, url = upload
+
+    assert _append(client, headers, url, 0, PDF + b"trailing").status_code == 413
+
+
+def test_chunk_needs_the_offset_content_type(client, upload):
+    _, headers, url = upload
+
+    response = client.patch(url, content=PDF, headers={**headers, "Upload-Offset": "0"})
+
+    assert response.status_code == 415
+
+
+def test_incomplete_upload_cannot_be_completed(client, upload):
+    _, headers, url = upload
+    _append(client, headers, url, 0, PDF[:1000])
+
+    assert client.post(f"{url}/complete", headers=headers).status_code == 409
+    # The failed completion released the upload, so it can still be finished
+    assert _append(client, headers, url, 1000, PDF[1000:]).status_code == 204
+    assert client.post(f"{url}/complete", headers=headers).status_code == 200
+
+
+def test_uploads_belong_to_their_applicant(client, make_user, upload):
+    _, _, url = upload
+    _, other = make_user()
+
+    assert client.head(url, headers=other).status_code == 404
+    assert _append(client, other, url, 0, PDF).status_code == 404
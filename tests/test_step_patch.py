@@ -0,0 +1,60 @@
+import json
+import uuid
+
+PATCH_TYPE = {"Content-Type": "application/json-patch+json"}
+
+
+def _save(client, session_id, step, data):
+    return client.post(f"/api/step/{step}/", json={
+        "session_id": session_id, "user_id": "applicant", "step": step, "data": data,
+    })
+
+
+def _patch(client, session_id, step, ops, if_match=None):
+    headers = dict(PATCH_TYPE, **({"If-Match": if_match} if if_match else {}))
+    return client.patch(
+        f"/api/step/{step}/", params={"session_id": session_id}, content=json.dumps(ops), headers=headers
+    )
+
+
+def test_patch_with_the_current_etag_applies_and_moves_the_version(client):
+    session_id = uuid.uuid4().hex
+    etag = _save(client, session_id, "personal", {"name": "Asha", "city": "Pune"}).headers["ETag"]
+
+    response = _patch(client, session_id, "personal", [{"op": "replace", "path": "/city", "value": "Nagpur"}], etag)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    cache = client.get(f"/api/step/cache/{session_id}/")
+    assert cache.headers["ETag"] == response.headers["ETag"]
+    assert cache.json()["steps"]["personal"] == {"name": "Asha", "city": "Nagpur"}
+
+
+def test_patch_with_a_stale_etag_conflicts_and_reports_the_current_one(client):
+    session_id = uuid.uuid4().hex
+    stale = _save(client, session_id, "personal", {"name": "Asha"}).headers["ETag"]
+    current = _save(client, session_id, "address", {"pin": "411001"}).headers["ETag"]
+
+    response = _patch(client, session_id, "personal", [{"op": "add", "path": "/city", "value": "Pune"}], stale)
+
+    assert response.status_code == 409
+    assert response.headers["ETag"] == current
+    assert client.get(f"/api/step/cache/{session_id}/").json()["steps"]["personal"] == {"name": "Asha"}
+
+
+def test_patch_without_if_match_is_refused(client):
+    session_id = uuid.uuid4().hex
+    _save(client, session_id, "personal", {"name": "Asha"})
+
+    response = _patch(client, session_id, "personal", [{"op": "add", "path": "/city", "value": "Pune"}])
+
+    assert response.status_code == 428
+
+
+def test_unchanged_cache_answers_not_modified(client):
+    session_id = uuid.uuid4().hex
+    etag = _save(client, session_id, "personal", {"name": "Asha"}).headers["ETag"]
+
+    response = client.get(f"/api/step/cache/{session_id}/", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304